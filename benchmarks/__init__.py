@@ -0,0 +1,38 @@
+"""
+Offline benchmarks for PyCor's hot paths, run via `python -m benchmarks`.
+
+Everything runs against synthetic correctors, student files and student folders in a
+temporary directory, neither Excel nor a mail server is required.
+"""
+
+import runpy
+import sys
+import types
+from pathlib import Path
+
+
+def install_config(work_dir: Path, **overrides) -> types.ModuleType:
+    """
+    Registers `pycor.config` based on config.example.py before pycor is imported.
+    The benchmarks never touch a production config.py.
+
+    :param work_dir: Folder containing the synthetic subject groups
+    :param overrides: Config values replacing the example values
+    """
+    example = Path(__file__).parent.parent / "pycor" / "config.example.py"
+    module = types.ModuleType("pycor.config")
+    module.__dict__.update(
+        {k: v for k, v in runpy.run_path(str(example)).items() if k.isupper()}
+    )
+    module.__dict__.update(
+        {
+            "FOLDERS": [str(work_dir / "group")],
+            "DISABLE_OUTGOING_MAIL": True,
+            "HEALTHCHECK_PING": None,
+            "SENTRY_DSN": None,
+            "MAIL_FORWARDS": {},
+        }
+    )
+    module.__dict__.update(overrides)
+    sys.modules["pycor.config"] = module
+    return module
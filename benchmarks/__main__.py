@@ -0,0 +1,243 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+from benchmarks import install_config, synthetic
+
+
+def percentile(values: typing.List[float], perc: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(perc / 100 * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.results: typing.List[dict] = []
+
+    def measure(
+        self,
+        name: str,
+        func: typing.Callable[[typing.Any], typing.Any],
+        items: typing.Iterable[typing.Any],
+        unit: str = "op",
+    ) -> typing.List[typing.Any]:
+        """
+        Calls func once per item and records throughput and latency percentiles
+        """
+        latencies = []
+        ret = []
+        begin = time.perf_counter()
+        for item in items:
+            start = time.perf_counter()
+            ret.append(func(item))
+            latencies.append(time.perf_counter() - start)
+        total = time.perf_counter() - begin
+
+        self.results.append(
+            {
+                "name": name,
+                "unit": unit,
+                "count": len(latencies),
+                "total_s": round(total, 6),
+                "throughput_per_s": round(len(latencies) / total, 3) if total else None,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+            }
+        )
+        print(
+            f"{name:<32} n={len(latencies):<6} p50={self.results[-1]['p50_ms']:.3f}ms "
+            f"p95={self.results[-1]['p95_ms']:.3f}ms",
+            file=sys.stderr,
+        )
+        return ret
+
+
+def run(args, work_dir: Path) -> dict:
+    rnd = random.Random(args.seed)
+    install_config(work_dir)
+
+    # Logs and state.json end up in the working directory
+    os.chdir(work_dir)
+    import pycor
+    from pycor import excel, post
+
+    sys.excepthook = sys.__excepthook__
+    logging.getLogger("PyCor").setLevel(args.log_level)
+
+    print("Generating synthetic data", file=sys.stderr)
+    layout, corrector_file, student_files = synthetic.generate_subject(
+        rnd,
+        work_dir,
+        "bench_1",
+        args.students,
+        args.exercises,
+        args.max_parts,
+        args.string_ratio,
+    )
+
+    recorder = Recorder()
+
+    # region Parsing
+    students = recorder.measure(
+        "student_parse",
+        lambda path: excel.Student(path, layout.dummy_count),
+        student_files,
+        unit="file",
+    )
+
+    def exercise_rows(item):
+        commons, ws, is_student = item
+        commons.set_exercise_rows(ws, is_student=is_student)
+
+    corrector_commons = excel.Commons(corrector_file)
+    corrector_wb = excel.load_workbook(corrector_file)
+    recorder.measure(
+        "set_exercise_rows_corrector",
+        exercise_rows,
+        [(corrector_commons, corrector_wb.worksheets[0], False)] * args.repeat,
+        unit="sheet",
+    )
+    corrector_wb.close()
+
+    student_commons = excel.Commons(student_files[0])
+    student_wb = excel.load_workbook(student_files[0])
+    recorder.measure(
+        "set_exercise_rows_student",
+        exercise_rows,
+        [(student_commons, student_wb.worksheets[0], True)] * args.repeat,
+        unit="sheet",
+    )
+    student_wb.close()
+    # endregion
+
+    # region Comparison
+    real_solutions = [
+        synthetic.solutions(layout, student.mat_num, student.dummies)
+        for student in students
+    ]
+
+    def compare_submission(item):
+        student, solutions = item
+        correct = 0
+        for student_solution, corrector_solution in zip(student.solutions, solutions):
+            for partial, solution in zip(student_solution, corrector_solution):
+                correct += pycor.compare(
+                    partial,
+                    solution["value"],
+                    solution["tolerance_rel"],
+                    solution["tolerance_abs"],
+                )
+        return correct
+
+    recorder.measure(
+        "compare_submission",
+        compare_submission,
+        list(zip(students, real_solutions)),
+        unit="submission",
+    )
+    # endregion
+
+    # region Stats
+    exercises = range(len(layout.exercises))
+    recorder.measure(
+        "get_stats",
+        lambda student: [
+            student.get_stats(ex, layout.max_attempts) for ex in exercises
+        ],
+        students,
+        unit="submission",
+    )
+
+    def update_stats(student: excel.Student):
+        for ex in exercises:
+            student.update_stats(ex, rnd.choice([0, 50, 100]), layout.max_attempts)
+        student.save_record()
+
+    recorder.measure("update_stats", update_stats, students, unit="submission")
+    # endregion
+
+    # region Post processing
+    post_processing = post.PostProcessing(corrector_file.parent, len(layout.exercises))
+    for step in [
+        "generate_attempt_info",
+        "check_mat_num",
+        "generate_bars",
+        "generate_histograms",
+        "render_charts",
+    ]:
+        recorder.measure(
+            f"post_{step}", lambda s: getattr(post_processing, s)(), [step], "step"
+        )
+
+    # Second run without any changes
+    post_processing = post.PostProcessing(corrector_file.parent, len(layout.exercises))
+    recorder.measure("post_run_unchanged", lambda _: post_processing.run(), [None])
+    # endregion
+
+    return {
+        "parameters": {
+            "students": args.students,
+            "exercises": args.exercises,
+            "max_parts": args.max_parts,
+            "string_ratio": args.string_ratio,
+            "seed": args.seed,
+        },
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpus": os.cpu_count(),
+        },
+        "results": recorder.results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="PyCor - Offline benchmarks on synthetic data",
+    )
+    parser.add_argument("-n", "--students", type=int, default=200)
+    parser.add_argument("-e", "--exercises", type=int, default=8)
+    parser.add_argument("--max-parts", type=int, default=4)
+    parser.add_argument(
+        "--string-ratio",
+        type=float,
+        default=0.1,
+        help="Share of sub exercises with string answers",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="Repetitions of single-sheet benchmarks"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("-o", "--output", type=Path, help="Write JSON results to file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the generated working directory"
+    )
+
+    args = parser.parse_args()
+    cwd = Path.cwd()
+    work_dir = Path(tempfile.mkdtemp(prefix="pycor-bench-"))
+    try:
+        report = run(args, work_dir)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Kept working directory {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
@@ -0,0 +1,390 @@
+"""
+End-to-end load harness, run via `python -m benchmarks.load`.
+
+Seeds local IMAP/SMTP stand-ins with generated submission mails and runs
+:func:`pycor.main` against them with a deterministic solution backend in place of Excel.
+"""
+
+import argparse
+import collections
+import email.mime.application
+import email.mime.multipart
+import email.mime.text
+import functools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import typing
+from email.utils import formatdate
+from pathlib import Path
+
+from benchmarks import install_config, servers, synthetic
+
+
+class FakeCell:
+    def __init__(self, sheet: "FakeSheet", row: int, column: int):
+        self.sheet = sheet
+        self.row = row
+        self.column = column
+
+    @property
+    def Value(self):
+        return self.sheet.value(self.row, self.column)
+
+
+class FakeRange:
+    def __init__(self, sheet: "FakeSheet", target: str):
+        self.sheet = sheet
+        self.target = target
+
+    @property
+    def Value(self):
+        return None
+
+    @Value.setter
+    def Value(self, value):
+        if self.target == "B10":
+            self.sheet.mat_num = int(value)
+        else:
+            self.sheet.dummies = list(value)
+
+
+class FakeSheet:
+    """
+    Worksheet of a synthetic corrector, column C is computed like Excel would
+    """
+
+    def __init__(self, layout: synthetic.Layout):
+        self.layout = layout
+        self.rows = {row: (ex, part, kind) for row, ex, part, kind in layout.rows()}
+        self.mat_num = 0
+        self.dummies: typing.List[typing.Any] = []
+
+    def Range(self, first, last=None):
+        return FakeRange(self, first if isinstance(first, str) else "dummies")
+
+    def Cells(self, row: int, column: int):
+        return FakeCell(self, row, column)
+
+    def value(self, row: int, column: int):
+        if row not in self.rows:
+            return None
+        ex, part, kind = self.rows[row]
+        if column == 2:
+            return f"x{ex + 1}_{part + 1}"
+        elif column == 3:
+            return synthetic.solution_value(self.mat_num, self.dummies, ex, part, kind)
+        elif column == 4:
+            return None if kind == "str" else 1.0
+        elif column == 5:
+            return None if kind == "str" else 0.001
+        return None
+
+
+class FakeWorkbook:
+    def __init__(self, layout: synthetic.Layout):
+        self.sheet = FakeSheet(layout)
+
+    def Worksheets(self, index: int):
+        return self.sheet
+
+    def Close(self, SaveChanges=False):
+        pass
+
+
+class FakeExcel:
+    """
+    Stands in for the COM object returned by :func:`pycor.excel.setup_excel`
+    """
+
+    def __init__(self, layouts: typing.Dict[Path, synthetic.Layout]):
+        self.layouts = layouts
+        self.Workbooks = self
+        self.Application = self
+
+    def Open(self, path, *args):
+        return FakeWorkbook(self.layouts[Path(path).resolve()])
+
+    def Quit(self):
+        pass
+
+
+class Stages:
+    """
+    Inclusive wall-clock time per wrapped function
+    """
+
+    def __init__(self):
+        self.totals: typing.Dict[str, float] = collections.defaultdict(float)
+        self.counts: typing.Counter[str] = collections.Counter()
+
+    def wrap(self, owner, attr: str, stage: str):
+        original = getattr(owner, attr)
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.totals[stage] += time.perf_counter() - start
+                self.counts[stage] += 1
+
+        setattr(owner, attr, wrapper)
+
+    def report(self) -> dict:
+        return {
+            stage: {"total_s": round(total, 4), "calls": self.counts[stage]}
+            for stage, total in sorted(self.totals.items())
+        }
+
+
+def submission_mail(
+    sender: str, attachment_name: str, payload: typing.Optional[bytes], subject: str
+) -> bytes:
+    msg = email.mime.multipart.MIMEMultipart("mixed")
+    msg["From"] = sender
+    msg["To"] = "pycor@fh-aachen.de"
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg.attach(email.mime.text.MIMEText("Abgabe", "plain", "utf-8"))
+    if payload is not None:
+        part = email.mime.application.MIMEApplication(
+            payload,
+            "vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+        part.add_header("Content-Disposition", "attachment", filename=attachment_name)
+        msg.attach(part)
+    return msg.as_bytes()
+
+
+def seed_inbox(
+    rnd: random.Random,
+    store: servers.Store,
+    attachments: typing.Dict[str, typing.List[bytes]],
+    mails: int,
+    students: int,
+    noise: float,
+) -> typing.Counter[str]:
+    """
+    Seeds the inbox with submissions, a share of noise mails is invalid in various ways
+    """
+    kinds: typing.Counter[str] = collections.Counter()
+    codenames = list(attachments)
+    inbox = store.mailboxes["INBOX"]
+    for _ in range(mails):
+        student = f"student{rnd.randrange(students):05d}@fh-aachen.de"
+        codename = rnd.choice(codenames)
+        payload: typing.Optional[bytes] = rnd.choice(attachments[codename])
+        name = f"{codename}.xlsx"
+        subject = "Abgabe"
+
+        kind = "submission"
+        if rnd.random() < noise:
+            kind = rnd.choice(["wrong_domain", "no_attachment", "unknown", "problem"])
+            if kind == "wrong_domain":
+                student = student.replace("fh-aachen.de", "example.com")
+            elif kind == "no_attachment":
+                payload = None
+            elif kind == "unknown":
+                name = "unknown_module.xlsx"
+            else:
+                subject = "Problem mit der Abgabe"
+        kinds[kind] += 1
+        inbox.append(submission_mail(student, name, payload, subject))
+    return kinds
+
+
+def run(args, work_dir: Path) -> dict:
+    rnd = random.Random(args.seed)
+
+    imap_store, smtp_store = servers.Store(), servers.Store()
+    imap_server = servers.IMAPServer(imap_store)
+    smtp_server = servers.SMTPServer(smtp_store, latency=args.smtp_latency)
+    servers.serve(imap_server)
+    servers.serve(smtp_server)
+
+    install_config(
+        work_dir,
+        MAIL_USER="pycor@fh-aachen.de",
+        MAIL_FROM="pycor@fh-aachen.de",
+        MAIL_IMAP="127.0.0.1",
+        MAIL_IMAP_PORT=imap_server.server_address[1],
+        MAIL_IMAP_SSL=False,
+        MAIL_SMTP="127.0.0.1",
+        MAIL_SMTP_PORT=smtp_server.server_address[1],
+        MAIL_SMTP_STARTTLS=False,
+        ADMIN_CONTACT="admin@fh-aachen.de",
+        DISABLE_OUTGOING_MAIL=False,
+        MARK_MAILS_AS_READ=True,
+        MAIL_SMTP_RATE=args.smtp_rate,
+        MAIL_SMTP_CONNECTIONS=args.smtp_connections,
+        MAX_SUBMISSIONS_PER_CYCLE=args.batch,
+        CACHE_SOLUTIONS=args.cache_solutions,
+    )
+
+    os.chdir(work_dir)
+    import pycor
+    from pycor import excel, mail, metrics, post, sessions, utils
+
+    sys.excepthook = sys.__excepthook__
+    logging.getLogger("PyCor").setLevel(args.log_level)
+    # stdout is reserved for the JSON report
+    for handler in utils.LISTENER.handlers if utils.LISTENER else ():
+        if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+            handler.setStream(sys.stderr)
+
+    # region Synthetic subjects and inbox
+    print("Generating synthetic data", file=sys.stderr)
+    layouts: typing.Dict[Path, synthetic.Layout] = {}
+    attachments: typing.Dict[str, typing.List[bytes]] = {}
+    for idx in range(args.correctors):
+        layout, corrector, _ = synthetic.generate_subject(
+            rnd, work_dir, f"load_{idx + 1}", 0, args.exercises
+        )
+        layouts[corrector.resolve()] = layout
+
+        pool = work_dir / "attachments" / layout.codename
+        attachments[layout.codename] = [
+            synthetic.write_student_file(
+                rnd, layout, pool / f"{n}.xlsx", 3000000 + n
+            ).read_bytes()
+            for n in range(args.attachment_pool)
+        ]
+    kinds = seed_inbox(
+        rnd, imap_store, attachments, args.mails, args.students, args.noise
+    )
+    # endregion
+
+    excel.setup_excel = lambda: FakeExcel(layouts)
+
+    stages = Stages()
+    stages.wrap(pycor, "find_valid_filenames", "discovery")
+    stages.wrap(sessions.ImapSession, "connect", "imap_login")
+    stages.wrap(sessions.SmtpSession, "connect", "smtp_login")
+    stages.wrap(mail.Mail, "forward_mails", "forward_mails")
+    stages.wrap(mail.Mail, "check_inbox", "check_inbox")
+    stages.wrap(mail.Mail, "download_attachment", "download_attachment")
+    stages.wrap(mail.Mail, "send", "send")
+    stages.wrap(excel.Corrector, "generate_solutions", "generate_solutions")
+    stages.wrap(post.PostProcessing, "run", "post_processing")
+
+    print(f"Running PyCor against {args.mails} mails", file=sys.stderr)
+    cycles = []
+    begin = time.perf_counter()
+    for cycle in range(args.cycles):
+        start = time.perf_counter()
+        pycor.main()
+        cycles.append(round(time.perf_counter() - start, 4))
+        if imap_store.unseen() == 0:
+            break
+    total = time.perf_counter() - begin
+
+    # Timed by PyCor itself, files may be parsed in worker processes
+    for stage in ("student_parse", "journal", "stats_io"):
+        calls, seconds = metrics.METRICS.stages.get(stage, (0, 0.0))
+        stages.totals[stage] += seconds
+        stages.counts[stage] += int(calls)
+
+    sessions.close_all()
+    imap_server.shutdown()
+    smtp_server.shutdown()
+
+    return {
+        "parameters": {
+            "mails": args.mails,
+            "students": args.students,
+            "correctors": args.correctors,
+            "exercises": args.exercises,
+            "noise": args.noise,
+            "smtp_latency": args.smtp_latency,
+            "seed": args.seed,
+        },
+        "seeded": dict(kinds),
+        "total_s": round(total, 4),
+        "throughput_mails_per_s": round(args.mails / total, 3),
+        "cycles_s": cycles,
+        "stages": stages.report(),
+        "metrics": metrics.METRICS.prometheus().splitlines(),
+        "imap": {
+            "connections": imap_store.connections,
+            "round_trips": sum(imap_store.commands.values()),
+            "commands": dict(imap_store.commands),
+            "unseen_left": imap_store.unseen(),
+        },
+        "smtp": {
+            "connections": smtp_store.connections,
+            "round_trips": sum(smtp_store.commands.values()),
+            "commands": dict(smtp_store.commands),
+            "delivered": len(smtp_server.delivered),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="PyCor - End-to-end load test against local mail stand-ins",
+    )
+    parser.add_argument("-m", "--mails", type=int, default=2000)
+    parser.add_argument("-s", "--students", type=int, default=500)
+    parser.add_argument("-c", "--correctors", type=int, default=4)
+    parser.add_argument("-e", "--exercises", type=int, default=8)
+    parser.add_argument(
+        "--attachment-pool",
+        type=int,
+        default=20,
+        help="Distinct student files generated per corrector",
+    )
+    parser.add_argument(
+        "--noise", type=float, default=0.05, help="Share of invalid mails"
+    )
+    parser.add_argument(
+        "--smtp-latency",
+        type=float,
+        default=0.0,
+        help="Seconds the SMTP stand-in waits before each reply",
+    )
+    parser.add_argument(
+        "--smtp-rate", type=float, help="Mails sent per second, unlimited by default"
+    )
+    parser.add_argument(
+        "--smtp-connections", type=int, default=4, help="Concurrent SMTP sessions"
+    )
+    parser.add_argument(
+        "--cycles", type=int, default=1, help="Maximum amount of main() cycles"
+    )
+    parser.add_argument(
+        "--batch", type=int, help="Submissions per cycle, unlimited by default"
+    )
+    parser.add_argument(
+        "--cache-solutions", action="store_true", help="Enable CACHE_SOLUTIONS"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("-o", "--output", type=Path, help="Write JSON results to file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the generated working directory"
+    )
+
+    args = parser.parse_args()
+    cwd = Path.cwd()
+    work_dir = Path(tempfile.mkdtemp(prefix="pycor-load-"))
+    try:
+        report = run(args, work_dir)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Kept working directory {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
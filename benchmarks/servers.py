@@ -0,0 +1,246 @@
+"""
+Minimal in-process IMAP and SMTP stand-ins, just enough for :class:`pycor.mail.Mail`
+"""
+
+import collections
+import re
+import socketserver
+import threading
+import time
+import typing
+
+LITERAL = re.compile(rb"\{(\d+)\}$")
+
+
+class Message:
+    def __init__(self, uid: int, raw: bytes, flags: typing.Set[str]):
+        self.uid = uid
+        self.raw = raw
+        self.flags = flags
+
+
+class Mailbox:
+    def __init__(self):
+        self.messages: typing.List[Message] = []
+        self.next_uid = 1
+
+    def append(self, raw: bytes, flags: typing.Iterable[str] = ()) -> Message:
+        msg = Message(self.next_uid, raw, set(flags))
+        self.next_uid += 1
+        self.messages.append(msg)
+        return msg
+
+
+class Store:
+    """
+    Mailboxes shared by all connections plus round trip counters
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mailboxes: typing.Dict[str, Mailbox] = collections.defaultdict(Mailbox)
+        self.commands: typing.Counter[str] = collections.Counter()
+        self.connections = 0
+
+    def unseen(self, mailbox: str = "INBOX") -> int:
+        with self.lock:
+            return sum(
+                "\\Seen" not in m.flags for m in self.mailboxes[mailbox].messages
+            )
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    server: "IMAPServer"
+    disable_nagle_algorithm = True
+
+    def send(self, line: typing.Union[str, bytes]):
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        store = self.server.store
+        with store.lock:
+            store.connections += 1
+        selected: typing.Optional[Mailbox] = None
+        self.send("* OK IMAP4rev1 stand-in ready")
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.rstrip(b"\r\n")
+
+            # APPEND sends the message as a literal
+            literal = None
+            match = LITERAL.search(line)
+            if match:
+                self.send("+ Ready for literal data")
+                literal = self.rfile.read(int(match.group(1)))
+                self.rfile.readline()
+                line = line[: match.start()].rstrip()
+
+            tag, _, rest = line.decode("utf-8", "replace").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+
+            use_uid = command == "UID"
+            if use_uid:
+                command, _, args = args.partition(" ")
+                command = command.upper()
+
+            with store.lock:
+                store.commands[("UID " if use_uid else "") + command] += 1
+
+                if command == "CAPABILITY":
+                    self.send("* CAPABILITY IMAP4rev1 AUTH=PLAIN")
+                elif command == "LOGIN" or command == "NOOP":
+                    pass
+                elif command == "SELECT":
+                    selected = store.mailboxes[args.strip('"')]
+                    self.send(f"* {len(selected.messages)} EXISTS")
+                    self.send("* 0 RECENT")
+                    self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+                    continue
+                elif command == "SEARCH" and selected is not None:
+                    found = [
+                        str(m.uid if use_uid else idx + 1)
+                        for idx, m in enumerate(selected.messages)
+                        if "UNSEEN" not in args.upper() or "\\Seen" not in m.flags
+                    ]
+                    self.send("* SEARCH " + " ".join(found))
+                elif command == "FETCH" and selected is not None:
+                    id_set, _, items = args.partition(" ")
+                    for idx, msg in self.resolve(selected, id_set, use_uid):
+                        if "PEEK" not in items.upper():
+                            msg.flags.add("\\Seen")
+                        name = "RFC822" if "RFC822" in items.upper() else "BODY[]"
+                        self.wfile.write(
+                            f"* {idx + 1} FETCH (UID {msg.uid} {name} "
+                            f"{{{len(msg.raw)}}}\r\n".encode("utf-8")
+                            + msg.raw
+                            + b")\r\n"
+                        )
+                elif command == "STORE" and selected is not None:
+                    id_set, _, rest = args.partition(" ")
+                    mode, _, flags = rest.partition(" ")
+                    flags_set = set(flags.strip("()").split())
+                    for idx, msg in self.resolve(selected, id_set, use_uid):
+                        if mode.upper().startswith("-"):
+                            msg.flags -= flags_set
+                        else:
+                            msg.flags |= flags_set
+                        self.send(
+                            f"* {idx + 1} FETCH (FLAGS ({' '.join(sorted(msg.flags))}))"
+                        )
+                elif command == "APPEND" and literal is not None:
+                    mailbox, _, flags = args.partition(" ")
+                    flags_match = re.search(r"\((.*?)\)", flags)
+                    store.mailboxes[mailbox.strip('"')].append(
+                        literal, flags_match.group(1).split() if flags_match else ()
+                    )
+                elif command == "CLOSE" or command == "EXPUNGE":
+                    selected = None if command == "CLOSE" else selected
+                elif command == "LOGOUT":
+                    self.send("* BYE stand-in logging out")
+                    self.send(f"{tag} OK LOGOUT completed")
+                    return
+                else:
+                    self.send(f"{tag} BAD unsupported command {command}")
+                    continue
+
+            self.send(f"{tag} OK {command} completed")
+
+    @staticmethod
+    def resolve(
+        mailbox: Mailbox, id_set: str, use_uid: bool
+    ) -> typing.List[typing.Tuple[int, Message]]:
+        wanted = set()
+        for part in id_set.split(","):
+            if ":" in part:
+                begin, end = part.split(":")
+                wanted.update(
+                    range(int(begin), (int(end) if end != "*" else 1 << 31) + 1)
+                )
+            else:
+                wanted.add(int(part))
+        return [
+            (idx, msg)
+            for idx, msg in enumerate(mailbox.messages)
+            if (msg.uid if use_uid else idx + 1) in wanted
+        ]
+
+
+class IMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, store: Store):
+        super().__init__(("127.0.0.1", 0), IMAPHandler)
+        self.store = store
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    server: "SMTPServer"
+    disable_nagle_algorithm = True
+
+    def send(self, line: str):
+        self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+    def handle(self):
+        store = self.server.store
+        with store.lock:
+            store.connections += 1
+        self.send("220 localhost ESMTP stand-in")
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().split(" ")[0].upper()
+            with store.lock:
+                store.commands[command] += 1
+
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            if command in ("EHLO", "HELO"):
+                self.send("250-localhost")
+                self.send("250-AUTH PLAIN LOGIN")
+                self.send("250 8BITMIME")
+            elif command == "AUTH":
+                self.send("235 2.7.0 Authentication successful")
+            elif command == "DATA":
+                self.send("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b".\r\n":
+                        break
+                    data.append(data_line)
+                with store.lock:
+                    self.server.delivered.append(b"".join(data))
+                self.send("250 2.0.0 Ok: queued")
+            elif command == "QUIT":
+                self.send("221 2.0.0 Bye")
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self.send("250 2.0.0 Ok")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, store: Store, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.store = store
+        self.latency = latency
+        self.delivered: typing.List[bytes] = []
+
+
+def serve(server: socketserver.BaseServer) -> threading.Thread:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,206 @@
+"""
+Generators for synthetic corrector layouts, student files and student folders
+"""
+
+import datetime
+import random
+import typing
+from pathlib import Path
+
+import openpyxl  # type: ignore
+
+WORDS = ["laminar", "turbulent", "subcritical", "supercritical", "steady"]
+FIRST_ROW = 13
+
+
+class Layout:
+    """
+    Synthetic corrector layout, each exercise is a list of part types ("float"/"str")
+    """
+
+    def __init__(
+        self,
+        codename: str,
+        exercises: typing.List[typing.List[str]],
+        max_attempts: int = 3,
+        dummy_count: int = 8,
+    ):
+        self.codename = codename
+        self.exercises = exercises
+        self.max_attempts = max_attempts
+        self.dummy_count = dummy_count
+
+    @staticmethod
+    def generate(
+        rnd: random.Random,
+        codename: str,
+        exercise_count: int,
+        max_parts: int = 4,
+        string_ratio: float = 0.1,
+    ) -> "Layout":
+        exercises = [
+            [
+                "str" if rnd.random() < string_ratio else "float"
+                for _ in range(rnd.randint(1, max_parts))
+            ]
+            for _ in range(exercise_count)
+        ]
+        return Layout(codename, exercises)
+
+    def rows(self) -> typing.Iterator[typing.Tuple[int, int, int, str]]:
+        """
+        Yields row number, exercise index, part index and part type
+        """
+        row = FIRST_ROW
+        for ex, parts in enumerate(self.exercises):
+            for part, kind in enumerate(parts):
+                yield row, ex, part, kind
+                row += 1
+
+
+def solution_value(
+    mat_num: int, dummies: typing.List[typing.Any], ex: int, part: int, kind: str
+) -> typing.Union[float, str]:
+    """
+    Deterministic stand-in for the formulas of a corrector
+    """
+    if kind == "str":
+        return WORDS[(mat_num + ex + part) % len(WORDS)]
+    seed = sum(float(d or 0) for d in dummies)
+    return round((mat_num % 997) * (part + 1) / 7.0 + seed * (ex + 1) / 10.0, 4)
+
+
+def solutions(
+    layout: Layout, mat_num: int, dummies: typing.List[typing.Any]
+) -> typing.List[typing.List[dict]]:
+    """
+    Returns solutions in the format of :meth:`pycor.excel.Corrector.generate_solutions`
+    """
+    ret: typing.List[typing.List[dict]] = [[] for _ in layout.exercises]
+    for _, ex, part, kind in layout.rows():
+        ret[ex].append(
+            {
+                "name": f"x{ex + 1}_{part + 1}",
+                "value": solution_value(mat_num, dummies, ex, part, kind),
+                "tolerance_rel": None if kind == "str" else 1.0,
+                "tolerance_abs": None if kind == "str" else 0.001,
+            }
+        )
+    return ret
+
+
+def write_corrector(layout: Layout, subject_folder: Path) -> Path:
+    subject_folder.mkdir(parents=True, exist_ok=True)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.cell(1, 2, f"Benchmark {layout.codename}")
+    ws.cell(2, 2, layout.codename)
+    ws.cell(3, 2, datetime.datetime.now() + datetime.timedelta(days=30))
+    ws.cell(4, 2, layout.max_attempts)
+    ws.cell(7, 3, layout.dummy_count)
+    for row, ex, part, kind in layout.rows():
+        ws.cell(row, 1, ex + 1)
+        ws.cell(row, 2, f"x{ex + 1}_{part + 1}")
+        ws.cell(row, 3, solution_value(0, [], ex, part, kind))
+        if kind == "float":
+            ws.cell(row, 4, 1.0)
+            ws.cell(row, 5, 0.001)
+
+    target = subject_folder / "corrector.xlsx"
+    wb.save(target)
+    return target
+
+
+def write_student_file(
+    rnd: random.Random,
+    layout: Layout,
+    target: Path,
+    mat_num: int,
+    accuracy: float = 0.7,
+) -> Path:
+    """
+    Writes a student file answering each part correctly with a probability of accuracy.
+    Some float answers are written as strings with a decimal comma.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    dummies = [rnd.randint(1, 50) for _ in range(layout.dummy_count)]
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for column, dummy in enumerate(dummies, start=2):
+        ws.cell(9, column, dummy)
+    ws.cell(10, 2, mat_num)
+    for row, ex, part, kind in layout.rows():
+        value = solution_value(mat_num, dummies, ex, part, kind)
+        if rnd.random() > accuracy:
+            value = "wrong" if kind == "str" else value * 1.5 + 1
+        elif kind == "float" and rnd.random() < 0.2:
+            value = str(value).replace(".", ",")
+        ws.cell(row, 1, ex + 1)
+        ws.cell(row, 3, value)
+
+    wb.save(target)
+    return target
+
+
+def write_history(
+    rnd: random.Random, layout: Layout, student_folder: Path, mat_num: int
+):
+    """
+    Writes a random attempt history in the layout of :meth:`pycor.excel.Student.update_stats`
+    """
+    # pycor reads the config on import, see install_config
+    from pycor import records
+
+    student_folder.mkdir(parents=True, exist_ok=True)
+    now = datetime.datetime.now()
+    record = records.StudentRecord()
+    for ex in range(len(layout.exercises)):
+        if rnd.random() < 0.3:
+            continue
+        attempts = []
+        for _ in range(rnd.randint(1, layout.max_attempts)):
+            attempts.append(100 if rnd.random() < 0.4 else rnd.randint(1, 99))
+            if attempts[-1] == 100:
+                break
+        for perc in attempts:
+            timestamp = (
+                now - datetime.timedelta(minutes=rnd.randint(0, 10000))
+            ).strftime("%Y-%m-%d %H:%M:%S")
+            record.update_stats(ex, perc, layout.max_attempts, timestamp, mat_num)
+    records.save(student_folder, record)
+
+
+def generate_subject(
+    rnd: random.Random,
+    work_dir: Path,
+    codename: str,
+    student_count: int,
+    exercise_count: int,
+    max_parts: int = 4,
+    string_ratio: float = 0.1,
+) -> typing.Tuple[Layout, Path, typing.List[Path]]:
+    """
+    Generates a subject folder containing a corrector and one submission plus
+    attempt history per student
+
+    :return: Layout, path to the corrector and paths to the student files
+    """
+    layout = Layout.generate(rnd, codename, exercise_count, max_parts, string_ratio)
+    subject_folder = work_dir / "group" / codename
+    corrector = write_corrector(layout, subject_folder)
+
+    student_files = []
+    for idx in range(student_count):
+        student_folder = subject_folder / f"student{idx:05d}@fh-aachen.de"
+        mat_num = 3000000 + idx
+        write_history(rnd, layout, student_folder, mat_num)
+        student_files.append(
+            write_student_file(
+                rnd,
+                layout,
+                student_folder / "2021-01-01 00.00.00_bench.xlsx",
+                mat_num,
+            )
+        )
+    return layout, corrector, student_files
@@ -1,10 +1,27 @@
+import json
 import logging
 import os
 import typing
 from pathlib import Path
 from urllib import error, request
 
-from pycor import config, excel, mail, post, utils
+from pycor import (
+    cache,
+    config,
+    dropfolder,
+    excel,
+    fingerprints,
+    journal,
+    mail,
+    matnums,
+    metrics,
+    post,
+    profiling,
+    sandbox,
+    scheduler,
+    upload,
+    utils,
+)
 
 log = utils.setup_logger(logging.DEBUG if config.DEBUG else logging.INFO)
 
@@ -82,6 +99,46 @@ def compare(
     return False
 
 
+def grade_exercise(
+    idx: int,
+    student_solution: typing.List[typing.Any],
+    corrector_solution: typing.List[dict],
+) -> dict:
+    """
+    Compares all parts of an exercise, returns a dict containing the exercise index,
+    whether each part is correct, and the names of the compared parts
+
+    :param idx: Exercise number [beginning at 0]
+    :param student_solution: Student's values of the exercise
+    :param corrector_solution: Solutions as returned by :meth:`excel.Corrector.generate_solutions`
+    """
+    exercise_solved = {
+        "exercise": idx,
+        "correct": [False] * len(student_solution),
+        "var_names": [],
+    }
+    for partial_idx, partial in enumerate(student_solution):
+        # Empty line in corrector, skip it
+        if (
+            len(corrector_solution) == 0
+            or corrector_solution[partial_idx]["value"] is None
+        ):
+            continue
+
+        exercise_solved["correct"][partial_idx] = compare(
+            partial,
+            corrector_solution[partial_idx]["value"],
+            corrector_solution[partial_idx]["tolerance_rel"],
+            corrector_solution[partial_idx]["tolerance_abs"],
+        )
+        exercise_solved["var_names"].append(corrector_solution[partial_idx]["name"])
+    return exercise_solved
+
+
+def percentage(exercise_solved: dict) -> int:
+    return int(sum(exercise_solved["correct"]) / len(exercise_solved["correct"]) * 100)
+
+
 def find_valid_filenames() -> typing.Dict[str, excel.Corrector]:
     """
     Searches for corrector files in configured folders. Returns dictionary containing codename as key
@@ -121,242 +178,328 @@ def find_valid_filenames() -> typing.Dict[str, excel.Corrector]:
                 # Append subject and Corrector
                 log.info('Registered "%s" for "%s"', exc.codename, exc.corrector_title)
                 valid_filenames[exc.codename.lower()] = exc
+
+    # Write state of new/changed correctors
+    excel.STATE.flush()
     return valid_filenames
 
 
-def main():
-    # Dict containing file name as key and Corrector as value
-    valid_filenames = find_valid_filenames()
+def grade_student(e: excel.Student, corrector: excel.Corrector, entry: journal.Entry):
+    """
+    Grades a parsed student file, the mails are queued in the journal entry
 
-    if len(valid_filenames) == 0:
-        log.info("There's nothing to do.")
+    :param e: The parsed student file
+    :param corrector: The student file's corrector, Excel has to be opened
+    :param entry: Journal entry of the submission, see :func:`journal.commit`
+    """
+    # Couldn't find any solutions in submitted file
+    if len(e.solutions) == 0:
+        log.warning("Found no solutions in submitted file")
+        metrics.inc("rejections", reason="malformed_attachment")
+        entry.send(e.student_email, *mail.Generator.malformed_attachment())
         return
 
-    # Idling mail instance
-    mail_instance = mail.Mail()
+    with metrics.timer("solution_generation"):
+        real_solutions = corrector.generate_solutions(e.mat_num, e.dummies)
 
-    # Forward mails from known accounts
-    mail_instance.forward_mails()
+    # Couldn't find any solutions in submitted file
+    if len(e.solutions) != len(real_solutions):
+        log.warning("Found more/fewer tasks in submitted file")
+        metrics.inc("rejections", reason="malformed_attachment")
+        entry.send(e.student_email, *mail.Generator.malformed_attachment())
+        return
 
-    # Check inbox for new mails/submitted files
-    student_files = mail_instance.check_inbox(valid_filenames)
+    compared_solutions = []
 
-    # Sort by codename/module number
-    student_files.sort(key=lambda x: x["corrector"].codename)
+    # List of passed/blocked exercises
+    exercises_blocked = []
+    exercises_passed = []
+    exercises_erroneous = []
+    for idx, student_solution in enumerate(e.solutions):
+        # Ignore exercise if one of the fields is empty
+        if None in student_solution:
+            log.debug("Ignoring exercise %s due to empty field", idx + 1)
+            continue
 
-    # Keep track of current corrector to close Excel during changes
-    current_corrector: typing.Optional[excel.Corrector] = None
+        # region First block/pass check for exercise
+        # Check if user is blocked or passed the exercise previously
+        with metrics.timer("stats_io"):
+            blocked, passed = e.get_stats(idx, corrector.max_attempts)
+        if blocked:
+            log.info(
+                "Ignoring exercise %s since %s is already blocked",
+                idx + 1,
+                e.student_email,
+            )
+            exercises_blocked.append(idx)
+            continue
+        elif passed:
+            log.debug(
+                "Ignoring exercise %s since %s has already passed this exercise",
+                idx + 1,
+                e.student_email,
+            )
+            exercises_passed.append(idx)
+            continue
 
-    # Correct each file
-    for sf in student_files:
-        try:
-            corrector: excel.Corrector = sf["corrector"]
-            e = excel.Student(sf["student"], corrector.dummy_count)
+        log.debug("Processing exercise %s for %s", idx + 1, e.student_email)
 
-            # Close and reopen Excel
-            if corrector != current_corrector:
-                if current_corrector:
-                    current_corrector.close_excel()
-                current_corrector = corrector
-                corrector.open_excel()
+        # endregion
 
-            # Couldn't find any solutions in submitted file
-            if len(e.solutions) == 0:
-                log.warning("Found no solutions in submitted file")
-                mail_instance.send(
-                    e.student_email, *mail.Generator.malformed_attachment()
-                )
-                continue
+        # region Comparison of submitted solutions with corrector
+        corrector_solution = real_solutions[idx]
+        # Make sure the student didn't somehow delete any exercise part
+        if len(student_solution) != len(corrector_solution):
+            exercises_erroneous.append(idx + 1)
+            log.warning(
+                "%s may have tampered with the excel file, got different amount of sub "
+                "exercises for exercise %s",
+                e.student_email,
+                idx + 1,
+            )
+            continue
 
-            real_solutions = corrector.generate_solutions(e.mat_num, e.dummies)
+        # Vector for single exercise
+        with metrics.timer("comparison"):
+            exercise_solved = grade_exercise(idx, student_solution, corrector_solution)
+
+        # Update student block/pass stats, the list may be empty
+        if len(exercise_solved["correct"]) > 0:
+            perc = percentage(exercise_solved)
+            with metrics.timer("stats_io"):
+                blocked, passed = e.update_stats(idx, perc, corrector.max_attempts)
+            entry.attempts.append((idx, perc))
+            if passed:
+                exercises_passed.append(idx)
+            if blocked:
+                exercises_blocked.append(idx)
+
+        compared_solutions.append(exercise_solved)
+    # endregion
+
+    # region Sending passed/blocked/congrats mails
+    # Send results
+    results = ""
+    for solution in compared_solutions:
+        results += mail.Generator.exercise_details(solution)
+
+    # May be empty if nothing was submitted
+    if len(results) > 0:
+        entry.send(e.student_email, f"Ergebnisse: {corrector.corrector_title}", results)
+        log.debug("Sending results")
+
+    # Send mail informing about passed exercises
+    if len(exercises_passed) > 0:
+        entry.send(
+            e.student_email,
+            *mail.Generator.exercise_passed(
+                corrector.corrector_title, exercises_passed, e.mat_num
+            ),
+        )
+        log.debug("Sending passed")
+
+    # Send mail informing about blocked exercises
+    if len(exercises_blocked) > 0:
+        entry.send(
+            e.student_email,
+            *mail.Generator.exercise_blocked(
+                corrector.corrector_title,
+                exercises_blocked,
+                corrector.max_attempts,
+            ),
+        )
+        log.debug("Sending blocked")
 
-            # Couldn't find any solutions in submitted file
-            if len(e.solutions) != len(real_solutions):
-                log.warning("Found more/fewer tasks in submitted file")
-                mail_instance.send(
-                    e.student_email, *mail.Generator.malformed_attachment()
-                )
-                continue
+    # Send final congrats
+    if len(exercises_passed) == len(real_solutions):
+        entry.send(
+            e.student_email,
+            *mail.Generator.exercise_congrats(corrector.corrector_title, e.mat_num),
+        )
+        log.debug("Sending final congrats")
+    # endregion
+
+    if len(exercises_erroneous) > 0:
+        entry.send(
+            e.student_email,
+            *mail.Generator.exercise_erroneous(
+                corrector.corrector_title, exercises_erroneous
+            ),
+        )
+        log.debug("Sent ignored exercises")
+
+    if (
+        len(exercises_passed)
+        + len(exercises_blocked)
+        + len(exercises_erroneous)
+        + len(results)
+        == 0
+    ):
+        entry.send(
+            e.student_email,
+            *mail.Generator.exercise_ignored(corrector.corrector_title),
+        )
+        log.debug("Sent info that nothing was corrected")
 
-            compared_solutions = []
+    # Journal attempts and mails before storing all attempts at once
+    journal.commit(entry, e, corrector.max_attempts)
+    fingerprints.add(e.parent_path, e.excel_file.name, e.dummies, e.solutions)
 
-            # List of passed/blocked exercises
-            exercises_blocked = []
-            exercises_passed = []
-            exercises_erroneous = []
-            for idx, student_solution in enumerate(e.solutions):
-                # Ignore exercise if one of the fields is empty
-                if None in student_solution:
-                    log.debug("Ignoring exercise %s due to empty field", idx + 1)
-                    continue
 
-                # region First block/pass check for exercise
-                # Check if user is blocked or passed the exercise previously
-                blocked, passed = e.get_stats(idx, corrector.max_attempts)
-                if blocked:
-                    log.info(
-                        "Ignoring exercise %s since %s is already blocked",
-                        idx + 1,
-                        e.student_email,
-                    )
-                    exercises_blocked.append(idx)
-                    continue
-                elif passed:
-                    log.debug(
-                        "Ignoring exercise %s since %s has already passed this exercise",
-                        idx + 1,
-                        e.student_email,
-                    )
-                    exercises_passed.append(idx)
-                    continue
+def grade_submissions(
+    student_files: typing.List[typing.Dict], mail_instance: mail.Mail
+) -> typing.List[typing.Dict]:
+    """
+    Grades submitted files and mails the results, returns the graded submissions
 
-                log.debug("Processing exercise %s for %s", idx + 1, e.student_email)
+    :param student_files: Dicts as returned by :meth:`mail.Mail.check_inbox`
+    :param mail_instance: Used to send the results
+    """
+    # Only grade the latest of a student's rapid-fire resubmissions
+    if getattr(config, "COALESCE_WINDOW", None):
+        student_files, superseded = scheduler.coalesce(
+            student_files, config.COALESCE_WINDOW * 60
+        )
+        for sf in superseded:
+            log.info("Skipping superseded submission %s", sf["student"].name)
+            metrics.inc("rejections", reason="superseded")
+            try:
+                utils.archive_submission(sf["student"])
+            except OSError:
+                log.exception("Failed to archive superseded submission.")
+            entry = sf.get("journal") or journal.Entry(journaled=False)
+            entry.send(
+                sf["student"].parent.name,
+                *mail.Generator.submission_superseded(sf["corrector"].corrector_title),
+            )
+            journal.deliver(entry, mail_instance)
+            upload.finished(sf, entry)
 
-                # endregion
+    # Group by corrector, most urgent deadlines first
+    student_files = scheduler.order_submissions(student_files)
 
-                # region Comparison of submitted solutions with corrector
-                corrector_solution = real_solutions[idx]
-                # Make sure the student didn't somehow delete any exercise part
-                if len(student_solution) != len(corrector_solution):
-                    exercises_erroneous.append(idx + 1)
-                    log.warning(
-                        "%s may have tampered with the excel file, got different amount of sub "
-                        "exercises for exercise %s",
-                        e.student_email,
-                        idx + 1,
-                    )
-                    continue
+    # Keep track of current corrector to close Excel during changes
+    current_corrector: typing.Optional[excel.Corrector] = None
 
-                # Vector for single exercise
-                exercise_solved = {
-                    "exercise": idx,
-                    "correct": [False] * len(student_solution),
-                    "var_names": [],
-                }
-                for partial_idx, partial in enumerate(student_solution):
-                    # Empty line in corrector, skip it
-                    if (
-                        len(corrector_solution) == 0
-                        or corrector_solution[partial_idx]["value"] is None
-                    ):
-                        continue
-
-                    exercise_solved["correct"][partial_idx] = compare(
-                        partial,
-                        corrector_solution[partial_idx]["value"],
-                        corrector_solution[partial_idx]["tolerance_rel"],
-                        corrector_solution[partial_idx]["tolerance_abs"],
-                    )
-                    exercise_solved["var_names"].append(
-                        corrector_solution[partial_idx]["name"]
-                    )
+    # Parse student files ahead in worker processes if enabled
+    parsed = sandbox.parse_students(
+        (sf["student"], sf["corrector"].dummy_count) for sf in student_files
+    )
 
-                # Update student block/pass stats, the list may be empty
-                if len(exercise_solved["correct"]) > 0:
-                    perc = int(
-                        sum(exercise_solved["correct"])
-                        / len(exercise_solved["correct"])
-                        * 100
-                    )
-                    blocked, passed = e.update_stats(idx, perc, corrector.max_attempts)
-                    if passed:
-                        exercises_passed.append(idx)
-                    if blocked:
-                        exercises_blocked.append(idx)
-
-                compared_solutions.append(exercise_solved)
-            # endregion
-
-            # region Sending passed/blocked/congrats mails
-            # Send results
-            results = ""
-            for solution in compared_solutions:
-                results += mail.Generator.exercise_details(solution)
-
-            # May be empty if nothing was submitted
-            if len(results) > 0:
-                mail_instance.send(
-                    e.student_email, f"Ergebnisse: {corrector.corrector_title}", results
-                )
-                log.debug("Sending results")
-
-            # Send mail informing about passed exercises
-            if len(exercises_passed) > 0:
-                mail_instance.send(
-                    e.student_email,
-                    *mail.Generator.exercise_passed(
-                        corrector.corrector_title, exercises_passed, e.mat_num
-                    ),
-                )
-                log.debug("Sending passed")
-
-            # Send mail informing about blocked exercises
-            if len(exercises_blocked) > 0:
-                mail_instance.send(
-                    e.student_email,
-                    *mail.Generator.exercise_blocked(
-                        corrector.corrector_title,
-                        exercises_blocked,
-                        corrector.max_attempts,
-                    ),
-                )
-                log.debug("Sending blocked")
-
-            # Send final congrats
-            if len(exercises_passed) == len(real_solutions):
-                mail_instance.send(
-                    e.student_email,
-                    *mail.Generator.exercise_congrats(
-                        corrector.corrector_title, e.mat_num
-                    ),
-                )
-                log.debug("Sending final congrats")
-            # endregion
-
-            if len(exercises_erroneous) > 0:
-                mail_instance.send(
-                    e.student_email,
-                    *mail.Generator.exercise_erroneous(
-                        corrector.corrector_title, exercises_erroneous
-                    ),
-                )
-                log.debug("Sent ignored exercises")
-
-            if (
-                len(exercises_passed)
-                + len(exercises_blocked)
-                + len(exercises_erroneous)
-                + len(results)
-                == 0
-            ):
-                mail_instance.send(
-                    e.student_email,
-                    *mail.Generator.exercise_ignored(corrector.corrector_title),
-                )
-                log.debug("Sent info that nothing was corrected")
+    # Correct each file
+    for sf in student_files:
+        # Profile a random share of submissions if enabled
+        profiler = profiling.start_submission()
+        # Mails are queued and only sent once the attempts are committed
+        entry: journal.Entry = sf.get("journal") or journal.Entry(journaled=False)
+        try:
+            corrector: excel.Corrector = sf["corrector"]
+            with metrics.timer("student_parse"):
+                e = next(parsed)
+            if isinstance(e, excel.ExcelFileException):
+                raise e
 
+            # Close Excel, the next corrector opens it once it's needed
+            if corrector != current_corrector:
+                if current_corrector:
+                    current_corrector.close_excel()
+                current_corrector = corrector
+
+            grade_student(e, corrector, entry)
+
+        except excel.FileTooLargeException as exc:
+            log.warning("Rejected oversized student file: %s", exc)
+            metrics.inc("rejections", reason="file_too_large")
+            entry.send(
+                sf["student"].parent.name,
+                *mail.Generator.file_too_large(sf["corrector"].corrector_title),
+            )
         except excel.ExcelFileException:
             log.exception("Error during processing of student file.")
+            metrics.inc("rejections", reason="error_processing")
             student_mail = Path(os.path.abspath(sf["student"].parent)).name
-            mail_instance.send(
+            entry.send(
                 student_mail,
                 *mail.Generator.error_processing(sf["corrector"].corrector_title),
             )
         except IOError:
             log.exception("Critical error during processing. Quitting.")
             raise
+        finally:
+            profiling.stop_submission(profiler, sf["corrector"].codename)
 
-    mail_instance.logout()
+        journal.deliver(entry, mail_instance)
+        upload.finished(sf, entry)
 
-    if len(student_files) > 0:
-        # Run post processing on all matched correctors
-        for corrector in set(_["corrector"] for _ in student_files):
+    with metrics.timer("mail_delivery"):
+        journal.complete(wait=True)
+    matnums.flush()
+    fingerprints.flush()
+    cache.flush()
+    return student_files
+
+
+def post_process(student_files: typing.List[typing.Dict]):
+    """
+    Runs post processing on all correctors of the graded submissions
+    """
+    for corrector in set(_["corrector"] for _ in student_files):
+        with metrics.timer("post_processing"):
             post.PostProcessing(
                 corrector.parent_path, len(corrector.exercise_ranges)
             ).run()
 
+
+def main() -> scheduler.CycleResult:
+    metrics.METRICS.start_cycle()
+
+    # Dict containing file name as key and Corrector as value
+    with metrics.timer("discovery"):
+        valid_filenames = find_valid_filenames()
+
+    upload.register(valid_filenames)
+    dropfolder.watch(valid_filenames)
+
+    if len(valid_filenames) == 0:
+        log.info("There's nothing to do.")
+        metrics.METRICS.end_cycle()
+        return scheduler.CycleResult()
+
+    # Idling mail instance
+    mail_instance = mail.Mail()
+
+    # Forward mails from known accounts
+    mail_instance.forward_mails()
+
+    # Complete submissions of an interrupted cycle first
+    student_files = journal.resume(valid_filenames, mail_instance, upload.owns)
+
+    # Uploaded submissions are already saved
+    student_files += upload.pending(valid_filenames)
+    student_files += dropfolder.collect(valid_filenames)
+
+    # Check inbox for new mails/submitted files
+    student_files += mail_instance.check_inbox(valid_filenames)
+    metrics.inc("submissions", len(student_files))
+
+    student_files = grade_submissions(student_files, mail_instance)
+    mail_instance.logout()
+    post_process(student_files)
+
+    snapshot = metrics.METRICS.end_cycle()
+    log.info("Cycle took %.1fs", snapshot["duration"])
+
     if hasattr(config, "HEALTHCHECK_PING") and config.HEALTHCHECK_PING:
         try:
-            request.urlopen(config.HEALTHCHECK_PING)
+            # The cycle's duration and stage timings end up in the ping's body
+            request.urlopen(
+                config.HEALTHCHECK_PING, data=json.dumps(snapshot).encode("utf-8")
+            )
         except (error.HTTPError, OSError):
             log.exception("Failed to ping healthcheck.")
+
+    return scheduler.CycleResult(
+        submissions=len(student_files),
+        truncated=mail_instance.truncated,
+        deadlines=tuple(c.deadline for c in valid_filenames.values()),
+    )
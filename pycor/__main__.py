@@ -1,15 +1,28 @@
 import argparse
 import datetime
 import getpass
-import time
 from pathlib import Path
 
 from cryptography.fernet import Fernet
 
-from . import config, utils
+from . import (
+    config,
+    memory,
+    metrics,
+    profiling,
+    records,
+    regrade,
+    replay,
+    scheduler,
+    upload,
+    utils,
+)
 
 __version__ = "2021-12-30"
 
+# Seconds to wait for the lock of a previous daemon
+RESTART_WAIT = 15
+
 from pycor import log, main
 
 if __name__ == "__main__":
@@ -24,6 +37,74 @@ if __name__ == "__main__":
         action="store_true",
         help="Generate password passphrase/secret",
     )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=1,
+        default=0,
+        type=int,
+        metavar="N",
+        help="Profile the first N cycles (default 1), writes to logs/profiles",
+    )
+    parser.add_argument(
+        "--profile-submissions",
+        type=float,
+        metavar="RATE",
+        help="Profile a random share of submissions (0-1), writes to logs/profiles",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+    regrade_parser = subparsers.add_parser(
+        "regrade",
+        help="Recompute results of all stored submissions with the current corrector",
+    )
+    regrade_parser.add_argument(
+        "subject", type=Path, help="Subject folder containing corrector and students"
+    )
+    regrade_parser.add_argument(
+        "-w",
+        "--write",
+        action="store_true",
+        help="Replace the record of students whose results changed",
+    )
+    regrade_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Path of the report, defaults to _postprocessing/Regrade_{timestamp}.csv",
+    )
+    regrade_parser.add_argument(
+        "-j", "--workers", type=int, help="Parser processes, defaults to CPU count"
+    )
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="Process mails from a Maildir or a folder of .eml files instead of IMAP",
+    )
+    replay_parser.add_argument(
+        "source", type=Path, help="Maildir or folder containing .eml files"
+    )
+    replay_parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Don't send any mails or change any student folders",
+    )
+    replay_parser.add_argument(
+        "-j", "--workers", type=int, help="Parser processes, defaults to CPU count"
+    )
+    migrate_parser = subparsers.add_parser(
+        "migrate",
+        help="Convert the attempt history of students into record files",
+    )
+    migrate_parser.add_argument(
+        "subject",
+        type=Path,
+        nargs="?",
+        help="Subject folder, defaults to all subjects in the configured folders",
+    )
+    migrate_parser.add_argument(
+        "-k", "--keep", action="store_true", help="Keep the legacy files"
+    )
 
     args = parser.parse_args()
     if args.psw:  # Create password file
@@ -41,24 +122,84 @@ if __name__ == "__main__":
         key = Fernet.generate_key()
         print("Please set this passphrase in config.py: {}".format(key.decode("utf-8")))
         exit()
+    elif args.command == "regrade":
+        # Records written by a running daemon would be overwritten
+        if args.write and not utils.acquire_lock():
+            log.error("PyCor is running, stop it before regrading with --write")
+            exit(1)
+        regrade.run(args.subject, args.write, args.output, args.workers)
+        exit()
+    elif args.command == "replay":
+        # Grades and writes records like the daemon unless it's a dry run
+        if not args.dry_run and not utils.acquire_lock():
+            log.error("PyCor is running, stop it or replay with --dry-run")
+            exit(1)
+        replay.run(args.source, args.dry_run, args.workers)
+        exit()
+    elif args.command == "migrate":
+        # Every student folder is rewritten
+        if not utils.acquire_lock():
+            log.error("PyCor is running, stop it before migrating")
+            exit(1)
+        if args.subject:
+            records.migrate(args.subject, args.keep)
+        else:
+            records.migrate_all(args.keep)
+        exit()
+
+    # A daemon restarted on Windows (see memory.enforce_limit) starts before its
+    # predecessor exited, which holds the lock and the HTTP ports until then
+    if not utils.acquire_lock(wait=RESTART_WAIT):
+        log.error("PyCor is already running or regrading in this folder")
+        exit(1)
 
     # Initialize Sentry
     if hasattr(config, "SENTRY_DSN") and config.SENTRY_DSN:
         utils.setup_sentry(__version__)
 
+    # Expose Prometheus metrics on localhost
+    if getattr(config, "METRICS_PORT", None):
+        metrics.serve(config.METRICS_PORT)
+
+    # Accept submissions via HTTP on localhost
+    if getattr(config, "UPLOAD_PORT", None):
+        upload.serve(config.UPLOAD_PORT)
+
+    if args.profile_submissions is not None:
+        profiling.submission_rate = args.profile_submissions
+
     log.info("Welcome to PyCor v.%s", __version__)
     log.info("PyCor is now running!")
 
+    # Track memory across cycles if enabled
+    tracker = memory.MemoryTracker() if memory.enabled() else None
+
+    # Adapt the polling interval to arrival rates and deadlines if enabled
+    poll_scheduler = (
+        scheduler.PollScheduler()
+        if getattr(config, "ADAPTIVE_POLLING", False)
+        else None
+    )
+
+    profiled_cycles = args.profile
     while True:
-        main()
+        if profiled_cycles > 0:
+            profiled_cycles -= 1
+            with profiling.profile_cycle():
+                result = main()
+        else:
+            result = main()
+
+        if tracker:
+            tracker.checkpoint()
 
-        # Wait until a multiple of DELAY_SLEEP is on the clock
         current = datetime.datetime.now()
-        current_time = current.time()
-        sleep_time = (
-            abs(current_time.minute % config.DELAY_SLEEP - config.DELAY_SLEEP) * 60
-            - current_time.second
-        )
+        if poll_scheduler:
+            sleep_time = poll_scheduler.next_delay(result)
+        else:
+            # Wait until a multiple of DELAY_SLEEP is on the clock
+            sleep_time = scheduler.aligned_delay(current)
         next_execution = current + datetime.timedelta(seconds=sleep_time)
         log.info("Pausing until %s", next_execution.strftime("%H:%M:%S"))
-        time.sleep(sleep_time)
+        if scheduler.sleep(sleep_time):
+            log.info("Woken up by new submissions")
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import typing
+from pathlib import Path
+
+from pydantic import BaseModel, ValidationError  # type: ignore
+
+from pycor import config, metrics, utils
+
+# Bump whenever the cached format or the way solutions are generated changes
+CACHE_VERSION = 3
+CACHE_DIR = Path("cache", "solutions")
+
+log = logging.getLogger("PyCor").getChild("Cache")
+
+Solutions = typing.List[typing.List[typing.Dict[str, typing.Any]]]
+
+
+class CachedSolutions(BaseModel):
+    version: int
+    # sha256 of the serialized solutions, detects truncated or edited files
+    checksum: str
+    # JSON of [mat_num, dummies] as key
+    solutions: typing.Dict[str, Solutions] = {}
+
+
+def enabled() -> bool:
+    return getattr(config, "CACHE_SOLUTIONS", False)
+
+
+def content_hash(corrector_file: Path, password: str) -> str:
+    """
+    Hash of the corrector's content and its password, independent of the file's mtime
+    """
+    digest = hashlib.sha256()
+    digest.update(corrector_file.read_bytes())
+    digest.update(b"\0")
+    digest.update(password.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _checksum(solutions: typing.Dict[str, Solutions]) -> str:
+    return hashlib.sha256(
+        json.dumps(solutions, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _key(mat_num: int, dummies: typing.List[typing.Any]) -> typing.Optional[str]:
+    try:
+        return json.dumps([mat_num, dummies])
+    except TypeError:
+        # E.g. dates as dummies
+        return None
+
+
+class SolutionCache:
+    """
+    Solutions generated by Excel per corrector version, keyed by mat_num and dummies.
+    Resubmissions with the same inputs are graded without starting Excel, also
+    after a restart.
+    """
+
+    def __init__(self, digest: str):
+        self.file = CACHE_DIR / f"{digest}.json"
+        self.solutions: typing.Optional[typing.Dict[str, Solutions]] = None
+        self.dirty = False
+
+    def load(self) -> typing.Dict[str, Solutions]:
+        if self.solutions is not None:
+            return self.solutions
+
+        self.solutions = {}
+        if not self.file.exists():
+            return self.solutions
+        try:
+            cached = CachedSolutions.parse_file(self.file)
+            if cached.version != CACHE_VERSION:
+                raise ValueError(f"Outdated version {cached.version}")
+            if cached.checksum != _checksum(cached.solutions):
+                raise ValueError("Checksum mismatch")
+            self.solutions = cached.solutions
+        except (OSError, ValueError, ValidationError) as exc:
+            log.warning("Discarding cached solutions %s: %s", self.file.stem, exc)
+            try:
+                self.file.unlink()
+            except OSError:
+                pass
+        return self.solutions
+
+    def get(
+        self, mat_num: int, dummies: typing.List[typing.Any]
+    ) -> typing.Optional[Solutions]:
+        key = _key(mat_num, dummies)
+        solutions = self.load().get(key) if key else None
+        metrics.inc("cache_hits" if solutions else "cache_misses", cache="solutions")
+        return solutions
+
+    def set(self, mat_num: int, dummies: typing.List[typing.Any], solutions: Solutions):
+        key = _key(mat_num, dummies)
+        if key is None:
+            return
+        try:
+            # Only values surviving JSON unchanged are cached, not e.g. dates
+            if json.loads(json.dumps(solutions)) != solutions:
+                return
+        except (TypeError, ValueError):
+            return
+        self.load()[key] = solutions
+        self.dirty = True
+
+    def flush(self):
+        if not self.dirty or self.solutions is None:
+            return
+        cached = CachedSolutions(
+            version=CACHE_VERSION,
+            checksum=_checksum(self.solutions),
+            solutions=self.solutions,
+        )
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            utils.write_atomic(self.file, cached.json())
+            self.dirty = False
+        except OSError:
+            log.exception("Failed to write solution cache.")
+
+
+# Corrector digest as key
+_CACHES: typing.Dict[str, SolutionCache] = {}
+
+
+def get(digest: str) -> SolutionCache:
+    if digest not in _CACHES:
+        _CACHES[digest] = SolutionCache(digest)
+    return _CACHES[digest]
+
+
+def discard(digest: str):
+    """
+    Removes the solutions of a corrector version which was replaced
+    """
+    _CACHES.pop(digest, None)
+    try:
+        (CACHE_DIR / f"{digest}.json").unlink()
+        metrics.inc("cache_pruned", cache="solutions")
+    except FileNotFoundError:
+        pass
+    except OSError:
+        log.exception("Failed to remove cached solutions %s", digest)
+
+
+def flush():
+    """
+    Writes all changed caches, call once per cycle
+    """
+    for solution_cache in _CACHES.values():
+        solution_cache.flush()
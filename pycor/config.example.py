@@ -3,6 +3,12 @@
 # Sets console output level to DEBUG, default is INFO.
 DEBUG = False
 
+# Debug records let through per second and logging function, None = unlimited.
+# Dropped records are counted in the log_records_dropped metric.
+LOG_DEBUG_RATE_LIMIT = 20
+# Overrides per function as "<logger>:<function>", e.g. {"PyCor:compare": 0}
+LOG_DEBUG_SITE_LIMITS = {}
+
 # Sets folders containing subjects over which will be iterated
 FOLDERS = ["test_folder\\folder 1", "test_folder\\folder 2"]
 
@@ -14,6 +20,18 @@ MAIL_PASS = "root"
 MAIL_IMAP = "imap.example.com"
 # SMTP server
 MAIL_SMTP = "smtp.example.com"
+# Ports and encryption, only change these for local test servers
+MAIL_IMAP_PORT = 993
+MAIL_IMAP_SSL = True
+MAIL_SMTP_PORT = 587
+MAIL_SMTP_STARTTLS = True
+# Mails sent per second (with bursts of up to MAIL_SMTP_BURST) and maximum amount of
+# concurrent SMTP sessions. Fewer sessions are used while the relay throttles.
+MAIL_SMTP_RATE = 5
+MAIL_SMTP_BURST = 10
+MAIL_SMTP_CONNECTIONS = 4
+# Seconds between NOOPs keeping the IMAP session alive while idle, 0 disables them
+MAIL_IMAP_KEEPALIVE = 5 * 60
 # Spoof From header
 MAIL_FROM = "pycor@example.com"
 
@@ -26,6 +44,43 @@ MARK_MAILS_AS_READ = False
 # Minute to run at (multiple of n). E.g.: 5 results in 8:05, 8:10, 8:15...
 DELAY_SLEEP = 10
 
+# Maximum amount of mails processed per cycle, the rest is left for the next cycle
+MAX_SUBMISSIONS_PER_CYCLE = None
+
+# Limits for submitted files, checked before parsing. Sizes in MB, the ratio is
+# checked per zip entry, sheet size applies to worksheets and shared strings.
+MAX_FILE_SIZE = 10
+MAX_UNCOMPRESSED_SIZE = 100
+MAX_COMPRESSION_RATIO = 200
+MAX_ZIP_ENTRIES = 1000
+MAX_SHEET_SIZE = 50
+
+# Parse student files in PARSE_WORKERS processes (None = in the main process). Parsing
+# is aborted after PARSE_TIMEOUT seconds or PARSE_MEMORY_LIMIT MB (not on Windows),
+# workers are replaced after PARSE_TASKS_PER_WORKER files.
+PARSE_WORKERS = 2
+PARSE_TIMEOUT = 60
+PARSE_MEMORY_LIMIT = 1024
+PARSE_TASKS_PER_WORKER = 100
+
+# Only grade the newest of several submissions a student sent for the same corrector
+# within COALESCE_WINDOW minutes, the others are archived (None = disabled)
+COALESCE_WINDOW = None
+
+# Submissions are graded per corrector, most urgent deadline first. Every corrector
+# gets at most QUEUE_SLICE submissions before the next one's turn (None = unlimited)
+QUEUE_SLICE = 50
+
+# Pick the polling interval based on arrival rates and deadlines instead of DELAY_SLEEP.
+# Polls every POLL_MIN_INTERVAL seconds within POLL_DEADLINE_WINDOW hours before a
+# deadline, aims for POLL_TARGET_BATCH submissions per cycle and backs off to
+# POLL_IDLE_INTERVAL minutes while idle.
+ADAPTIVE_POLLING = False
+POLL_MIN_INTERVAL = 15
+POLL_DEADLINE_WINDOW = 6
+POLL_TARGET_BATCH = 10
+POLL_IDLE_INTERVAL = 30
+
 # Passphrase for corrector pws files (Base64-encoded Fernet key)
 PSW_PASSPHRASE = "gC9VGy09lEk7zK1257Pzj5-mDPclX_FScqLC2RLObyU="
 
@@ -35,12 +90,36 @@ FOLDER_IGNORE = ["_postprocessing"]
 # Make excel visible during processing
 SHOW_EXCEL = False
 
+# Keep the solutions Excel generated per matriculation number and dummies in
+# cache/solutions, resubmissions are then graded without Excel. Leave disabled for
+# correctors using volatile formulas like RAND() or TODAY().
+CACHE_SOLUTIONS = False
+
 # Sentry DSN
 SENTRY_DSN = None
 
-# Healthcheck address (called after every run)
+# Healthcheck address (called after every run, receives the cycle's timings as body)
 HEALTHCHECK_PING = None
 
+# Port for Prometheus metrics on http://127.0.0.1:{port}/metrics, disabled if None
+METRICS_PORT = None
+
+# Accept submissions on http://127.0.0.1:{port}/submissions as multipart form with the
+# fields `email` and `file`, authenticated via `Authorization: Bearer {UPLOAD_TOKEN}`.
+# Waits up to UPLOAD_WAIT seconds for the result, then answers with a URL to poll.
+# Disabled if None.
+UPLOAD_PORT = None
+UPLOAD_TOKEN = ""
+UPLOAD_WAIT = 30
+
+# Grade files dropped into the `inbox` folder of a subject, named
+# `<email>__<codename>.xlsx`. Results are written to `inbox/results` ("file") or mailed
+# ("mail"). Without inotify (i.e. on Windows) the folders are polled every
+# DROP_POLL_INTERVAL seconds.
+DROP_FOLDERS = False
+DROP_FOLDER_RESULTS = "file"
+DROP_POLL_INTERVAL = 10
+
 # Where to send mails with "PROBLEM" in the subject
 ADMIN_CONTACT = "root@example.com"
 
@@ -55,3 +134,28 @@ MAIL_FORWARDS = {
         "password": "",
     }
 }
+
+# Processes used to render changed post processing charts, defaults to the CPU count
+POSTPROCESSING_WORKERS = None
+# Changed charts needed to start these processes, fewer are rendered right away
+POSTPROCESSING_POOL_THRESHOLD = 24
+
+# Flag submissions of different students whose dummies and answers match to at least
+# FINGERPRINT_SIMILARITY (0-1), clusters are listed in _postprocessing/Clusters.csv.
+# None disables fingerprinting.
+FINGERPRINT_SIMILARITY = 0.9
+
+# Share of submissions (0-1) which are profiled individually into logs/profiles
+PROFILE_SUBMISSION_RATE = 0.0
+
+# Record the largest allocation changes via tracemalloc after every cycle (slow),
+# MEMORY_TOP_ALLOCATIONS of them are logged
+MEMORY_DIAGNOSTICS = False
+MEMORY_TOP_ALLOCATIONS = 10
+# Warn if memory grows by more than MEMORY_GROWTH_LIMIT MB across MEMORY_GROWTH_CYCLES cycles
+MEMORY_GROWTH_CYCLES = 6
+MEMORY_GROWTH_LIMIT = 50
+# Memory limit in MB, exceeding it forces a garbage collection ("collect") or also
+# restarts PyCor if that didn't help ("restart")
+MEMORY_LIMIT = None
+MEMORY_LIMIT_ACTION = "collect"
@@ -0,0 +1,254 @@
+"""
+Concurrent SMTP delivery, rate limited by a token bucket. The amount of concurrent
+sessions follows AIMD: it grows by one after a round of successful sends and is
+halved whenever the relay answers with 4xx or drops the connection.
+"""
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+import typing
+from concurrent import futures
+from email.message import Message
+
+from pycor import config, metrics, sessions
+
+# Attempts per mail before giving up until the next cycle
+MAX_ATTEMPTS = 6
+
+log = logging.getLogger("PyCor").getChild("Delivery")
+
+# Concurrency reached by the last instance, reused as starting point
+_concurrency = 1
+
+
+class DeliveryException(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: Tokens added per second, unlimited if falsy
+        :param burst: Maximum amount of tokens
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, blocks until one is available
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Job:
+    def __init__(self, recipient: str, msg: Message):
+        self.recipient = recipient
+        self.msg = msg
+        self.future: futures.Future = futures.Future()
+        self.attempts = 0
+        self.not_before = 0.0
+        self.queued = time.perf_counter()
+
+
+def _transient(exc: Exception) -> bool:
+    """
+    Whether the relay is throttling or unavailable, i.e. whether to retry later
+    """
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    # SMTPException is an OSError as well, anything else is a connection problem
+    return isinstance(exc, smtplib.SMTPServerDisconnected) or not isinstance(
+        exc, smtplib.SMTPException
+    )
+
+
+def _rejected(exc: Exception) -> bool:
+    """
+    Whether the mail itself was refused, i.e. with 5xx in reply to MAIL, RCPT or DATA
+    """
+    if isinstance(exc, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return 500 <= exc.smtp_code < 600
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return any(500 <= code < 600 for code, _ in exc.recipients.values())
+    return False
+
+
+class Delivery:
+    def __init__(self):
+        self.max_sessions = max(getattr(config, "MAIL_SMTP_CONNECTIONS", 4) or 1, 1)
+        self.bucket = TokenBucket(
+            getattr(config, "MAIL_SMTP_RATE", 5), getattr(config, "MAIL_SMTP_BURST", 10)
+        )
+
+        self.jobs: "queue.Queue[typing.Optional[Job]]" = queue.Queue()
+        self.workers: typing.List[threading.Thread] = []
+
+        # Sessions allowed to send concurrently, adapted via AIMD
+        self.cond = threading.Condition()
+        self.limit = min(_concurrency, self.max_sessions)
+        self.active = 0
+        self.successes = 0
+
+        # Set if connecting failed permanently (e.g. login refused), the remaining
+        # mails stay journaled for the next cycle
+        self.unavailable: typing.Optional[Exception] = None
+
+    def submit(self, recipient: str, msg: Message) -> futures.Future:
+        """
+        Queues a mail, the future's result is the sent message
+        """
+        if not self.workers:
+            self.workers = [
+                threading.Thread(target=self.work, name=f"smtp-{idx}", daemon=True)
+                for idx in range(self.max_sessions)
+            ]
+            for worker in self.workers:
+                worker.start()
+
+        job = Job(recipient, msg)
+        self.jobs.put(job)
+        metrics.gauge("mail_queue_depth", self.jobs.qsize())
+        return job.future
+
+    def wait(self):
+        """
+        Blocks until all queued mails are sent or failed
+        """
+        self.jobs.join()
+
+    def close(self):
+        global _concurrency
+
+        self.wait()
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        _concurrency = self.limit
+
+    # region AIMD
+    def acquire(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def on_success(self):
+        with self.cond:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_sessions:
+                self.limit += 1
+                self.successes = 0
+                metrics.gauge("smtp_concurrency", self.limit)
+                self.cond.notify_all()
+
+    def on_throttle(self):
+        with self.cond:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            metrics.gauge("smtp_concurrency", self.limit)
+        metrics.inc("smtp_throttled")
+
+    # endregion
+
+    def retry(self, job: Job, exc: Exception):
+        self.on_throttle()
+        job.attempts += 1
+        if job.attempts >= MAX_ATTEMPTS:
+            log.error("Giving up sending mail to %s: %s", job.recipient, exc)
+            job.future.set_exception(DeliveryException(str(exc)))
+            return
+
+        log.warning("Failed to send mail to %s, will retry: %s", job.recipient, exc)
+        metrics.inc("mail_retries", kind="smtp_send")
+        job.not_before = time.monotonic() + min(2**job.attempts, 30)
+        self.jobs.put(job)
+
+    def work(self):
+        # Kept across deliveries, see :mod:`pycor.sessions`
+        session = sessions.smtp()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+
+            delay = job.not_before - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            self.acquire()
+            try:
+                self.send(session, job)
+            finally:
+                self.release()
+                metrics.gauge("mail_queue_depth", self.jobs.qsize())
+                self.jobs.task_done()
+
+        sessions.release(session)
+
+    def send(self, session: sessions.SmtpSession, job: Job):
+        """
+        Sends the job's mail, resolves its future unless it's retried
+        """
+        if self.unavailable is not None:
+            job.future.set_exception(DeliveryException(str(self.unavailable)))
+            return
+
+        try:
+            smtp = session.ensure()
+        except (smtplib.SMTPException, OSError) as exc:
+            if _transient(exc):
+                self.retry(job, exc)
+            else:
+                log.error("Failed to connect to %s: %s", config.MAIL_SMTP, exc)
+                self.unavailable = exc
+                job.future.set_exception(DeliveryException(str(exc)))
+            return
+
+        self.bucket.acquire()
+        try:
+            with metrics.timer("mail_send"):
+                smtp.sendmail(config.MAIL_FROM, job.recipient, job.msg.as_bytes())
+        except (smtplib.SMTPException, OSError) as exc:
+            if _rejected(exc):
+                log.error("Failed to send mail to %s: %s", job.recipient, exc)
+                job.future.set_exception(exc)
+                return
+            if not isinstance(exc, smtplib.SMTPResponseException) or (
+                exc.smtp_code == 421
+            ):
+                session.disconnect()
+            self.retry(job, exc)
+        else:
+            log.info("Sent mail to %s", job.recipient)
+            metrics.inc("mails_sent")
+            metrics.METRICS.observe("mail_latency", time.perf_counter() - job.queued)
+            self.on_success()
+            job.future.set_result(job.msg)
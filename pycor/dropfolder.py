@@ -0,0 +1,337 @@
+"""
+Watched `inbox` folder per subject for submissions collected elsewhere (e.g. via the
+LMS). Files named `<email>__<codename>.xlsx` are picked up as soon as they were
+written, noticed via inotify on Linux and by polling the folders otherwise.
+"""
+
+import ctypes
+import ctypes.util
+import datetime
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import typing
+import uuid
+from pathlib import Path
+
+from pycor import config, excel, journal, mail, metrics, scheduler
+
+INBOX_FOLDER = "inbox"
+REJECTED_FOLDER = "rejected"
+RESULTS_FOLDER = "results"
+
+# Files modified within this many seconds may still be copied
+SETTLE = 2
+
+# See inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+log = logging.getLogger("PyCor").getChild("DropFolder")
+
+
+def enabled() -> bool:
+    return getattr(config, "DROP_FOLDERS", False)
+
+
+def settled(item: Path, now: float) -> bool:
+    """
+    Whether the item is a dropped file which isn't being copied anymore
+    """
+    return (
+        item.suffix.lower() == ".xlsx"
+        and item.is_file()
+        and now - item.stat().st_mtime >= SETTLE
+    )
+
+
+def parse_name(name: str) -> typing.Optional[typing.Tuple[str, str]]:
+    """
+    Splits `<email>__<codename>.xlsx` into address and codename
+    """
+    if not name.lower().endswith(".xlsx"):
+        return None
+    stem = name[: -len(".xlsx")]
+    # Domains don't contain underscores, codenames might
+    at = stem.find("@")
+    separator = stem.find("__", at)
+    if at < 1 or separator < 0:
+        return None
+    return stem[:separator], stem[separator + 2 :]
+
+
+class Inotify:
+    def __init__(self):
+        """
+        :raises OSError: If inotify isn't available
+        """
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is not available")
+
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add(self, folder: Path) -> int:
+        """
+        :returns: Watch descriptor for :meth:`remove`
+        """
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(str(folder)), IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Can't watch {folder}")
+        return wd
+
+    def remove(self, wd: int):
+        # Fails if the folder was deleted, which removed the watch already
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: typing.Optional[float]) -> typing.List[str]:
+        """
+        Returns the names of files written to or moved into a watched folder
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        buffer = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(buffer):
+            _, _, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            names.append(os.fsdecode(buffer[offset : offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+
+class Watcher:
+    """
+    Wakes up the daemon once files were dropped into any of the watched folders
+    """
+
+    def __init__(self):
+        # Folder as key, inotify watch descriptor as value (None while polling)
+        self.folders: typing.Dict[Path, typing.Optional[int]] = {}
+        # Files which couldn't be ingested, with their mtime at that point
+        self.failed: typing.Dict[Path, float] = {}
+        self.lock = threading.Lock()
+        self.poll_interval = getattr(config, "DROP_POLL_INTERVAL", 10)
+
+        try:
+            self.inotify: typing.Optional[Inotify] = Inotify()
+        except OSError:
+            log.info("Polling drop folders every %ss", self.poll_interval)
+            self.inotify = None
+
+        threading.Thread(target=self.run, name="dropfolder", daemon=True).start()
+
+    def watch(self, folders: typing.Set[Path]):
+        """
+        Watches exactly the given folders, e.g. not those of expired subjects
+        """
+        with self.lock:
+            for folder in set(self.folders) - folders:
+                wd = self.folders.pop(folder)
+                if self.inotify and wd is not None:
+                    self.inotify.remove(wd)
+                log.debug("Stopped watching %s", folder)
+            self.failed = {
+                item: mtime
+                for item, mtime in self.failed.items()
+                if item.parent in folders and item.exists()
+            }
+
+            for folder in folders - set(self.folders):
+                try:
+                    self.folders[folder] = (
+                        self.inotify.add(folder) if self.inotify else None
+                    )
+                except OSError:
+                    log.exception("Failed to watch %s", folder)
+                    continue
+                log.debug("Watching %s", folder)
+
+    def fail(self, item: Path):
+        """
+        Remembers a file which stays in the inbox, it's retried in the following cycles
+        but doesn't wake the daemon until it's written again
+        """
+        try:
+            mtime = item.stat().st_mtime
+        except OSError:
+            return
+        with self.lock:
+            self.failed[item] = mtime
+
+    def dropped(self) -> bool:
+        """
+        Whether any of the folders contains a file which can be ingested
+        """
+        with self.lock:
+            folders = list(self.folders)
+            failed = dict(self.failed)
+        now = time.time()
+        return any(
+            settled(item, now) and failed.get(item) != item.stat().st_mtime
+            for folder in folders
+            if folder.is_dir()
+            for item in folder.iterdir()
+        )
+
+    def run(self):
+        while True:
+            if self.inotify:
+                names = self.inotify.read(None)
+                # Wait until a bulk copy is done, so it's graded as one batch
+                while self.inotify.read(SETTLE + 0.5):
+                    pass
+                if not any(name.lower().endswith(".xlsx") for name in names):
+                    continue
+            else:
+                time.sleep(self.poll_interval)
+                try:
+                    if not self.dropped():
+                        continue
+                except OSError:
+                    # Files are being moved by the current cycle
+                    continue
+            scheduler.wake()
+
+
+_watcher: typing.Optional[Watcher] = None
+
+
+def watch(valid_filenames: typing.Dict[str, excel.Corrector]):
+    """
+    Creates and watches the drop folders of all subjects
+    """
+    global _watcher
+
+    if not enabled():
+        return
+    if _watcher is None:
+        _watcher = Watcher()
+
+    inboxes = set()
+    for corrector in valid_filenames.values():
+        inbox = corrector.parent_path / INBOX_FOLDER
+        try:
+            inbox.mkdir(exist_ok=True)
+        except OSError:
+            log.exception("Failed to create %s", inbox)
+            continue
+        inboxes.add(inbox)
+    _watcher.watch(inboxes)
+
+
+def reject(item: Path, reason: str):
+    log.warning("Rejected dropped file %s: %s", item.name, reason)
+    metrics.inc("rejections", reason="invalid_drop")
+
+    rejected = item.parent / REJECTED_FOLDER
+    rejected.mkdir(exist_ok=True)
+    item.replace(rejected / item.name)
+    with (rejected / "rejected.txt").open("a") as f:
+        f.write(
+            f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} - {item.name} - {reason}\n"
+        )
+
+
+def ingest(
+    item: Path,
+    corrector: excel.Corrector,
+    valid_filenames: typing.Dict[str, excel.Corrector],
+) -> typing.Optional[typing.Dict]:
+    """
+    Moves a dropped file into the student's folder, returns the submission or None if
+    the file was rejected
+    """
+    parsed = parse_name(item.name)
+    if parsed is None:
+        reject(item, "Expected <email>__<codename>.xlsx")
+        return None
+    student_email, codename = parsed
+    if not mail.accepted_address(student_email):
+        reject(item, "Address is not accepted")
+        return None
+    if mail.find_corrector(codename, valid_filenames) is not corrector:
+        reject(item, f"Unknown codename {codename} for this subject")
+        return None
+
+    received = item.stat().st_mtime
+    student_file = mail.submission_path(student_email, corrector, received)
+    if student_file is None:
+        return None
+
+    submission = {
+        "student": student_file,
+        "corrector": corrector,
+        "received": received,
+    }
+    entry = journal.Entry(id=uuid.uuid4().hex)
+    if getattr(config, "DROP_FOLDER_RESULTS", "file") == "file":
+        entry.result_file = (
+            item.parent
+            / RESULTS_FOLDER
+            / f"{item.stem}_{datetime.datetime.now():%Y-%m-%d %H.%M.%S}.html"
+        )
+    # Journaled first, after a crash the file is still in the inbox and the entry is
+    # discarded as its student file doesn't exist
+    journal.saved(entry, submission)
+    try:
+        item.replace(student_file)
+    except OSError:
+        journal.discard(entry)
+        raise
+    submission["journal"] = entry
+
+    log.info("Accepted dropped file %s", item.name)
+    metrics.inc("dropped_submissions")
+    return submission
+
+
+def collect(
+    valid_filenames: typing.Dict[str, excel.Corrector],
+) -> typing.List[typing.Dict]:
+    """
+    Ingests all dropped files, returns the submissions to grade in this cycle
+    """
+    if not enabled():
+        return []
+
+    batch_limit = getattr(config, "MAX_SUBMISSIONS_PER_CYCLE", None)
+    now = time.time()
+    ret: typing.List[typing.Dict] = []
+    for corrector in sorted(set(valid_filenames.values()), key=lambda c: c.parent_path):
+        inbox = corrector.parent_path / INBOX_FOLDER
+        if not inbox.is_dir():
+            continue
+
+        for item in sorted(inbox.iterdir()):
+            if not settled(item, now):
+                continue
+            if batch_limit and len(ret) >= batch_limit:
+                # Leave the remaining files for the next cycle, which starts right away
+                scheduler.wake()
+                return ret
+
+            try:
+                submission = ingest(item, corrector, valid_filenames)
+            except OSError:
+                log.exception("Failed to ingest %s", item)
+                submission = None
+            if submission:
+                ret.append(submission)
+            elif _watcher and item.exists():
+                _watcher.fail(item)
+    return ret
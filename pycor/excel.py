@@ -7,27 +7,44 @@ import zipfile
 from pathlib import Path
 from typing import List
 
-import numpy as np  # type: ignore
 import openpyxl.reader.excel  # type: ignore
 import openpyxl.worksheet.worksheet  # type: ignore
-import pywintypes  # type: ignore
-import win32com.client  # type: ignore
 from cryptography import fernet  # type: ignore
-from win32com.client.dynamic import CDispatch  # type: ignore
 
-from pycor import config, utils
+from pycor import cache, config, matnums, metrics, records, utils
 from pycor.state import CorrectorDict, State
 
+try:
+    import pywintypes  # type: ignore
+    import win32com.client  # type: ignore
+    from win32com.client.dynamic import CDispatch  # type: ignore
+except ImportError:
+    # Excel is only available on Windows, student files and correctors without a
+    # password can still be read via openpyxl, e.g. for benchmarks
+    win32com = None
+    CDispatch = typing.Any
+
+    class pywintypes:  # type: ignore
+        class com_error(Exception):
+            pass
+
 
 class ExcelFileException(Exception):
     pass
 
 
+class FileTooLargeException(ExcelFileException):
+    pass
+
+
 # Create global state object
 STATE = State.load()
 
 
 def setup_excel() -> CDispatch:
+    if win32com is None:
+        raise ExcelFileException("Excel is not available on this platform")
+
     excel = win32com.client.Dispatch("Excel.Application")
 
     # "Do you want to save your work?"
@@ -53,6 +70,40 @@ def load_workbook(excel_file: Path):
     return openpyxl.load_workbook(mem_file, read_only=True, data_only=True)
 
 
+def check_zip(excel_file: Path):
+    """
+    Checks sizes, compression ratios and entry count listed in the zip's central
+    directory against the configured limits without decompressing anything
+
+    :raises FileTooLargeException: If a limit is exceeded
+    """
+    mb = 2**20
+    size = excel_file.stat().st_size
+    if size > getattr(config, "MAX_FILE_SIZE", 10) * mb:
+        raise FileTooLargeException(f"File size of {size} bytes exceeds limit")
+
+    with zipfile.ZipFile(excel_file) as zf:
+        entries = zf.infolist()
+
+    if len(entries) > getattr(config, "MAX_ZIP_ENTRIES", 1000):
+        raise FileTooLargeException(f"Zip contains {len(entries)} entries")
+
+    uncompressed = sum(entry.file_size for entry in entries)
+    if uncompressed > getattr(config, "MAX_UNCOMPRESSED_SIZE", 100) * mb:
+        raise FileTooLargeException(f"Uncompressed size of {uncompressed} bytes")
+
+    max_ratio = getattr(config, "MAX_COMPRESSION_RATIO", 200)
+    max_sheet_size = getattr(config, "MAX_SHEET_SIZE", 50) * mb
+    for entry in entries:
+        if entry.file_size > max_ratio * max(entry.compress_size, 1):
+            raise FileTooLargeException(f"Compression ratio of {entry.filename}")
+        if (
+            entry.filename.startswith("xl/worksheets/")
+            or entry.filename == "xl/sharedStrings.xml"
+        ) and entry.file_size > max_sheet_size:
+            raise FileTooLargeException(f"{entry.filename} is too large")
+
+
 def get_cell(
     ws: typing.Union[openpyxl.reader.excel.ReadOnlyWorksheet, typing.Any],
     row: int,
@@ -180,6 +231,10 @@ class Student(Commons):
 
         self.student_email = self.parent_path.name
 
+        # Attempt history, see :attr:`record`
+        self._record: typing.Optional[records.StudentRecord] = None
+        self.record_changed = False
+
         wb: typing.Union[openpyxl.workbook.Workbook, typing.Any] = None
         excel: typing.Optional[CDispatch] = None
         try:
@@ -188,6 +243,9 @@ class Student(Commons):
 
             # File is a zipfile, open via openpyxl (read-only, fast)
             if zipfile.is_zipfile(self.excel_file):
+                # Refuse zip bombs before openpyxl inflates them
+                check_zip(self.excel_file)
+
                 # Ignore formulas, ignore Excel's "smart" types
                 wb = load_workbook(self.excel_file)
 
@@ -238,6 +296,15 @@ class Student(Commons):
                 if wb:
                     wb.close()
 
+    @property
+    def record(self) -> records.StudentRecord:
+        """
+        The student's record, read on first access
+        """
+        if self._record is None:
+            self._record = records.load(self.parent_path)
+        return self._record
+
     def get_stats(self, exercise: int, max_attempts: int) -> typing.Tuple[bool, bool]:
         """
         Returns the student's statistics
@@ -246,117 +313,59 @@ class Student(Commons):
         :param max_attempts: Maximum amount of tries before being blocked
         :return:
         """
-        try:
-            exercise_file = self.parent_path / "Exercise{}_block.txt".format(
-                exercise + 1
-            )
-
-            if exercise_file.exists():
-                block_status = np.loadtxt(str(exercise_file))
-
-                # Check if user's try list doesn't match the specified max_tries
-                if block_status.size > max_attempts:
-                    block_status = block_status[0:max_attempts]
-                    np.savetxt(exercise_file, block_status, fmt="%3.2f")
-                elif block_status.size < max_attempts:
-                    # Extend list
-                    block_status = np.append(
-                        block_status, [0] * (max_attempts - block_status.size)
-                    )
-                    # noinspection PyTypeChecker
-                    np.savetxt(exercise_file, block_status, fmt="%3.2f")
-
-                if 0 < block_status[-1] < 100:
-                    # Last entry isn't passed
-                    return True, False
-                elif 100 in block_status:
-                    # Any entry is marked as passed
-                    return False, True
-                else:
-                    # Neither passed nor blocked
-                    return False, False
-            else:
-                return False, False
-        except IOError:
-            self.log.exception("Failed to get student's stats.")
-            raise
+        blocked, passed, resized = self.record.get_stats(exercise, max_attempts)
+        self.record_changed |= resized
+        return blocked, passed
 
     def update_stats(
         self, exercise: int, correct_percentage: int, max_attempts: int
     ) -> typing.Tuple[bool, bool]:
         """
-        Updates and saves the student's statistics
+        Updates the student's statistics, call :meth:`save_record` afterwards
 
         :param exercise: Exercise number [beginning at 0]
         :param correct_percentage: Percentage of correctly answered sub tasks
         :param max_attempts: Maximum amount of tries before being blocked
         :return:
         """
-        try:
-            blocked = False
-            passed = correct_percentage == 100
-
-            exercise_file = self.parent_path / "Exercise{}_block.txt".format(
-                exercise + 1
+        blocked, passed = self.record.update_stats(
+            exercise,
+            correct_percentage,
+            max_attempts,
+            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            self.mat_num,
+        )
+        self.record_changed = True
+        matnums.add(self.parent_path, self.mat_num)
+        if blocked:
+            self.log.info(
+                "Blocked %s for exercise %s", self.student_email, exercise + 1
             )
-            student_data = self.parent_path / "data"
-
-            # Does the file exist already?
-            if exercise_file.exists():
-                # noinspection PyTypeChecker
-                block_status = np.loadtxt(exercise_file)
-            else:
-                block_status = np.zeros(max_attempts)
-
-            # Check if user still has tries
-            if block_status.size == 1:
-                # Account for block_status being a scalar
-                try_row = [0] if block_status[0] == 0 else []
-            else:
-                try_row = [r[0] for r in enumerate(block_status) if r[1] == 0]
-
-            # There's at least one attempt left, let's log the results!
-            if len(try_row) > 0:
-                block_status[try_row[0]] = correct_percentage
-                # noinspection PyTypeChecker
-                np.savetxt(exercise_file, block_status, fmt="%3.2f")
-            else:
-                blocked = True
-
-            # Check if student failed his last try
-            if 0 < block_status[-1] < 100:
-                blocked = True
-                self.log.info(
-                    "Blocked %s for exercise %s", self.student_email, exercise + 1
-                )
-
-            # Create user-specific data folder
-            if not student_data.exists():
-                student_data.mkdir(exist_ok=True)
-
-            current_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            # Save percentage and date/time to file
-            exercise_all = student_data / "Exercise{}.txt".format(exercise + 1)
-            with exercise_all.open("a") as ea:
-                ea.write("{} - {}\n".format(current_datetime, correct_percentage))
-
-            # Save used mat_num to file
-            mat_num_file = student_data / "mat_num.txt"
-            with mat_num_file.open("a") as mnf:
-                mnf.write("{} - {}\n".format(current_datetime, self.mat_num))
+        return blocked, passed
 
-            return blocked, passed
+    def save_record(self):
+        """
+        Writes the student's record if it changed
+        """
+        if not self.record_changed:
+            return
+        if self.excel_file.name not in self.record.submissions:
+            self.record.submissions.append(self.excel_file.name)
+        try:
+            records.save(self.parent_path, self.record)
+            self.record_changed = False
         except IOError:
             self.log.exception("Failed to save student's stats.")
             raise
 
 
 class Corrector(Commons):
-    def __init__(self, excel_file: Path):
+    def __init__(self, excel_file: Path, check_deadline: bool = True):
         super().__init__(excel_file)
         self.password = self.find_password()
         self.excel_instance: typing.Optional[CDispatch] = None
+        # Content hash of the corrector, identifies its cached solutions
+        self.digest = ""
 
         # Password could not be decrypted
         if self.password is None:
@@ -376,85 +385,101 @@ class Corrector(Commons):
             self.valid = False
 
             # Load state if possible
-            state = STATE.correctors.get(self.get_relevant_path("_"), None)
+            state = STATE.get(self.get_relevant_path("_"))
             change_date = datetime.datetime.utcfromtimestamp(
                 self.excel_file.stat().st_mtime
             )
 
             # File was not changed since last check, skip verification
             if state and change_date == state.change_date:
+                metrics.inc("cache_hits", cache="corrector_state")
                 # Use saved info
-                self.codename = state.codename
-                self.deadline = state.deadline
-                self.max_attempts = state.max_attempts
-                self.password = state.password
-                self.corrector_title = state.title
-                self.exercise_ranges = state.exercise_ranges
-                self.dummy_count = state.dummy_count
+                self.load_state(state)
+                if not state.digest:
+                    # State from before digests were saved
+                    self.digest = cache.content_hash(self.excel_file, self.password)
+                    STATE.set(
+                        self.get_relevant_path("_"),
+                        state.copy(update={"digest": self.digest}),
+                    )
             else:
-                if self.password == "":
-                    wb = load_workbook(self.excel_file)
-                    ws = wb.worksheets[0]
+                # Only the mtime may have changed, e.g. after restoring a backup
+                self.digest = cache.content_hash(self.excel_file, self.password)
+                if state and state.digest == self.digest:
+                    metrics.inc("cache_hits", cache="corrector_digest")
+                    self.load_state(state)
                 else:
-                    self.log.debug("File requires a password, can't open without Excel")
-                    """
-                       Open workbook in Excel. It has to be Excel because workbook-wide 
-                       encryption creates a weird FAT-like compound archive that can't 
-                       be read with any (currently) existing library.
-                    """
-                    excel = setup_excel()
-                    wb = excel.Workbooks.Open(
-                        self.excel_file, 0, False, None, self.password
-                    )
-                    ws = wb.Worksheets(1)
+                    metrics.inc("cache_misses", cache="corrector_state")
+                    if state and state.digest:
+                        # Solutions of the replaced version are never needed again
+                        cache.discard(state.digest)
+
+                    if self.password == "":
+                        wb = load_workbook(self.excel_file)
+                        ws = wb.worksheets[0]
+                    else:
+                        self.log.debug(
+                            "File requires a password, can't open without Excel"
+                        )
+                        """
+                           Open workbook in Excel. It has to be Excel because workbook-wide 
+                           encryption creates a weird FAT-like compound archive that can't 
+                           be read with any (currently) existing library.
+                        """
+                        excel = setup_excel()
+                        wb = excel.Workbooks.Open(
+                            self.excel_file, 0, False, None, self.password
+                        )
+                        ws = wb.Worksheets(1)
 
-                # Set default dummy count
-                self.dummy_count = 8
+                    # Set default dummy count
+                    self.dummy_count = 8
 
-                # Extract subject
-                self.corrector_title = get_cell(ws, 1, 2)  # B1
-                if not self.corrector_title:
-                    utils.write_error(self.parent_path, "Ungültiger Name im Titel.")
-                    raise ExcelFileException(
-                        "Empty title field. Please specify a valid name."
-                    )
+                    # Extract subject
+                    self.corrector_title = get_cell(ws, 1, 2)  # B1
+                    if not self.corrector_title:
+                        utils.write_error(self.parent_path, "Ungültiger Name im Titel.")
+                        raise ExcelFileException(
+                            "Empty title field. Please specify a valid name."
+                        )
 
-                # Get dummy count, if it is set verify it's a valid int
-                dummy_count = get_cell(ws, 7, 3)  # C7
-                if dummy_count:
-                    if (
-                        not str(dummy_count).isnumeric()
-                        or self.dummy_count < 0
-                        or self.dummy_count > 100
-                    ):
+                    # Get dummy count, if it is set verify it's a valid int
+                    dummy_count = get_cell(ws, 7, 3)  # C7
+                    if dummy_count:
+                        if (
+                            not str(dummy_count).isnumeric()
+                            or self.dummy_count < 0
+                            or self.dummy_count > 100
+                        ):
+                            utils.write_error(
+                                self.parent_path,
+                                "Ungültige Parameterzahl in C7. Bitte wählen Sie einen "
+                                "Wert zwischen 1 und 100 (inklusive).",
+                            )
+                            raise ExcelFileException("Invalid dummy value count")
+                        else:
+                            self.dummy_count = int(dummy_count)  # type: ignore
+
+                    # Name that should be matched against submitted files
+                    self.codename = get_cell(ws, 2, 2)  # B2
+                    if not self.codename:
                         utils.write_error(
                             self.parent_path,
-                            "Ungültige Parameterzahl in C7. Bitte wählen Sie einen "
-                            "Wert zwischen 1 und 100 (inklusive).",
+                            "Dateiname konnte nicht ausgelesen werden.",
                         )
-                        raise ExcelFileException("Invalid dummy value count")
-                    else:
-                        self.dummy_count = int(dummy_count)  # type: ignore
-
-                # Name that should be matched against submitted files
-                self.codename = get_cell(ws, 2, 2)  # B2
-                if not self.codename:
-                    utils.write_error(
-                        self.parent_path, "Dateiname konnte nicht ausgelesen werden."
-                    )
-                    raise ExcelFileException(
-                        "Empty file name field. Please specify a valid name."
-                    )
-                elif ".xlsx" in str(self.codename):
-                    # Remove file ending, might get added accidentally
-                    self.codename = str(self.codename).replace(".xlsx", "")
+                        raise ExcelFileException(
+                            "Empty file name field. Please specify a valid name."
+                        )
+                    elif ".xlsx" in str(self.codename):
+                        # Remove file ending, might get added accidentally
+                        self.codename = str(self.codename).replace(".xlsx", "")
 
-                self.codename = str(self.codename).strip()
-                self.deadline = get_cell(ws, 3, 2)  # B3
-                self.max_attempts = int(get_cell(ws, 4, 2) or 0)  # type: ignore # B4
+                    self.codename = str(self.codename).strip()
+                    self.deadline = get_cell(ws, 3, 2)  # B3
+                    self.max_attempts = int(get_cell(ws, 4, 2) or 0)  # type: ignore # B4
 
-                # Grab exercise info
-                self.set_exercise_rows(ws)
+                    # Grab exercise info
+                    self.set_exercise_rows(ws)
 
             # Check deadline, allow for same-day submissions
             if not isinstance(self.deadline, datetime.datetime):
@@ -463,7 +488,7 @@ class Corrector(Commons):
 
             deadline_date = self.deadline.date()
 
-            if (deadline_date - datetime.date.today()).days < 0:
+            if check_deadline and (deadline_date - datetime.date.today()).days < 0:
                 self.log.info(
                     "Ignoring %s due to deadline (%s)",
                     self.get_relevant_path(),
@@ -488,7 +513,7 @@ class Corrector(Commons):
             # Save state if new/changed
             if not state or change_date != state.change_date:
                 self.log.debug("Updated/created saved state")
-                STATE.correctors[self.get_relevant_path("_")] = CorrectorDict(
+                new_state = CorrectorDict(
                     codename=self.codename,
                     deadline=self.deadline,
                     exercise_ranges=self.exercise_ranges,
@@ -497,8 +522,9 @@ class Corrector(Commons):
                     title=self.corrector_title,
                     change_date=change_date,
                     dummy_count=self.dummy_count,
+                    digest=self.digest,
                 )
-                STATE.save()
+                STATE.set(self.get_relevant_path("_"), new_state)
 
             self.valid = True
         except (pywintypes.com_error, TypeError, ValueError, KeyError):
@@ -523,6 +549,18 @@ class Corrector(Commons):
                 if wb:
                     wb.close()
 
+    def load_state(self, state: CorrectorDict):
+        """
+        Uses saved info instead of reading the workbook, the password is kept
+        """
+        self.codename = state.codename
+        self.deadline = state.deadline
+        self.max_attempts = state.max_attempts
+        self.corrector_title = state.title
+        self.exercise_ranges = state.exercise_ranges
+        self.dummy_count = state.dummy_count
+        self.digest = self.digest or state.digest
+
     def open_excel(self):
         """Opens Excel if necessary"""
         try:
@@ -549,6 +587,18 @@ class Corrector(Commons):
         :param mat_num: Student's matriculation number
         :param dummies: List of dummy values (e.g. a1-a8)
         """
+        solution_cache = (
+            cache.get(self.digest) if self.digest and cache.enabled() else None
+        )
+        if solution_cache:
+            cached = solution_cache.get(mat_num, dummies)
+            if cached:
+                return cached
+
+        if not self.excel_instance:
+            # Only started once a solution isn't cached
+            self.open_excel()
+
         wb = None
         try:
             # Open workbook
@@ -582,6 +632,8 @@ class Corrector(Commons):
                         }
                     )
 
+            if solution_cache:
+                solution_cache.set(mat_num, dummies, solutions)
             return solutions
         except (pywintypes.com_error, TypeError, ValueError):
             self.log.exception("Failed to generate solutions in corrector.")
@@ -636,20 +688,30 @@ class Corrector(Commons):
 
         :param subject_folder: Path in which should be searched
         """
-        extensions = [".xlsx", ".xlsm", ".xls"]
-
         # Ignore folders containing the ignore file
         ignore_file = subject_folder / "PYCOR_IGNORE.txt"
         if ignore_file.exists():
             return None
+
+        corrector_file = Corrector.find_file(subject_folder)
+        if corrector_file:
+            return Corrector(corrector_file)
+        return None
+
+    @staticmethod
+    def find_file(subject_folder: Path) -> typing.Optional[Path]:
+        """
+        Returns the path of `corrector.xls[mx]?` in given path if it exists
+        """
+        extensions = [".xlsx", ".xlsm", ".xls"]
+
         for item in subject_folder.iterdir():
             if (
                 item.is_file()
                 and item.suffix in extensions
                 and item.stem == "corrector"
             ):
-                return Corrector(item)
-
+                return item
         return None
 
     def find_password(self) -> typing.Optional[str]:
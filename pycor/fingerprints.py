@@ -0,0 +1,256 @@
+"""
+MinHash fingerprints of graded submissions, indexed via locality-sensitive hashing to
+find near-identical submissions of different students without comparing all pairs
+"""
+
+import collections
+import datetime
+import hashlib
+import logging
+import random
+import typing
+from pathlib import Path
+
+from pydantic import BaseModel, ValidationError  # type: ignore
+
+from pycor import config, metrics
+
+# Bump whenever tokens or hashing change, older entries are ignored
+FINGERPRINT_VERSION = 1
+# Append-only, one JSON entry per graded submission
+INDEX_FILE = "fingerprint_index.jsonl"
+
+# Signature length is BANDS * ROWS, pairs with a similarity s become candidates with a
+# probability of 1 - (1 - s^ROWS)^BANDS, i.e. ~50% at 0.5 and >99.9% at 0.8
+BANDS = 16
+ROWS = 4
+
+_PRIME = (1 << 61) - 1
+# Seeded, stored signatures have to stay comparable across restarts
+_rnd = random.Random(FINGERPRINT_VERSION)
+_PERMUTATIONS = [
+    (_rnd.randrange(1, _PRIME), _rnd.randrange(0, _PRIME)) for _ in range(BANDS * ROWS)
+]
+
+log = logging.getLogger("PyCor").getChild("Fingerprints")
+
+
+class Fingerprint(BaseModel):
+    version: int = FINGERPRINT_VERSION
+    student: str
+    file: str
+    signature: typing.List[int]
+
+
+def normalize(value: typing.Any) -> str:
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        # Ignore float noise from Excel
+        return f"{float(value):.10g}"
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value).strip().lower()
+
+
+def tokens(
+    dummies: typing.List[typing.Any], solutions: typing.List[typing.List[typing.Any]]
+) -> typing.Set[str]:
+    """
+    Position-tagged dummies and answers, empty cells are skipped
+    """
+    ret = {f"d{idx}={normalize(value)}" for idx, value in enumerate(dummies)}
+    for ex, answers in enumerate(solutions):
+        for idx, value in enumerate(answers):
+            if value is not None:
+                ret.add(f"e{ex}.{idx}={normalize(value)}")
+    return ret
+
+
+def signature(token_set: typing.Set[str]) -> typing.List[int]:
+    hashes = [
+        int.from_bytes(
+            hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        for t in token_set
+    ]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(a: typing.List[int], b: typing.List[int]) -> float:
+    """
+    Estimated Jaccard similarity of the token sets
+    """
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class FingerprintIndex:
+    def __init__(self, subject_folder: Path):
+        self.index_file = subject_folder / INDEX_FILE
+        self.threshold = getattr(config, "FINGERPRINT_SIMILARITY", 0.9)
+
+        self.fingerprints: typing.List[Fingerprint] = []
+        # Band number and hash of its rows as key, positions in fingerprints as value
+        self.buckets: typing.DefaultDict[typing.Tuple[int, int], typing.List[int]] = (
+            collections.defaultdict(list)
+        )
+        # Pairs of students as key, highest similarity and amount of matches as value
+        self.pairs: typing.Dict[typing.Tuple[str, str], typing.Tuple[float, int]] = {}
+
+        # Entries not written to the index file yet
+        self.pending: typing.List[Fingerprint] = []
+
+        if self.index_file.exists():
+            self.load()
+
+    def load(self):
+        for line in self.index_file.read_text().splitlines():
+            try:
+                fingerprint = Fingerprint.parse_raw(line)
+            except ValidationError:
+                continue
+            if fingerprint.version == FINGERPRINT_VERSION:
+                self.insert(fingerprint)
+
+    def insert(self, fingerprint: Fingerprint) -> typing.List[typing.Tuple[str, float]]:
+        """
+        Adds the fingerprint, returns other students with a similar submission
+        """
+        position = len(self.fingerprints)
+        self.fingerprints.append(fingerprint)
+
+        candidates = set()
+        for band in range(BANDS):
+            key = (
+                band,
+                hash(tuple(fingerprint.signature[band * ROWS : (band + 1) * ROWS])),
+            )
+            candidates.update(self.buckets[key])
+            self.buckets[key].append(position)
+
+        matches: typing.Dict[str, float] = {}
+        for candidate in candidates:
+            other = self.fingerprints[candidate]
+            if other.student == fingerprint.student:
+                continue
+            score = similarity(fingerprint.signature, other.signature)
+            if score >= self.threshold:
+                matches[other.student] = max(score, matches.get(other.student, 0))
+
+        for student, score in matches.items():
+            pair = tuple(sorted((student, fingerprint.student)))
+            best, count = self.pairs.get(pair, (0, 0))  # type: ignore
+            self.pairs[pair] = (max(best, score), count + 1)  # type: ignore
+        return sorted(matches.items())
+
+    def add(
+        self,
+        student: str,
+        file_name: str,
+        dummies: typing.List[typing.Any],
+        solutions: typing.List[typing.List[typing.Any]],
+    ) -> typing.List[typing.Tuple[str, float]]:
+        """
+        Fingerprints a graded submission, returns other students with a similar one
+        """
+        token_set = tokens(dummies, solutions)
+        if len(token_set) <= len(dummies):
+            # Nothing answered
+            return []
+
+        fingerprint = Fingerprint(
+            student=student, file=file_name, signature=signature(token_set)
+        )
+        self.pending.append(fingerprint)
+        return self.insert(fingerprint)
+
+    def flush(self):
+        """
+        Appends all new fingerprints to the index file
+        """
+        if not self.pending:
+            return
+        try:
+            with self.index_file.open("a") as f:
+                f.writelines(fingerprint.json() + "\n" for fingerprint in self.pending)
+            self.pending = []
+        except IOError:
+            log.exception("Failed to save fingerprint index.")
+
+    def clusters(self) -> typing.List[typing.Tuple[typing.List[str], float, int]]:
+        """
+        Groups students connected by similar submissions, returns the students, the
+        highest similarity and the amount of matches per cluster
+        """
+        parents: typing.Dict[str, str] = {}
+
+        def find(student: str) -> str:
+            parents.setdefault(student, student)
+            while parents[student] != student:
+                parents[student] = parents[parents[student]]
+                student = parents[student]
+            return student
+
+        for a, b in self.pairs:
+            parents[find(a)] = find(b)
+
+        groups: typing.DefaultDict[str, typing.List[str]] = collections.defaultdict(
+            list
+        )
+        for student in list(parents):
+            groups[find(student)].append(student)
+
+        # Highest similarity and amount of matches per cluster
+        stats: typing.Dict[str, typing.Tuple[float, int]] = {}
+        for pair, (score, count) in self.pairs.items():
+            root = find(pair[0])
+            best, total = stats.get(root, (0, 0))
+            stats[root] = (max(best, score), total + count)
+
+        ret = [(sorted(students), *stats[root]) for root, students in groups.items()]
+        return sorted(ret, key=lambda cluster: (-len(cluster[0]), cluster[0]))
+
+
+# Subject folder as key, kept across cycles
+_INDEXES: typing.Dict[Path, FingerprintIndex] = {}
+
+
+def enabled() -> bool:
+    return getattr(config, "FINGERPRINT_SIMILARITY", 0.9) is not None
+
+
+def get(subject_folder: Path) -> FingerprintIndex:
+    subject_folder = subject_folder.resolve()
+    if subject_folder not in _INDEXES:
+        _INDEXES[subject_folder] = FingerprintIndex(subject_folder)
+    return _INDEXES[subject_folder]
+
+
+def add(
+    student_folder: Path,
+    file_name: str,
+    dummies: typing.List[typing.Any],
+    solutions: typing.List[typing.List[typing.Any]],
+):
+    """
+    Fingerprints a graded submission and logs similar submissions of other students
+    """
+    if not enabled():
+        return
+    with metrics.timer("fingerprint"):
+        matches = get(student_folder.parent).add(
+            student_folder.name, file_name, dummies, solutions
+        )
+    for student, score in matches:
+        log.warning(
+            "Submission of %s matches %s (similarity %.2f)",
+            student_folder.name,
+            student,
+            score,
+        )
+        metrics.inc("near_duplicates")
+
+
+def flush():
+    for index in _INDEXES.values():
+        index.flush()
@@ -0,0 +1,311 @@
+"""
+Write-ahead journal of each submission's lifecycle. A crash mid-cycle resumes from
+the last completed step instead of refetching, regrading or double-counting attempts.
+"""
+
+import datetime
+import logging
+import typing
+import uuid
+from concurrent import futures
+from pathlib import Path
+
+from pydantic import BaseModel, ValidationError  # type: ignore
+
+from pycor import delivery, excel, matnums, metrics, records, utils
+
+if typing.TYPE_CHECKING:
+    from pycor import mail
+
+JOURNAL_DIR = Path("journal")
+
+# Lifecycle of a submission, the entry is deleted once all mails are sent
+FETCHED = "fetched"  # Mail downloaded, only kept in memory
+SAVED = "saved"  # Attachment saved, mail marked as seen
+GRADED = "graded"  # Attempts and mails determined, record not saved yet
+COMMITTED = "committed"  # Record saved, mails may be pending
+
+# Saved submissions are regraded this many times after a crash, then given up
+MAX_RESUMES = 3
+
+log = logging.getLogger("PyCor").getChild("Journal")
+
+
+class Outgoing(BaseModel):
+    recipient: str
+    subject: str
+    content: str
+    sent: bool = False
+
+
+class Entry(BaseModel):
+    id: str = ""
+    # Entries of replayed mails are not persisted
+    journaled: bool = True
+    step: str = FETCHED
+    # IMAP UID of the mail
+    uid: typing.Optional[str] = None
+
+    student: typing.Optional[Path] = None
+    codename: typing.Optional[str] = None
+    received: typing.Optional[float] = None
+    # Times grading was resumed after a crash, see :data:`MAX_RESUMES`
+    resumes: int = 0
+
+    mat_num: int = 0
+    max_attempts: int = 0
+    # (exercise, percentage) per attempt of this submission
+    attempts: typing.List[typing.Tuple[int, int]] = []
+    outbox: typing.List[Outgoing] = []
+    # Mails are written to this file instead of being sent
+    result_file: typing.Optional[Path] = None
+
+    def send(self, recipient: str, subject: str, content: str):
+        """
+        Queues a mail, sent by :func:`deliver`
+        """
+        self.outbox.append(
+            Outgoing(recipient=recipient, subject=subject, content=content)
+        )
+
+
+def write(entry: Entry):
+    if not entry.journaled:
+        return
+    with metrics.timer("journal"):
+        JOURNAL_DIR.mkdir(exist_ok=True)
+        utils.write_atomic(JOURNAL_DIR / f"{entry.id}.json", entry.json())
+
+
+def discard(entry: Entry):
+    if not entry.journaled:
+        return
+    with metrics.timer("journal"):
+        try:
+            (JOURNAL_DIR / f"{entry.id}.json").unlink()
+        except FileNotFoundError:
+            pass
+
+
+def fetched(uid: str) -> Entry:
+    """
+    Creates the entry of a downloaded mail, first written once its attachment is saved.
+    Until then the mail is still unseen and simply fetched again after a crash.
+    """
+    return Entry(id=uuid.uuid4().hex, uid=uid)
+
+
+def saved(entry: Entry, submission: typing.Dict):
+    entry.step = SAVED
+    entry.student = submission["student"]
+    entry.codename = submission["corrector"].codename.lower()
+    entry.received = submission["received"]
+    write(entry)
+
+
+def commit(entry: Entry, student: excel.Student, max_attempts: int):
+    """
+    Journals the submission's attempts and mails, then saves the student's record
+    """
+    entry.step = GRADED
+    entry.mat_num = student.mat_num
+    entry.max_attempts = max_attempts
+    write(entry)
+
+    with metrics.timer("stats_io"):
+        student.save_record()
+
+    # Not written, resuming a graded entry skips records already containing it and
+    # the entry is usually discarded right after its mails were sent
+    entry.step = COMMITTED
+
+
+# Entries whose mails are being delivered, see :func:`complete`
+_DELIVERING: typing.List[
+    typing.Tuple[Entry, typing.List[typing.Tuple[Outgoing, futures.Future]]]
+] = []
+
+
+def deliver(entry: Entry, mail_instance: "mail.Mail"):
+    """
+    Queues all mails which weren't sent yet, the entry is completed by :func:`complete`
+    """
+    pending = [outgoing for outgoing in entry.outbox if not outgoing.sent]
+    if pending and entry.result_file is not None:
+        write_results(entry)
+        pending = []
+    if not pending:
+        discard(entry)
+        return
+
+    if entry.step != COMMITTED:
+        # Rejected submissions skip committing, journal their mails anyway
+        entry.step = COMMITTED
+        write(entry)
+
+    _DELIVERING.append(
+        (
+            entry,
+            [
+                (
+                    outgoing,
+                    mail_instance.send(
+                        outgoing.recipient, outgoing.subject, outgoing.content
+                    ),
+                )
+                for outgoing in pending
+            ],
+        )
+    )
+    complete()
+
+
+def write_results(entry: Entry):
+    """
+    Writes all mails of the entry to its result file and marks them as sent
+    """
+    entry.result_file.parent.mkdir(parents=True, exist_ok=True)
+    utils.write_atomic(
+        entry.result_file,
+        "".join(
+            f"<h2>{outgoing.subject}</h2>\n{outgoing.content}\n"
+            for outgoing in entry.outbox
+        ),
+    )
+    for outgoing in entry.outbox:
+        outgoing.sent = True
+
+
+def complete(wait: bool = False):
+    """
+    Marks delivered mails as sent and discards entries without pending mails. Entries
+    whose mails couldn't be delivered are kept for the next cycle.
+
+    :param wait: Block until all queued mails are delivered
+    """
+    for item in list(_DELIVERING):
+        entry, sending = item
+        if wait:
+            futures.wait([future for _, future in sending])
+
+        changed = False
+        for outgoing, future in sending:
+            if outgoing.sent or not future.done():
+                continue
+            exc = future.exception()
+            if isinstance(exc, delivery.DeliveryException):
+                # Relay unavailable, retried next cycle
+                continue
+            # Permanently rejected mails are not retried either
+            outgoing.sent = True
+            changed = True
+
+        if all(future.done() for _, future in sending):
+            _DELIVERING.remove(item)
+            if all(outgoing.sent for outgoing in entry.outbox):
+                discard(entry)
+                continue
+        if changed:
+            write(entry)
+
+
+def load() -> typing.List[Entry]:
+    if not JOURNAL_DIR.exists():
+        return []
+
+    entries = []
+    for item in JOURNAL_DIR.glob("*.json"):
+        try:
+            entries.append(Entry.parse_file(item))
+        except (OSError, ValueError, ValidationError):
+            log.exception("Discarding unreadable journal entry %s", item.name)
+            item.unlink()
+    return entries
+
+
+def known_uids() -> typing.Set[str]:
+    """
+    UIDs of mails which were saved but may not have been marked as seen
+    """
+    return {entry.uid for entry in load() if entry.uid and entry.step != FETCHED}
+
+
+def apply_attempts(entry: Entry):
+    """
+    Applies the journaled attempts unless the record already contains them
+    """
+    if not entry.attempts:
+        return
+    student_folder = entry.student.parent
+    record = records.load(student_folder)
+    if entry.student.name in record.submissions:
+        return
+
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for exercise, percentage in entry.attempts:
+        record.update_stats(
+            exercise, percentage, entry.max_attempts, timestamp, entry.mat_num
+        )
+    record.submissions.append(entry.student.name)
+    records.save(student_folder, record)
+    matnums.add(student_folder, entry.mat_num)
+
+
+def resume(
+    valid_filenames: typing.Dict[str, excel.Corrector],
+    mail_instance: "mail.Mail",
+    owned: typing.Callable[[str], bool] = lambda entry_id: False,
+) -> typing.List[typing.Dict]:
+    """
+    Completes the entries of an interrupted cycle, returns saved submissions which
+    still have to be graded
+
+    :param owned: Whether an entry is still being processed, e.g. a queued upload
+    """
+    student_files = []
+    for entry in load():
+        if owned(entry.id):
+            continue
+        log.info("Resuming %s submission %s", entry.step, entry.student or entry.uid)
+        metrics.inc("journal_resumed", step=entry.step)
+
+        if entry.step == FETCHED:
+            # The mail wasn't marked as seen and is fetched again
+            discard(entry)
+        elif entry.step == SAVED:
+            corrector = valid_filenames.get(entry.codename or "")
+            if corrector is None or not entry.student.exists():
+                log.warning("Can't regrade %s, discarding", entry.student)
+                discard(entry)
+                continue
+            if entry.resumes >= MAX_RESUMES:
+                # The submission most likely crashes the daemon itself
+                from pycor import mail
+
+                log.error(
+                    "Giving up on %s after %s resumes", entry.student, entry.resumes
+                )
+                metrics.inc("rejections", reason="error_processing")
+                entry.send(
+                    entry.student.parent.name,
+                    *mail.Generator.error_processing(corrector.corrector_title),
+                )
+                deliver(entry, mail_instance)
+                continue
+            entry.resumes += 1
+            write(entry)
+            student_files.append(
+                {
+                    "student": entry.student,
+                    "corrector": corrector,
+                    "received": entry.received,
+                    "journal": entry,
+                }
+            )
+        else:
+            if entry.step == GRADED:
+                apply_attempts(entry)
+                entry.step = COMMITTED
+                write(entry)
+            deliver(entry, mail_instance)
+    return student_files
@@ -3,19 +3,29 @@ import email.errors
 import email.header
 import email.mime.multipart
 import email.mime.text
+import hashlib
 import imaplib
 import logging
 import os
-import smtplib
+import re
 import time
 import typing
+from concurrent import futures
 from email.utils import formatdate
 from pathlib import Path
 
-from pycor import config, excel, utils
+from pycor import config, delivery, excel, journal, metrics, records, sessions, utils
 
 EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
+# Dot-atom local part and domain, the address is used as folder name
+ADDRESS = re.compile(
+    r"^[A-Za-z0-9!#$%&'*+=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+=?^_`{|}~-]+)*"
+    r"@[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)+$"
+)
+
+log = logging.getLogger("PyCor").getChild("Mail")
+
 
 class LoginException(BaseException):
     pass
@@ -70,6 +80,43 @@ def _filter(
     return msg, _encode_name(msg.get_filename()).lower().endswith(".xlsx")
 
 
+def _received(msg: email.message.Message) -> float:
+    """
+    Returns the mail's Date header as timestamp, the current time if it's missing/invalid
+    """
+    try:
+        return email.utils.parsedate_to_datetime(msg["Date"]).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return time.time()
+
+
+def message_key(msg: email.message.Message) -> typing.Optional[str]:
+    """
+    Digest of the mail's Message-ID, names the saved attachment to recognize the mail
+    """
+    message_id = (msg["Message-ID"] or "").strip()
+    if not message_id:
+        return None
+    return hashlib.sha1(message_id.encode("utf-8", "replace")).hexdigest()[:16]
+
+
+def already_submitted(student_folder: Path, key: str) -> bool:
+    """
+    Whether the mail's attachment was already saved or graded, e.g. when replaying
+    overlapping Maildirs
+    """
+    suffix = f"_{key}.xlsx"
+    if not student_folder.is_dir():
+        return False
+    # Coalesced submissions are archived without being recorded
+    for folder in (student_folder, student_folder / utils.SUPERSEDED_FOLDER):
+        if any(folder.glob(f"*{suffix}")):
+            return True
+    return any(
+        name.endswith(suffix) for name in records.load(student_folder).submissions
+    )
+
+
 def filter_files(msg: email.message.Message) -> typing.List[email.message.Message]:
     _files = []
     for _ in typing.cast(typing.Iterable[email.message.Message], msg.get_payload()):
@@ -80,170 +127,310 @@ def filter_files(msg: email.message.Message) -> typing.List[email.message.Messag
     return _files
 
 
+def accepted_address(address: str) -> bool:
+    """
+    Whether the address is well-formed and belongs to one of the accepted domains
+    """
+    if not ADDRESS.match(address):
+        return False
+    return address.rpartition("@")[2] in config.ACCEPTED_DOMAINS
+
+
+def find_corrector(
+    file_name: str, valid_filenames: typing.Dict[str, excel.Corrector]
+) -> typing.Optional[excel.Corrector]:
+    """
+    Matches a submitted file name against the registered codenames
+    """
+    return valid_filenames.get(file_name.lower().replace(".xlsx", "").strip())
+
+
+def submission_path(
+    student_email: str,
+    subject: excel.Corrector,
+    received: typing.Optional[float] = None,
+    folder: typing.Optional[Path] = None,
+    key: typing.Optional[str] = None,
+) -> typing.Optional[Path]:
+    """
+    Returns a new path in the student's folder, None if the folder couldn't be created
+
+    :param student_email: Student's email address
+    :param subject: :class:`excel.Corrector` instance that contains necessary paths
+    :param received: Timestamp used in the file name, defaults to the current time
+    :param folder: Folder containing the student folders, defaults to the subject's
+    :param key: Used in the file name instead of a random string, see :func:`message_key`
+    """
+    user_dir = (folder or subject.parent_path) / student_email
+
+    # Create folder
+    try:
+        user_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        log.exception("Failed to create user folder.")
+        return None
+
+    # Save file in proper folder
+    saved = (
+        datetime.datetime.fromtimestamp(received)
+        if received is not None
+        else datetime.datetime.now()
+    )
+    return user_dir / "{}_{}.xlsx".format(
+        datetime.datetime.strftime(saved, "%Y-%m-%d %H.%M.%S"),
+        key or utils.random_string(),
+    )
+
+
+def save_submission(
+    content: bytes,
+    student_email: str,
+    subject: excel.Corrector,
+    received: typing.Optional[float] = None,
+    folder: typing.Optional[Path] = None,
+    key: typing.Optional[str] = None,
+) -> typing.Optional[Path]:
+    """
+    Saves a submitted file to the student's folder and returns its path, None if the
+    folder couldn't be created
+
+    :param content: The xlsx file
+    :param student_email: Student's email address
+    :param subject: :class:`excel.Corrector` instance that contains necessary paths
+    :param received: Timestamp used in the file name, defaults to the current time
+    :param folder: Folder containing the student folders, defaults to the subject's
+    :param key: Used in the file name instead of a random string, see :func:`message_key`
+    """
+    file_path = submission_path(student_email, subject, received, folder, key)
+    if file_path is None:
+        return None
+
+    with file_path.open("wb") as fp:
+        fp.write(content)
+
+    log.debug("Saved file to %s", os.sep.join(file_path.parts[-3:]))
+
+    return file_path
+
+
 class Mail:
-    def __init__(self):
-        self.log = logging.getLogger("PyCor").getChild("Mail")
+    def __init__(
+        self,
+        login: bool = True,
+        dry_run: bool = False,
+        scratch: typing.Optional[Path] = None,
+    ):
+        """
+        :param login: Log in to the IMAP server, not needed when replaying local mails
+        :param dry_run: Don't send any mails
+        :param scratch: Save attachments below this folder instead of the subjects',
+            they're graded against a copy of the student's record
+        """
+        self.log = log
 
         self.username = config.MAIL_USER
         self.password = config.MAIL_PASS
 
-        self.imap: typing.Optional[imaplib.IMAP4_SSL] = None
-        self.smtp: typing.Optional[smtplib.SMTP] = None
-        self.smtp_connected: typing.Optional[float] = None
+        # Shared across cycles, see :mod:`pycor.sessions`
+        self.imap: typing.Optional[sessions.ImapSession] = None
+        # Sends mails in background threads, started with the first mail
+        self.delivery: typing.Optional[delivery.Delivery] = None
+        # Queued mails, saved to Sent once delivered
+        self.outstanding: typing.List[
+            typing.Tuple[futures.Future, email.message.Message]
+        ] = []
 
-        # Login
-        self.imap_login()
+        # Whether check_inbox left mails for the next cycle
+        self.truncated = False
+        self.dry_run = dry_run
+        self.scratch = scratch
 
-        self.log.info("%s - Successfully logged in", self.username)
+        # Login
+        if login:
+            self.imap_login()
+            self.log.debug("%s - Session ready", self.username)
 
     def imap_login(self):
         try:
-            self.imap = imaplib.IMAP4_SSL(config.MAIL_IMAP)
-            self.imap.login(self.username, self.password)
-            self.imap.select("INBOX")
+            self.imap = sessions.imap(
+                config.MAIL_IMAP,
+                self.username,
+                self.password,
+                getattr(config, "MAIL_IMAP_PORT", None),
+                getattr(config, "MAIL_IMAP_SSL", True),
+            )
         except (imaplib.IMAP4.error, ConnectionError, TimeoutError):
             self.log.exception("Failed to login to IMAP server.")
             raise LoginException
 
-    def smtp_login(self):
-        # Log out if logged in
-        if self.smtp:
-            self.logout(smtp_only=True)
-
-        # Retry login a few times
-        for _ in range(5):
-            try:
-                self.smtp = smtplib.SMTP(config.MAIL_SMTP, 587)
-                self.smtp.ehlo()
-                self.smtp.starttls()
-                self.smtp.login(config.MAIL_USER, config.MAIL_PASS)
-                self.smtp_connected = time.time()
-                return
-            except smtplib.SMTPException:
-                self.log.exception("Failed to login to SMTP server.")
-                time.sleep(30)
-
-        raise LoginException
-
-    def logout(self, smtp_only=False):
-        if self.smtp:
-            try:
-                self.smtp.quit()
-            except smtplib.SMTPServerDisconnected:
-                # Ignore disconnect, that's kinda what we want to do anyway
-                pass
-        self.smtp_connected = None
-
-        if self.imap and not smtp_only:
-            self.imap.close()
-            self.imap.logout()
+    def logout(self):
+        """
+        Delivers all queued mails, the IMAP session is kept for the next cycle
+        """
+        self.flush()
+        if self.delivery:
+            self.delivery.close()
+            self.delivery = None
 
     def check_inbox(
         self, valid_filenames: typing.Dict[str, excel.Corrector]
     ) -> typing.Optional[typing.List[typing.Dict]]:
-        ret, message_str = self.imap.search(None, "(UNSEEN)")
+        ret, message_str = self.imap.uid("SEARCH", None, "(UNSEEN)")
         corr_files = []
 
         if ret == "OK":
-            message_ids = message_str[0].split()
-            for message_id in message_ids:
+            uids = [uid.decode() for uid in message_str[0].split()]
+
+            # Leave the remaining mails for the next cycle
+            batch_limit = getattr(config, "MAX_SUBMISSIONS_PER_CYCLE", None)
+            if batch_limit and len(uids) > batch_limit:
+                self.log.info("Processing %s of %s new mails", batch_limit, len(uids))
+                uids = uids[:batch_limit]
+                # Unless marked as seen the same mails are fetched again right away
+                self.truncated = getattr(config, "MARK_MAILS_AS_READ", False)
+
+            # Saved before a crash but not marked as seen, resumed from the journal
+            known_uids = journal.known_uids()
+
+            for uid in uids:
+                if uid in known_uids:
+                    self.mark_seen(uid)
+                    continue
+
+                entry = journal.fetched(uid)
                 # In theory this could fail IF someone deletes the message before it is fetched.
                 # This should just result in an empty mail however.
-                _, data = self.imap.fetch(message_id, "(RFC822)")
-
-                # Keep mail as unread if in debug mode
-                if not (
-                    hasattr(config, "MARK_MAILS_AS_READ") and config.MARK_MAILS_AS_READ
-                ):
-                    self.imap.store(message_id, "-FLAGS", "\\Seen")
+                # BODY.PEEK leaves the mail unseen until its attachment is saved.
+                with metrics.timer("imap_fetch"):
+                    _, data = self.imap.uid("FETCH", uid, "(BODY.PEEK[])")
 
                 msg: email.message.Message = email.message_from_bytes(data[0][1])
+                submission = self.process_message(msg, valid_filenames)
+                if submission:
+                    journal.saved(entry, submission)
+                    submission["journal"] = entry
+                    corr_files.append(submission)
+                self.mark_seen(uid)
 
-                self.log.info(
-                    "%s - Downloading message from %s (%s)",
-                    self.username,
-                    msg["From"],
-                    msg["Subject"],
-                )
+        return corr_files
 
-                student_email = email.utils.parseaddr(msg["From"])[1]
+    def mark_seen(self, uid: str):
+        # Keep mail as unread if in debug mode
+        if getattr(config, "MARK_MAILS_AS_READ", False):
+            self.imap.uid("STORE", uid, "+FLAGS", "(\\Seen)")
 
-                if (
-                    any(
-                        _ in student_email
-                        for _ in ["noreply", "no-reply", "mailer-daemon"]
-                    )
-                    or student_email == self.username
-                ):
-                    # Ignore mailer-daemon, no-reply, or own account
-                    continue
-                elif any(
-                    student_email.endswith(f"@{domain}")
-                    for domain in config.ACCEPTED_DOMAINS
-                ):
-                    # Forward mails to admin if subject contains "problem"
-                    if (
-                        msg["Subject"]
-                        and "problem" in msg["Subject"].lower()
-                        and config.ADMIN_CONTACT
-                    ):
-                        msg.replace_header(
-                            "Subject", f"PyCor: {msg['Subject']} from {msg['From']}"
-                        )
-                        msg.replace_header(
-                            "From", "PyCor <{}>".format(config.MAIL_FROM)
-                        )
-                        msg.replace_header("To", config.ADMIN_CONTACT)
-                        msg.replace_header("Date", formatdate(localtime=True))
-                        self.send(config.ADMIN_CONTACT, "", msg)
-                        self.send(student_email, *Generator.problem_forwarded())
-                        continue
-
-                    possible_files = filter_files(msg)
-
-                    if len(possible_files) != 1:
-                        # No file, multiple files or invalid file. Notify student
-                        self.log.warning(
-                            "Student submitted %s files.", len(possible_files)
-                        )
-                        self.send(student_email, *Generator.invalid_attachment())
-                        continue
-
-                    file_name = _encode_name(possible_files[0].get_filename())
-                    stripped_filename = file_name.lower().replace(".xlsx", "").strip()
-                    subject_corrector = None
-                    for valid_filename, corr in valid_filenames.items():
-                        if valid_filename == stripped_filename:
-                            subject_corrector = corr
-
-                    if not subject_corrector:
-                        # Unknown subject. Notify student
-                        self.log.warning("Student submitted unknown subject.")
-
-                        self.send(
-                            student_email, *Generator.unknown_attachment(file_name)
-                        )
-                        continue
+    def process_message(
+        self,
+        msg: email.message.Message,
+        valid_filenames: typing.Dict[str, excel.Corrector],
+        keep_date: bool = False,
+    ) -> typing.Optional[typing.Dict]:
+        """
+        Filters a mail, matches its attachment against the registered codenames and saves
+        it. Returns the submission or None if the mail was rejected.
 
-                    downloaded_file = self.download_attachment(
-                        possible_files[0], student_email, subject_corrector
-                    )
+        :param msg: The mail
+        :param valid_filenames: Codenames as key, :class:`excel.Corrector` as value
+        :param keep_date: Name the saved file after the mail's date instead of the current time
+        """
+        self.log.info(
+            "%s - Downloading message from %s (%s)",
+            self.username,
+            msg["From"],
+            msg["Subject"],
+        )
 
-                    if downloaded_file:
-                        corr_files.append(
-                            {"student": downloaded_file, "corrector": subject_corrector}
-                        )
-                        self.log.info("Accepted submitted file")
+        student_email = email.utils.parseaddr(msg["From"])[1]
 
-                else:
-                    # Notify sender about wrong email address
-                    self.log.debug("Wrong address")
-                    self.send(student_email, *Generator.wrong_address())
+        if (
+            any(_ in student_email for _ in ["noreply", "no-reply", "mailer-daemon"])
+            or student_email == self.username
+        ):
+            # Ignore mailer-daemon, no-reply, or own account
+            metrics.inc("rejections", reason="ignored_sender")
+            return None
+        elif accepted_address(student_email):
+            # Forward mails to admin if subject contains "problem"
+            if (
+                msg["Subject"]
+                and "problem" in msg["Subject"].lower()
+                and config.ADMIN_CONTACT
+            ):
+                msg.replace_header(
+                    "Subject", f"PyCor: {msg['Subject']} from {msg['From']}"
+                )
+                msg.replace_header("From", "PyCor <{}>".format(config.MAIL_FROM))
+                msg.replace_header("To", config.ADMIN_CONTACT)
+                msg.replace_header("Date", formatdate(localtime=True))
+                self.send(config.ADMIN_CONTACT, "", msg)
+                self.send(student_email, *Generator.problem_forwarded())
+                metrics.inc("rejections", reason="problem_forwarded")
+                return None
+
+            possible_files = filter_files(msg)
+
+            if len(possible_files) != 1:
+                # No file, multiple files or invalid file. Notify student
+                self.log.warning("Student submitted %s files.", len(possible_files))
+                metrics.inc("rejections", reason="invalid_attachment")
+                self.send(student_email, *Generator.invalid_attachment())
+                return None
+
+            file_name = _encode_name(possible_files[0].get_filename())
+            subject_corrector = find_corrector(file_name, valid_filenames)
+
+            if not subject_corrector:
+                # Unknown subject. Notify student
+                self.log.warning("Student submitted unknown subject.")
+                metrics.inc("rejections", reason="unknown_attachment")
+
+                self.send(student_email, *Generator.unknown_attachment(file_name))
+                return None
+
+            key = message_key(msg)
+            if key and any(
+                already_submitted(folder / student_email, key)
+                for folder in {
+                    subject_corrector.parent_path,
+                    self.subject_folder(subject_corrector),
+                }
+            ):
+                self.log.info("Skipping already submitted mail %s", msg["Message-ID"])
+                metrics.inc("rejections", reason="duplicate")
+                return None
+
+            received = _received(msg)
+            with metrics.timer("attachment_save"):
+                downloaded_file = self.download_attachment(
+                    possible_files[0],
+                    student_email,
+                    subject_corrector,
+                    received if keep_date else None,
+                    key,
+                )
 
-        return corr_files
+            if downloaded_file:
+                self.log.info("Accepted submitted file")
+                return {
+                    "student": downloaded_file,
+                    "corrector": subject_corrector,
+                    "received": received,
+                }
+        else:
+            # Notify sender about wrong email address
+            self.log.debug("Wrong address")
+            metrics.inc("rejections", reason="wrong_address")
+            self.send(student_email, *Generator.wrong_address())
+
+        return None
 
     def download_attachment(
-        self, _file: email.message.Message, student_email: str, subject: excel.Corrector
+        self,
+        _file: email.message.Message,
+        student_email: str,
+        subject: excel.Corrector,
+        received: typing.Optional[float] = None,
+        key: typing.Optional[str] = None,
     ) -> typing.Optional[Path]:
         """
         Downloads attachment and returns the full path to it.
@@ -252,37 +439,46 @@ class Mail:
         :param _file: Message
         :param student_email: Student's email address
         :param subject: :class:`excel.Corrector` instance that contains necessary paths
+        :param received: Timestamp used in the file name, defaults to the current time
+        :param key: Identifies the mail in the file name, see :func:`message_key`
         :return: Full path to downloaded file OR None
         """
+        folder = self.subject_folder(subject)
+        if self.scratch is not None:
+            student_folder = folder / student_email
+            # Attempts are counted against a copy, the subject's folder stays untouched
+            if not student_folder.exists():
+                student_folder.mkdir(parents=True)
+                records.save(
+                    student_folder, records.load(subject.parent_path / student_email)
+                )
 
-        user_dir = subject.parent_path / student_email
-
-        # Create folder
-        try:
-            user_dir.mkdir(exist_ok=True)
-        except OSError:
-            self.log.exception("Failed to create user folder.")
-            return None
-
-        # Save file in proper folder
-        file_path = user_dir / "{}_{}.xlsx".format(
-            datetime.datetime.strftime(datetime.datetime.now(), "%Y-%m-%d %H.%M.%S"),
-            utils.random_string(),
+        return save_submission(
+            _file.get_payload(decode=True),
+            student_email,
+            subject,
+            received,
+            folder,
+            key,
         )
 
-        with file_path.open("wb") as fp:
-            fp.write(_file.get_payload(decode=True))
-
-        self.log.debug("Saved file to %s", os.sep.join(file_path.parts[-3:]))
-
-        return file_path
+    def subject_folder(self, subject: excel.Corrector) -> Path:
+        """
+        Folder the student folders of the subject are saved to, see :attr:`scratch`
+        """
+        if self.scratch is None:
+            return subject.parent_path
+        return self.scratch.joinpath(*subject.parent_path.parts[1:])
 
     def send(
         self,
         recipient: str,
         subject: str,
         content: typing.Union[str, email.message.Message],
-    ):
+    ) -> futures.Future:
+        """
+        Queues a mail for delivery, the future's result is the sent message
+        """
         # Mail is forwarded
         if isinstance(content, email.message.Message):
             msg = content
@@ -295,70 +491,65 @@ class Mail:
             msg["Date"] = formatdate(localtime=True)
 
         # Don't send emails if in debug mode
-        if hasattr(config, "DISABLE_OUTGOING_MAIL") and config.DISABLE_OUTGOING_MAIL:
+        if self.dry_run or (
+            hasattr(config, "DISABLE_OUTGOING_MAIL") and config.DISABLE_OUTGOING_MAIL
+        ):
             self.log.debug("Sending mail: %s", content)
-            return
+            future: futures.Future = futures.Future()
+            future.set_result(msg)
+            return future
 
         # Attach html content if it's not a forwarded mail
         if isinstance(content, str):
             msg.attach(email.mime.text.MIMEText(content, "html", "utf-8"))
 
-        try:
-            # Avoid reconnecting multiple times
-            if (
-                self.smtp_connected is None
-                or time.time() - self.smtp_connected > 5 * 60  # Over 5 minutes
-            ):
-                self.smtp_login()
-
-            # Retry sending the mail a few times
-            # TODO: Hello potential successor, please move mails to a different worker thread or just use Celery.
-            #       Message handling should not be in the main thread if every small thing
-            #       might go down at random.
-            for _ in range(6):
-                try:
-                    self.smtp.sendmail(config.MAIL_FROM, recipient, msg.as_bytes())
-                    self.log.info("Sent mail to %s", recipient)
-                    break
-                except smtplib.SMTPServerDisconnected:
-                    if _ < 5:
-                        self.log.error("Failed to send email, will retry")
-                        self.smtp_login()
-                    else:
-                        self.log.critical(
-                            "SMTP server still did not respond correctly. Raising exception."
-                        )
-                        raise LoginException
-        except LoginException:
-            self.log.error("Failed to send mail to %s", recipient)
-            raise
-        else:
-            # Save mail to Sent
-            try:
-                self.imap.append(
-                    "Sent",
-                    "\\Seen",
-                    imaplib.Time2Internaldate(time.time()),
-                    str(msg).encode("utf-8"),
-                )
-            except imaplib.IMAP4.abort:
-                # Retry saving the mail
-                self.imap_login()
-                self.imap.append(
-                    "Sent",
-                    "\\Seen",
-                    imaplib.Time2Internaldate(time.time()),
-                    str(msg).encode("utf-8"),
-                )
+        if self.delivery is None:
+            self.delivery = delivery.Delivery()
+        future = self.delivery.submit(recipient, msg)
+        self.outstanding.append((future, msg))
+        self.archive_sent()
+        return future
+
+    def flush(self):
+        """
+        Waits until all queued mails are delivered
+        """
+        if self.delivery:
+            self.delivery.wait()
+        self.archive_sent()
+
+    def archive_sent(self):
+        """
+        Saves delivered mails to Sent, IMAP is only used from the main thread
+        """
+        outstanding = []
+        for future, msg in self.outstanding:
+            if not future.done():
+                outstanding.append((future, msg))
+            elif future.exception() is None:
+                self.append_sent(msg)
+        self.outstanding = outstanding
+
+    def append_sent(self, msg: email.message.Message):
+        # Not logged in when replaying local mails
+        if self.imap is None:
+            return
+        # Dead connections are replaced and the mail saved again by the session
+        self.imap.append(
+            "Sent",
+            "\\Seen",
+            imaplib.Time2Internaldate(time.time()),
+            str(msg).encode("utf-8"),
+        )
 
     def forward_mails(self):
         for code_name, details in getattr(config, "MAIL_FORWARDS", {}).items():
             self.log.info("Downloading %s mails", code_name)
 
             try:
-                imap = imaplib.IMAP4_SSL("imap.gmail.com")
-                imap.login(details["username"], details["password"])
-                imap.select("INBOX")
+                imap = sessions.imap(
+                    "imap.gmail.com", details["username"], details["password"]
+                )
 
                 ret, message_str = imap.search(None, "(UNSEEN)")
                 if ret == "OK":
@@ -389,10 +580,7 @@ class Mail:
                         ):
                             # Ignore mailer-daemon, no-reply, or own account
                             continue
-                        elif any(
-                            student_email.endswith(f"@{domain}")
-                            for domain in config.ACCEPTED_DOMAINS
-                        ):
+                        elif accepted_address(student_email):
                             possible_files = filter_files(msg)
                             if len(possible_files) != 1:
                                 # No file, multiple files or invalid file. Notify student
@@ -426,22 +614,12 @@ class Mail:
                             new_msg.attach(possible_files[0])
 
                             # Save file to inbox
-                            try:
-                                self.imap.append(
-                                    "INBOX",
-                                    "",
-                                    imaplib.Time2Internaldate(time.time()),
-                                    str(new_msg).encode("utf-8"),
-                                )
-                            except imaplib.IMAP4.abort:
-                                # Retry saving the mail
-                                self.imap_login()
-                                self.imap.append(
-                                    "INBOX",
-                                    "",
-                                    imaplib.Time2Internaldate(time.time()),
-                                    str(new_msg).encode("utf-8"),
-                                )
+                            self.imap.append(
+                                "INBOX",
+                                "",
+                                imaplib.Time2Internaldate(time.time()),
+                                str(new_msg).encode("utf-8"),
+                            )
                         else:
                             # Notify sender about wrong email address
                             self.log.debug("Wrong address")
@@ -560,6 +738,26 @@ class Generator:
             """,
         )
 
+    @staticmethod
+    def file_too_large(corrector_title: str) -> typing.Tuple[str, str]:
+        return (
+            "Datei zu groß!",
+            f"""
+            <html>
+                <p>
+                    Liebe(r) Studierende(r),<br><br>
+                    Ihre eingesendete Datei ist zu groß und wurde nicht verarbeitet. Bitte verwenden Sie die 
+                    unveränderte Vorlage, tragen Sie nur Ihre Lösungen ein und senden Sie die Datei erneut ein. 
+                    Die erfolgte Abgabe wird nicht gewertet.
+                </p>
+                <p>
+                    Mit freundlichen Grüßen<br>
+                    <b>{corrector_title}</b> und PyCor
+                </p>
+            </html>
+            """,
+        )
+
     @staticmethod
     def exercise_passed(
         corrector_title: str, exercises: typing.List[int], mat_num: int
@@ -688,6 +886,26 @@ class Generator:
             """,
         )
 
+    @staticmethod
+    def submission_superseded(corrector_title: str) -> typing.Tuple[str, str]:
+        return (
+            f"Abgabe ersetzt: {corrector_title}",
+            f"""
+            <html>
+                <p>
+                    Liebe(r) Studierende(r),<br><br>
+                    Sie haben kurz nacheinander mehrere Dateien eingereicht. Es wird nur die 
+                    <b>zuletzt eingesendete Datei</b> korrigiert, diese Abgabe wurde nicht gewertet 
+                    und verbraucht keinen Versuch.
+                </p>
+                <p>
+                    Mit freundlichen Grüßen<br>
+                    <b>{corrector_title}</b> und PyCor
+                </p>
+            </html>
+            """,
+        )
+
     @staticmethod
     def problem_forwarded() -> typing.Tuple[str, str]:
         return (
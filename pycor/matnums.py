@@ -0,0 +1,138 @@
+"""
+Index of the matriculation numbers used per subject, maintained while grading to
+detect students using several numbers and numbers shared by several students
+"""
+
+import collections
+import logging
+import typing
+from pathlib import Path
+
+from pycor import config, records
+
+# Append-only, one `{student} - {mat_num}` line per distinct pair
+INDEX_FILE = "mat_num_index.txt"
+
+log = logging.getLogger("PyCor").getChild("MatNums")
+
+
+class MatNumIndex:
+    def __init__(self, subject_folder: Path):
+        self.subject_folder = subject_folder
+        self.index_file = subject_folder / INDEX_FILE
+
+        self.students: typing.DefaultDict[str, typing.Set[int]] = (
+            collections.defaultdict(set)
+        )
+        self.mat_nums: typing.DefaultDict[int, typing.Set[str]] = (
+            collections.defaultdict(set)
+        )
+        # Students using several mat_nums and mat_nums used by several students
+        self.multiple: typing.Set[str] = set()
+        self.shared: typing.Set[int] = set()
+
+        # Pairs not written to the index file yet
+        self.pending: typing.List[typing.Tuple[str, int]] = []
+        # Whether any finding changed since the last report
+        self.report_outdated = True
+
+        if self.index_file.exists():
+            self.load()
+        else:
+            self.rebuild()
+
+    def load(self):
+        for line in self.index_file.read_text().splitlines():
+            student, _, mat_num = line.rpartition(" - ")
+            if student:
+                self.add(student, int(mat_num), persist=False)
+
+    def rebuild(self):
+        """
+        Builds the index from all student records, only needed once per subject
+        """
+        log.info("Building mat_num index of %s", self.subject_folder)
+        for folder in self.subject_folder.iterdir():
+            if (
+                not folder.is_dir()
+                or folder.name in config.FOLDER_IGNORE
+                or "@" not in folder.name
+            ):
+                continue
+            for _, mat_num in records.load(folder).mat_nums:
+                self.add(folder.name, mat_num)
+
+    def add(self, student: str, mat_num: int, persist: bool = True) -> bool:
+        """
+        Adds a student/mat_num pair, returns whether it was unknown
+
+        :param student: Name of the student's folder
+        :param mat_num: Matriculation number used in a submission
+        :param persist: Queue the pair for :meth:`flush`
+        """
+        if mat_num in self.students[student]:
+            return False
+
+        self.students[student].add(mat_num)
+        self.mat_nums[mat_num].add(student)
+        if len(self.students[student]) > 1:
+            self.multiple.add(student)
+            self.report_outdated = True
+        if len(self.mat_nums[mat_num]) > 1:
+            self.shared.add(mat_num)
+            self.report_outdated = True
+
+        if persist:
+            self.pending.append((student, mat_num))
+        return True
+
+    def flush(self):
+        """
+        Appends all new pairs to the index file
+        """
+        if not self.pending:
+            return
+        try:
+            with self.index_file.open("a") as f:
+                f.writelines(
+                    f"{student} - {mat_num}\n" for student, mat_num in self.pending
+                )
+            self.pending = []
+        except IOError:
+            log.exception("Failed to save mat_num index.")
+
+    def report(self) -> typing.List[str]:
+        """
+        Lines of the cheater report, sorted for stable output
+        """
+        lines = ["List of students using several matriculation numbers:\n"]
+        for student in sorted(self.multiple):
+            mat_nums = ", ".join(
+                str(mat_num) for mat_num in sorted(self.students[student])
+            )
+            lines.append(f"{student} ({mat_nums})\n")
+
+        lines.append("\nList of matriculation numbers used by several students:\n")
+        for mat_num in sorted(self.shared):
+            lines.append(f"{mat_num}: {', '.join(sorted(self.mat_nums[mat_num]))}\n")
+        return lines
+
+
+# Subject folder as key, kept across cycles
+_INDEXES: typing.Dict[Path, MatNumIndex] = {}
+
+
+def get(subject_folder: Path) -> MatNumIndex:
+    subject_folder = subject_folder.resolve()
+    if subject_folder not in _INDEXES:
+        _INDEXES[subject_folder] = MatNumIndex(subject_folder)
+    return _INDEXES[subject_folder]
+
+
+def add(student_folder: Path, mat_num: int):
+    get(student_folder.parent).add(student_folder.name, mat_num)
+
+
+def flush():
+    for index in _INDEXES.values():
+        index.flush()
@@ -0,0 +1,168 @@
+import collections
+import ctypes
+import gc
+import logging
+import os
+import subprocess
+import sys
+import tracemalloc
+import typing
+
+from pycor import config, metrics, utils
+
+
+def rss() -> typing.Optional[int]:
+    """
+    Returns the current resident set size in bytes, None if it can't be determined
+    """
+    try:
+        if sys.platform == "win32":
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [
+                    ("cb", ctypes.c_ulong),
+                    ("PageFaultCount", ctypes.c_ulong),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()  # type: ignore
+            if ctypes.windll.psapi.GetProcessMemoryInfo(  # type: ignore
+                process, ctypes.byref(counters), counters.cb
+            ):
+                return counters.WorkingSetSize
+            return None
+
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def virtual_size() -> typing.Optional[int]:
+    """
+    Returns the current virtual memory size in bytes, None if it can't be determined
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def enabled() -> bool:
+    return bool(
+        getattr(config, "MEMORY_DIAGNOSTICS", False)
+        or getattr(config, "MEMORY_LIMIT", None)
+    )
+
+
+class MemoryTracker:
+    """
+    Records RSS and, if MEMORY_DIAGNOSTICS is set, the top tracemalloc deltas at every
+    cycle boundary. Warns about growth across cycles and enforces MEMORY_LIMIT.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger("PyCor").getChild("Memory")
+
+        self.trace = bool(getattr(config, "MEMORY_DIAGNOSTICS", False))
+        self.top = getattr(config, "MEMORY_TOP_ALLOCATIONS", 10)
+        # Megabytes of growth across MEMORY_GROWTH_CYCLES which trigger a warning
+        self.growth_limit = getattr(config, "MEMORY_GROWTH_LIMIT", 50) * 2**20
+        self.limit = (getattr(config, "MEMORY_LIMIT", None) or 0) * 2**20
+        self.action = getattr(config, "MEMORY_LIMIT_ACTION", "collect")
+
+        self.history: typing.Deque[int] = collections.deque(
+            maxlen=getattr(config, "MEMORY_GROWTH_CYCLES", 6) + 1
+        )
+        self.snapshot: typing.Optional[tracemalloc.Snapshot] = None
+
+        if self.trace:
+            tracemalloc.start()
+            self.snapshot = self.take_snapshot()
+
+    @staticmethod
+    def take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+
+    def checkpoint(self):
+        """
+        Call at cycle boundaries, when no submission is being processed
+        """
+        current = rss()
+        if current is not None:
+            metrics.gauge("rss_bytes", current)
+            self.history.append(current)
+            self.log.info("RSS: %.1f MB", current / 2**20)
+
+        if self.trace:
+            snapshot = self.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+            metrics.gauge("traced_bytes", traced)
+            for stat in snapshot.compare_to(self.snapshot, "lineno")[: self.top]:
+                if stat.size_diff == 0:
+                    continue
+                frame = stat.traceback[0]
+                self.log.info(
+                    "%+.1f KB (%+d blocks) %s:%s",
+                    stat.size_diff / 1024,
+                    stat.count_diff,
+                    frame.filename,
+                    frame.lineno,
+                )
+            self.snapshot = snapshot
+
+        if current is None:
+            return
+
+        if (
+            len(self.history) == self.history.maxlen
+            and current - self.history[0] > self.growth_limit
+        ):
+            self.log.warning(
+                "Memory grew by %.1f MB across the last %s cycles",
+                (current - self.history[0]) / 2**20,
+                len(self.history) - 1,
+            )
+
+        if self.limit and current > self.limit:
+            self.enforce_limit(current)
+
+    def enforce_limit(self, current: int):
+        self.log.warning(
+            "RSS of %.1f MB exceeds the limit, collecting garbage", current / 2**20
+        )
+        gc.collect()
+        metrics.inc("memory_collections")
+
+        current = rss() or 0
+        if current <= self.limit or self.action != "restart":
+            return
+
+        # Replace the process with a fresh one, safe since we're between cycles
+        self.log.critical(
+            "RSS of %.1f MB still exceeds the limit, restarting", current / 2**20
+        )
+        utils.stop_logger()
+        logging.shutdown()
+        args = [sys.executable, "-m", "pycor"] + sys.argv[1:]
+        if sys.platform == "win32":
+            # execv doesn't keep the console on Windows, the new process waits for
+            # the lock and the ports until this one exited
+            subprocess.Popen(args)
+            os._exit(0)
+        os.execv(sys.executable, args)
@@ -0,0 +1,182 @@
+import contextlib
+import datetime
+import http.server
+import json
+import logging
+import threading
+import time
+import typing
+from pathlib import Path
+
+
+class Metrics:
+    """
+    Collects stage timings and counters, per cycle and since start
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger("PyCor").getChild("Metrics")
+        self.lock = threading.Lock()
+
+        # Stage as key, [calls, seconds] as value
+        self.stages: typing.Dict[str, typing.List[float]] = {}
+        self.cycle_stages: typing.Dict[str, typing.List[float]] = {}
+        # (name, sorted labels) as key
+        self.counters: typing.Dict[
+            typing.Tuple[str, typing.Tuple[typing.Tuple[str, str], ...]], float
+        ] = {}
+        self.cycle_counters: typing.Dict[
+            typing.Tuple[str, typing.Tuple[typing.Tuple[str, str], ...]], float
+        ] = {}
+
+        # Name as key, last value as value
+        self.gauges: typing.Dict[str, float] = {}
+
+        self.cycles = 0
+        self.cycle_started: typing.Optional[float] = None
+        self.last_cycle: typing.Optional[dict] = None
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            for stages in (self.stages, self.cycle_stages):
+                entry = stages.setdefault(stage, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            for counters in (self.counters, self.cycle_counters):
+                counters[key] = counters.get(key, 0) + value
+
+    def set(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def start_cycle(self):
+        with self.lock:
+            self.cycle_stages = {}
+            self.cycle_counters = {}
+            self.cycle_started = time.perf_counter()
+
+    def end_cycle(self) -> dict:
+        """
+        Finishes the current cycle, returns its snapshot and appends it to logs/metrics.jsonl
+        """
+        with self.lock:
+            self.cycles += 1
+            duration = time.perf_counter() - (self.cycle_started or time.perf_counter())
+            self.last_cycle = {
+                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "duration": round(duration, 4),
+                "stages": {
+                    stage: {"calls": int(calls), "seconds": round(seconds, 4)}
+                    for stage, (calls, seconds) in sorted(self.cycle_stages.items())
+                },
+                "counters": {
+                    _format_key(name, labels): value
+                    for (name, labels), value in sorted(self.cycle_counters.items())
+                },
+                "gauges": dict(sorted(self.gauges.items())),
+            }
+            snapshot = self.last_cycle
+
+        try:
+            with Path("logs", "metrics.jsonl").open("a") as m:
+                m.write(json.dumps(snapshot) + "\n")
+        except IOError:
+            self.log.exception("Failed to write metrics snapshot.")
+        return snapshot
+
+    def prometheus(self) -> str:
+        """
+        Renders all metrics in Prometheus' text exposition format
+        """
+        lines = [
+            "# TYPE pycor_cycles_total counter",
+            f"pycor_cycles_total {self.cycles}",
+        ]
+        with self.lock:
+            if self.last_cycle:
+                lines += [
+                    "# TYPE pycor_last_cycle_seconds gauge",
+                    f"pycor_last_cycle_seconds {self.last_cycle['duration']}",
+                    "# TYPE pycor_last_cycle_stage_seconds gauge",
+                ]
+                lines += [
+                    f'pycor_last_cycle_stage_seconds{{stage="{stage}"}} {info["seconds"]}'
+                    for stage, info in self.last_cycle["stages"].items()
+                ]
+
+            lines.append("# TYPE pycor_stage_seconds_total counter")
+            lines += [
+                f'pycor_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}'
+                for stage, (_, seconds) in sorted(self.stages.items())
+            ]
+            lines.append("# TYPE pycor_stage_calls_total counter")
+            lines += [
+                f'pycor_stage_calls_total{{stage="{stage}"}} {int(calls)}'
+                for stage, (calls, _) in sorted(self.stages.items())
+            ]
+
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE pycor_{name} gauge")
+                lines.append(f"pycor_{name} {value:g}")
+
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE pycor_{name}_total counter")
+                    typed.add(name)
+                lines.append(f"pycor_{_format_key(name + '_total', labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_key(name: str, labels: typing.Tuple[typing.Tuple[str, str], ...]) -> str:
+    if not labels:
+        return name
+    return "{}{{{}}}".format(name, ",".join(f'{k}="{v}"' for k, v in labels))
+
+
+# Create global metrics object
+METRICS = Metrics()
+
+timer = METRICS.timer
+inc = METRICS.inc
+gauge = METRICS.set
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+
+        body = METRICS.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't spam the console with every scrape
+        pass
+
+
+def serve(port: int) -> http.server.HTTPServer:
+    """
+    Exposes metrics on http://localhost:{port}/metrics in a background thread
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    METRICS.log.info("Serving metrics on http://127.0.0.1:%s/metrics", port)
+    return server
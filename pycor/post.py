@@ -1,11 +1,120 @@
 import csv
+import hashlib
+import json
 import logging
+import os
+import typing
+from concurrent import futures
 from pathlib import Path
 
 import matplotlib.pyplot as plt  # type: ignore
 import numpy as np  # type: ignore
 
-from pycor import config
+from pycor import config, fingerprints, matnums, metrics, records
+
+# Bump whenever the look of the charts changes to force re-rendering
+CHART_STYLE_VERSION = 1
+
+# A chart takes ~50ms to render while starting a spawned worker and importing
+# matplotlib takes ~0.6s, fewer charts are rendered faster in the main process
+POOL_THRESHOLD = 24
+
+
+def chart_hash(*arrays: np.ndarray, **style) -> str:
+    """
+    Hashes a chart's input arrays and style parameters
+
+    :param arrays: Data arrays the chart is generated from
+    :param style: Any further parameters influencing the rendered image
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype}{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    style["version"] = CHART_STYLE_VERSION
+    digest.update(json.dumps(style, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def render_bars(
+    target: Path,
+    passed: np.ndarray,
+    submitted: np.ndarray,
+    bar_labels: typing.List[str],
+):
+    """
+    Renders the passed/submitted bar plot, module-level to be usable in a process pool
+    """
+    ind = np.arange(len(bar_labels))
+    width = 0.4
+
+    plt.clf()
+    p1 = plt.bar(ind - width / 2, passed, width, color="lightgreen")
+    p2 = plt.bar(ind + width / 2, submitted, width, color="lightcoral")
+    plt.ylabel("Number of students")
+    steps = 10 if np.max(submitted) > 40 else 5
+    plt.yticks(np.arange(np.max(submitted) + steps, step=steps))
+    plt.xticks(ind, bar_labels)
+
+    plt.ylim(top=np.max(submitted + 1))
+    plt.legend((p1[0], p2[0]), ("Passed", "Submitted"))
+    plt.grid(True)
+
+    plt.savefig(target)
+
+
+def render_histogram(
+    target: Path, exercise: int, y_submitted: np.ndarray, y_passed: np.ndarray
+):
+    """
+    Renders the attempt distribution of a single exercise, module-level to be usable
+    in a process pool
+    """
+    x = np.arange(0, y_submitted.size, 1)
+
+    plt.clf()
+    plt.plot(x, y_submitted, "k--")
+    plt.fill_between(
+        x,
+        y_submitted,
+        y_passed,
+        where=y_submitted > y_passed,
+        facecolor="lightcoral",
+        interpolate=True,
+        label="Submitted",
+        zorder=2,
+    )
+    plt.plot(x, y_passed, "k-")
+    plt.fill_between(
+        x,
+        y_passed,
+        0,
+        where=y_passed > 0,
+        facecolor="lightgreen",
+        interpolate=True,
+        label="Passed",
+        zorder=3,
+    )
+
+    plt.xlabel("Number of attempts")
+    plt.xticks(np.arange(len(y_submitted)))
+    plt.ylabel("Number of students")
+    steps = 10 if np.max(y_submitted) > 40 else 5
+    plt.yticks(np.arange(np.max(y_submitted) + steps, step=steps))
+
+    plt.xlim((-0.6, y_submitted.size))
+    plt.ylim((0, np.max(y_submitted) + 1))
+
+    title = "Distribution of the number of\nattempts per student, ex. {}".format(
+        exercise + 1
+    )
+    plt.title(title)
+
+    plt.legend(loc="best")
+    plt.grid()
+
+    plt.savefig(target)
 
 
 class PostProcessing:
@@ -19,6 +128,99 @@ class PostProcessing:
         if not self.post_dir.exists():
             self.post_dir.mkdir(exist_ok=True)
 
+        # Chart file name as key, hash of its inputs as value
+        self.manifest_file = self.post_dir / "charts.json"
+        self.manifest: typing.Dict[str, str] = self.load_manifest()
+        # Charts which need to be rendered: file name, render function, args, hash
+        self.pending_charts: typing.List[
+            typing.Tuple[str, typing.Callable, tuple, str]
+        ] = []
+        self._student_records: typing.Optional[
+            typing.List[typing.Tuple[Path, records.StudentRecord]]
+        ] = None
+
+    def load_manifest(self) -> typing.Dict[str, str]:
+        try:
+            if self.manifest_file.exists():
+                return json.loads(self.manifest_file.read_text())
+        except (IOError, ValueError):
+            self.log.warning("Failed to read chart manifest, rendering all charts")
+        return {}
+
+    def save_manifest(self):
+        try:
+            self.manifest_file.write_text(
+                json.dumps(self.manifest, indent=4, sort_keys=True)
+            )
+        except IOError:
+            self.log.exception("Failed to save chart manifest.")
+
+    def queue_chart(self, name: str, render: typing.Callable, args: tuple, digest: str):
+        """
+        Queues chart for rendering if its inputs changed or the image is missing
+
+        :param name: File name of the chart inside the post processing folder
+        :param render: Module-level function rendering the chart
+        :param args: Arguments passed to render after the target path
+        :param digest: Hash of the chart's inputs, see :func:`chart_hash`
+        """
+        if self.manifest.get(name) == digest and (self.post_dir / name).exists():
+            self.log.debug("Skipping unchanged chart %s", name)
+            metrics.inc("cache_hits", cache="charts")
+            return
+        metrics.inc("cache_misses", cache="charts")
+        self.pending_charts.append((name, render, args, digest))
+
+    def render_charts(self):
+        """
+        Renders all queued charts, in a process pool if at least
+        POSTPROCESSING_POOL_THRESHOLD charts have changed
+        """
+        if len(self.pending_charts) == 0:
+            self.log.info("All charts are up to date")
+            return
+
+        workers = min(
+            len(self.pending_charts),
+            getattr(config, "POSTPROCESSING_WORKERS", None) or os.cpu_count() or 1,
+        )
+        if len(self.pending_charts) < getattr(
+            config, "POSTPROCESSING_POOL_THRESHOLD", POOL_THRESHOLD
+        ):
+            workers = 1
+        rendered = 0
+        if workers > 1:
+            with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                jobs = {
+                    executor.submit(render, self.post_dir / name, *args): (
+                        name,
+                        digest,
+                    )
+                    for name, render, args, digest in self.pending_charts
+                }
+                for job in futures.as_completed(jobs):
+                    name, digest = jobs[job]
+                    try:
+                        job.result()
+                    except Exception:
+                        self.log.exception("Failed to save %s.", name)
+                        continue
+                    self.manifest[name] = digest
+                    rendered += 1
+        else:
+            for name, render, args, digest in self.pending_charts:
+                try:
+                    render(self.post_dir / name, *args)
+                except Exception:
+                    self.log.exception("Failed to save %s.", name)
+                    continue
+                self.manifest[name] = digest
+                rendered += 1
+
+        self.pending_charts = []
+        self.save_manifest()
+        self.log.info("Rendered %s changed charts", rendered)
+
     def filter_folders(self):
         for folder in self.subject_folder.iterdir():
             # Ignore folders that are blacklisted or don't contain @
@@ -30,31 +232,16 @@ class PostProcessing:
                 continue
             yield folder
 
-    @staticmethod
-    def get_mat_num(folder: Path):
-        try:
-            # dtype has to be float since old data contained values too long for C long
-            # noinspection PyTypeChecker
-            mn = np.loadtxt(
-                folder / "data" / "mat_num.txt",
-                delimiter=" - ",
-                usecols=1,
-                dtype=float,
-                ndmin=1,
-            )
-            return int(mn[-1]), np.unique(mn).size
-        except IOError:
-            return "", ""
-
-    @staticmethod
-    def load_txt(folder, ex):
-        return np.loadtxt(
-            folder / "data" / "Exercise{}.txt".format(ex + 1),
-            delimiter=" - ",
-            usecols=1,
-            dtype=int,
-            ndmin=1,
-        )
+    @property
+    def student_records(self) -> typing.List[typing.Tuple[Path, records.StudentRecord]]:
+        """
+        Record of every student folder, read once per run
+        """
+        if self._student_records is None:
+            self._student_records = [
+                (folder, records.load(folder)) for folder in self.filter_folders()
+            ]
+        return self._student_records
 
     def write_csv(self, rows, name):
         comma_file = self.post_dir / "{}.csv".format(name)
@@ -75,24 +262,18 @@ class PostProcessing:
         ]
         rows_attempts = list(rows_general)
 
-        for folder in self.filter_folders():
+        for folder, record in self.student_records:
             # Get amount of mat nums used and last num
-            mat_num, mn_count = self.get_mat_num(folder)
+            mat_num, mn_count = record.mat_num_info()
 
             row_general = [folder.name, mat_num, mn_count]
             row_attempts = list(row_general)
 
             # Percentage solved/Amount of tries
             for ex in range(self.exercise_count):
-                try:
-                    result = self.load_txt(folder, ex)
-                    perc = np.max(result)
-                    amount = len(result)
-                except IOError:
-                    perc = ""
-                    amount = ""
-                row_general.append(perc)
-                row_attempts.append(amount)
+                result = record.percentages(ex)
+                row_general.append(max(result) if result else "")
+                row_attempts.append(len(result) if result else "")
 
             rows_attempts.append(row_attempts)
             rows_general.append(row_general)
@@ -101,19 +282,30 @@ class PostProcessing:
         self.write_csv(rows_general, "GeneralInfo")
 
     def check_mat_num(self):
-        cheaters = []
-        for folder in self.filter_folders():
-            # Get amount of mat nums used and last num
-            _, mn_count = self.get_mat_num(folder)
-            if isinstance(mn_count, int) and mn_count > 1:
-                cheaters.append(folder.name + "\n")
+        index = matnums.get(self.subject_folder)
+        index.flush()
 
         cheater_file = self.post_dir / "cheaters.txt"
+        if not index.report_outdated and cheater_file.exists():
+            self.log.info("Cheater file is up to date.")
+            return
+
         with cheater_file.open("w") as c:
-            c.write("List of students using several matriculation numbers:\n")
-            c.writelines(cheaters)
+            c.writelines(index.report())
+        index.report_outdated = False
         self.log.info("Wrote cheater file.")
 
+    def generate_clusters(self):
+        if not fingerprints.enabled():
+            return
+        index = fingerprints.get(self.subject_folder)
+        index.flush()
+
+        rows = [["Cluster", "Students", "Highest similarity", "Matches"]]
+        for number, (students, score, count) in enumerate(index.clusters(), 1):
+            rows.append([number, " ".join(students), round(score, 2), count])
+        self.write_csv(rows, "Clusters")
+
     def generate_bars(self):
         if self.exercise_count < 10:
             bar_labels = ["Ex. {}".format(x + 1) for x in range(self.exercise_count)]
@@ -122,68 +314,39 @@ class PostProcessing:
         passed = np.zeros(self.exercise_count)
         submitted = np.zeros(self.exercise_count)
 
-        for folder in self.filter_folders():
+        for _, record in self.student_records:
             for ex in range(self.exercise_count):
-                try:
-                    result = self.load_txt(folder, ex)
-                    highest_score = np.max(result)
-
-                    if highest_score == 100:
-                        passed[ex] += 1
-                    submitted[ex] += 1
-                except IOError:
-                    pass
-
-        # Generate bar plots
-        ind = np.arange(self.exercise_count)
-        width = 0.4
-
-        plt.clf()
-        p1 = plt.bar(ind - width / 2, passed, width, color="lightgreen")
-        p2 = plt.bar(ind + width / 2, submitted, width, color="lightcoral")
-        plt.ylabel("Number of students")
-        steps = 10 if np.max(submitted) > 40 else 5
-        plt.yticks(np.arange(np.max(submitted) + steps, step=steps))
-        plt.xticks(ind, bar_labels)
-
-        plt.ylim(top=np.max(submitted + 1))
-        plt.legend((p1[0], p2[0]), ("Passed", "Submitted"))
-        plt.grid(True)
-
-        # Save plots
-        bars_png = self.post_dir / "passed-submitted.png"
-
-        try:
-            plt.savefig(bars_png)
-            self.log.info("Wrote bar plots")
-        except IOError:
-            self.log.exception("Failed to save bar plots.")
+                result = record.percentages(ex)
+                if not result:
+                    continue
+                if max(result) == 100:
+                    passed[ex] += 1
+                submitted[ex] += 1
+
+        self.queue_chart(
+            "passed-submitted.png",
+            render_bars,
+            (passed, submitted, bar_labels),
+            chart_hash(passed, submitted, labels=bar_labels),
+        )
 
     def generate_histograms(self):
         # Collect data on amount of passed exercises and amount of tries
         total = []
         passed = []
-        for idx, folder in enumerate(self.filter_folders()):
+        for _, record in self.student_records:
             total.append([])
             passed.append([])
 
             for ex in range(self.exercise_count):
-                total[idx].append([])
-                passed[idx].append([])
+                result = record.percentages(ex)
+                tries = len(result)
 
-                try:
-                    result = self.load_txt(folder, ex)
-                    highest_score = np.max(result)
-                    tries = result.size
-
-                    total[idx][ex] = tries
-                    if highest_score == 100:
-                        passed[idx][ex] = tries
-                    else:
-                        passed[idx][ex] = 0
-                except IOError:
-                    total[idx][ex] = 0
-                    passed[idx][ex] = 0
+                total[-1].append(tries)
+                if result and max(result) == 100:
+                    passed[-1].append(tries)
+                else:
+                    passed[-1].append(0)
 
         # Prepare data for plot
         total = np.array(total)
@@ -204,59 +367,19 @@ class PostProcessing:
 
                 y_submitted = np.append(y_submitted, 0)
                 y_passed = np.append(y_passed, 0)
-                x = np.arange(0, y_submitted.size, 1)
-
-                plt.clf()
-                plt.plot(x, y_submitted, "k--")
-                plt.fill_between(
-                    x,
-                    y_submitted,
-                    y_passed,
-                    where=y_submitted > y_passed,
-                    facecolor="lightcoral",
-                    interpolate=True,
-                    label="Submitted",
-                    zorder=2,
-                )
-                plt.plot(x, y_passed, "k-")
-                plt.fill_between(
-                    x,
-                    y_passed,
-                    0,
-                    where=y_passed > 0,
-                    facecolor="lightgreen",
-                    interpolate=True,
-                    label="Passed",
-                    zorder=3,
-                )
-
-                plt.xlabel("Number of attempts")
-                plt.xticks(np.arange(len(y_submitted)))
-                plt.ylabel("Number of students")
-                steps = 10 if np.max(y_submitted) > 40 else 5
-                plt.yticks(np.arange(np.max(y_submitted) + steps, step=steps))
 
-                plt.xlim((-0.6, y_submitted.size))
-                plt.ylim((0, np.max(y_submitted) + 1))
-
-                title = "Distribution of the number of\nattempts per student, ex. {}".format(
-                    ex + 1
+                self.queue_chart(
+                    "Exercise {}_distr.png".format(ex + 1),
+                    render_histogram,
+                    (ex, y_submitted, y_passed),
+                    chart_hash(y_submitted, y_passed, exercise=ex),
                 )
-                plt.title(title)
-
-                plt.legend(loc="best")
-                plt.grid()
-
-                label = "Exercise {}".format(ex + 1)
-                bars_png = self.post_dir / (label + "_distr.png")
-                try:
-                    plt.savefig(bars_png)
-                except IOError:
-                    self.log.exception("Failed to save hist plots.")
-        self.log.info("Generated exercise histograms.")
+        self.log.info("Collected exercise histograms.")
 
     def run(self):
         self.generate_attempt_info()
         self.check_mat_num()
+        self.generate_clusters()
         self.generate_bars()
         self.generate_histograms()
+        self.render_charts()
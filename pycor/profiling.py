@@ -0,0 +1,124 @@
+import cProfile
+import collections
+import contextlib
+import datetime
+import logging
+import os
+import random
+import sys
+import threading
+import typing
+from pathlib import Path
+
+from pycor import config, utils
+
+PROFILE_DIR = Path("logs", "profiles")
+
+log = logging.getLogger("PyCor").getChild("Profiling")
+
+# Share of submissions to profile individually, set via config or --profile-submissions
+submission_rate: float = getattr(config, "PROFILE_SUBMISSION_RATE", 0.0) or 0.0
+
+# Set while a whole cycle is profiled, cProfile can't be nested
+_cycle_active = False
+
+
+class StackSampler(threading.Thread):
+    """
+    Periodically samples the stack of a thread and counts collapsed stacks,
+    the output can be fed into flamegraph tools (e.g. flamegraph.pl, speedscope)
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: typing.Counter[str] = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, target: Path):
+        with target.open("w", encoding="utf-8") as c:
+            for stack, count in self.stacks.most_common():
+                c.write(f"{stack} {count}\n")
+
+
+def _target(name: str) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H.%M.%S")
+    return PROFILE_DIR / f"{timestamp}_{name}"
+
+
+@contextlib.contextmanager
+def profile_cycle(name: str = "cycle"):
+    """
+    Profiles the block via cProfile and a stack sampler, writes
+    `logs/profiles/{timestamp}_{name}.pstats` and `.collapsed`
+    """
+    global _cycle_active
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    _cycle_active = True
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        _cycle_active = False
+
+        target = _target(name)
+        try:
+            profiler.dump_stats(f"{target}.pstats")
+            sampler.write(Path(f"{target}.collapsed"))
+            log.info("Wrote profile to %s.pstats/.collapsed", target)
+        except IOError:
+            log.exception("Failed to write profile.")
+
+
+def start_submission() -> typing.Optional[cProfile.Profile]:
+    """
+    Starts profiling a random share of submissions, see :data:`submission_rate`
+    """
+    if _cycle_active or submission_rate <= 0 or random.random() >= submission_rate:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_submission(profiler: typing.Optional[cProfile.Profile], name: str):
+    """
+    Stops profiling started by :func:`start_submission` and writes the .pstats file
+
+    :param profiler: Return value of :func:`start_submission`
+    :param name: Added to the file name, e.g. the corrector's codename
+    """
+    if profiler is None:
+        return
+    profiler.disable()
+
+    target = f"{_target(f'submission_{name}_{utils.random_string()}')}.pstats"
+    try:
+        profiler.dump_stats(target)
+        log.debug("Wrote submission profile to %s", target)
+    except IOError:
+        log.exception("Failed to write submission profile.")
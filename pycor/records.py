@@ -0,0 +1,215 @@
+"""
+Per-student record containing all attempts, replaces the former
+`Exercise{n}_block.txt`, `data/Exercise{n}.txt` and `data/mat_num.txt` files
+"""
+
+import logging
+import re
+import shutil
+import typing
+from pathlib import Path
+
+from pydantic import BaseModel  # type: ignore
+
+from pycor import config, utils
+
+RECORD_FILE = "record.json"
+RECORD_VERSION = 1
+
+log = logging.getLogger("PyCor").getChild("Records")
+
+
+class StudentRecord(BaseModel):
+    version: int = RECORD_VERSION
+    # Attempt slots per exercise [beginning at 0], 0 marks an unused attempt
+    block_status: typing.Dict[int, typing.List[float]] = {}
+    # (timestamp, percentage) of every graded attempt per exercise
+    results: typing.Dict[int, typing.List[typing.Tuple[str, int]]] = {}
+    # (timestamp, mat_num), only appended if the mat_num changed
+    mat_nums: typing.List[typing.Tuple[str, int]] = []
+    # File names of the submissions whose attempts are contained
+    submissions: typing.List[str] = []
+
+    def get_stats(
+        self, exercise: int, max_attempts: int
+    ) -> typing.Tuple[bool, bool, bool]:
+        """
+        Returns whether the student is blocked, has passed and whether the attempt
+        slots had to be resized to max_attempts
+        """
+        block_status = self.block_status.get(exercise)
+        if block_status is None:
+            return False, False, False
+
+        resized = len(block_status) != max_attempts
+        if resized:
+            # Check if user's try list doesn't match the specified max_tries
+            block_status = block_status[:max_attempts]
+            block_status += [0] * (max_attempts - len(block_status))
+            self.block_status[exercise] = block_status
+
+        if 0 < block_status[-1] < 100:
+            # Last entry isn't passed
+            return True, False, resized
+        # Any entry is marked as passed
+        return False, 100 in block_status, resized
+
+    def update_stats(
+        self,
+        exercise: int,
+        correct_percentage: int,
+        max_attempts: int,
+        timestamp: str,
+        mat_num: int,
+    ) -> typing.Tuple[bool, bool]:
+        """
+        Records an attempt, returns whether the student is blocked and has passed
+        """
+        blocked = False
+        passed = correct_percentage == 100
+
+        block_status = self.block_status.setdefault(exercise, [0] * max_attempts)
+
+        # There's at least one attempt left, let's log the results!
+        if 0 in block_status:
+            block_status[block_status.index(0)] = correct_percentage
+        else:
+            blocked = True
+
+        # Check if student failed his last try
+        if 0 < block_status[-1] < 100:
+            blocked = True
+
+        self.results.setdefault(exercise, []).append((timestamp, correct_percentage))
+        if not self.mat_nums or self.mat_nums[-1][1] != mat_num:
+            self.mat_nums.append((timestamp, mat_num))
+        return blocked, passed
+
+    def percentages(self, exercise: int) -> typing.List[int]:
+        return [perc for _, perc in self.results.get(exercise, [])]
+
+    def mat_num_info(
+        self,
+    ) -> typing.Tuple[typing.Union[int, str], typing.Union[int, str]]:
+        """
+        Returns the last used mat_num and the amount of different mat_nums
+        """
+        if not self.mat_nums:
+            return "", ""
+        return self.mat_nums[-1][1], len(set(mat_num for _, mat_num in self.mat_nums))
+
+
+# region Legacy files
+LEGACY_BLOCK = re.compile(r"^Exercise(\d+)_block\.txt$")
+LEGACY_RESULTS = re.compile(r"^Exercise(\d+)\.txt$")
+
+
+def _read_lines(path: Path) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Reads `{timestamp} - {value}` lines
+    """
+    lines = []
+    for line in path.read_text().splitlines():
+        timestamp, _, value = line.rpartition(" - ")
+        if timestamp:
+            lines.append((timestamp, value.strip()))
+    return lines
+
+
+def has_legacy(student_folder: Path) -> bool:
+    return (student_folder / "data").is_dir() or any(
+        LEGACY_BLOCK.match(item.name) for item in student_folder.iterdir()
+    )
+
+
+def from_legacy(student_folder: Path) -> StudentRecord:
+    record = StudentRecord()
+    for item in student_folder.iterdir():
+        match = LEGACY_BLOCK.match(item.name)
+        if match:
+            record.block_status[int(match.group(1)) - 1] = [
+                float(line) for line in item.read_text().split()
+            ]
+
+    data = student_folder / "data"
+    if data.is_dir():
+        for item in data.iterdir():
+            match = LEGACY_RESULTS.match(item.name)
+            if match:
+                record.results[int(match.group(1)) - 1] = [
+                    (timestamp, int(float(perc)))
+                    for timestamp, perc in _read_lines(item)
+                ]
+
+        mat_num_file = data / "mat_num.txt"
+        if mat_num_file.exists():
+            for timestamp, value in _read_lines(mat_num_file):
+                # Not parsed as float, old data contains values beyond its precision
+                mat_num = int(value)
+                if not record.mat_nums or record.mat_nums[-1][1] != mat_num:
+                    record.mat_nums.append((timestamp, mat_num))
+    return record
+
+
+def remove_legacy(student_folder: Path):
+    for item in student_folder.iterdir():
+        if LEGACY_BLOCK.match(item.name):
+            item.unlink()
+    if (student_folder / "data").is_dir():
+        shutil.rmtree(student_folder / "data")
+
+
+# endregion
+
+
+def load(student_folder: Path) -> StudentRecord:
+    """
+    Reads the student's record, converts the legacy files if there's none yet
+    """
+    record_file = student_folder / RECORD_FILE
+    if record_file.exists():
+        return StudentRecord.parse_file(record_file)
+    if student_folder.is_dir() and has_legacy(student_folder):
+        return from_legacy(student_folder)
+    return StudentRecord()
+
+
+def save(student_folder: Path, record: StudentRecord):
+    utils.write_atomic(student_folder / RECORD_FILE, record.json(separators=(",", ":")))
+
+
+def migrate(subject_folder: Path, keep: bool = False) -> int:
+    """
+    Converts the legacy files of all students in the subject, returns the amount of
+    converted students
+
+    :param subject_folder: Folder containing the student folders
+    :param keep: Keep the legacy files instead of deleting them
+    """
+    migrated = 0
+    for folder in subject_folder.iterdir():
+        if not folder.is_dir() or "@" not in folder.name or not has_legacy(folder):
+            continue
+        if not (folder / RECORD_FILE).exists():
+            save(folder, from_legacy(folder))
+            migrated += 1
+        if not keep:
+            remove_legacy(folder)
+    log.info("Migrated %s students in %s", migrated, subject_folder)
+    return migrated
+
+
+def migrate_all(keep: bool = False) -> int:
+    """
+    Converts the legacy files of all subjects in the configured folders
+    """
+    migrated = 0
+    for group_path in config.FOLDERS:
+        group = Path(group_path)
+        if not group.exists():
+            log.warning("Could not find %s, skipping", group_path)
+            continue
+        for subject in group.iterdir():
+            if subject.is_dir() and subject.name not in config.FOLDER_IGNORE:
+                migrated += migrate(subject, keep)
+    return migrated
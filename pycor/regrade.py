@@ -0,0 +1,305 @@
+"""
+Recomputes the results of all stored submissions of a subject,
+run via `python -m pycor regrade <subject>`
+"""
+
+import csv
+import datetime
+import logging
+import os
+import re
+import shutil
+import sys
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import pycor
+from pycor import cache, config, excel, post, records
+
+log = logging.getLogger("PyCor").getChild("Regrade")
+
+# Stored submissions are named `{timestamp}_{random string}.xlsx`, see Mail.download_attachment
+SUBMISSION_NAME = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}\.\d{2}\.\d{2})_\w+\.xlsx$")
+
+
+class Submission(typing.NamedTuple):
+    submitted: datetime.datetime
+    path: Path
+
+
+class ParsedSubmission(typing.NamedTuple):
+    mat_num: int
+    dummies: typing.Tuple[typing.Any, ...]
+    solutions: typing.List[typing.List[typing.Any]]
+
+
+def find_submissions(
+    subject_folder: Path,
+) -> typing.Dict[Path, typing.List[Submission]]:
+    """
+    Returns the stored submissions of every student folder, oldest first.
+    Superseded submissions are ignored.
+    """
+    ret = {}
+    for folder in sorted(subject_folder.iterdir()):
+        if (
+            not folder.is_dir()
+            or folder.name in config.FOLDER_IGNORE
+            or "@" not in folder.name
+        ):
+            continue
+
+        submissions = []
+        for item in folder.iterdir():
+            match = SUBMISSION_NAME.match(item.name)
+            if item.is_file() and match:
+                submitted = datetime.datetime.strptime(
+                    match.group(1), "%Y-%m-%d %H.%M.%S"
+                )
+                submissions.append(Submission(submitted, item))
+        if submissions:
+            ret[folder] = sorted(submissions)
+    return ret
+
+
+def _init_worker():
+    # Every parsed file would be logged otherwise
+    logging.getLogger("PyCor").setLevel(logging.WARNING)
+
+
+def parse(path: Path, dummy_count: int) -> typing.Optional[ParsedSubmission]:
+    """
+    Parses a stored submission, runs in worker processes
+    """
+    try:
+        student = excel.Student(path, dummy_count)
+    except excel.ExcelFileException:
+        return None
+    return ParsedSubmission(student.mat_num, tuple(student.dummies), student.solutions)
+
+
+def progress(label: str, done: int, total: int):
+    # Update roughly every percent
+    if done != total and done % max(total // 100, 1):
+        return
+    sys.stderr.write(f"\r{label}: {done}/{total} ({done / max(total, 1):.0%})")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def load_block_status(
+    record: records.StudentRecord, exercise: int, max_attempts: int
+) -> typing.List[float]:
+    record.get_stats(exercise, max_attempts)
+    return record.block_status.get(exercise, [0] * max_attempts)
+
+
+def replayed_block_status(
+    record: records.StudentRecord, exercise: int, max_attempts: int
+) -> typing.List[float]:
+    """
+    Attempt slots as recorded by grading alone, differences to the stored slots are
+    manual changes (e.g. unblocked students or extra attempts)
+    """
+    replayed = records.StudentRecord()
+    for timestamp, percentage in record.results.get(exercise, []):
+        replayed.update_stats(exercise, percentage, max_attempts, timestamp, 0)
+    return load_block_status(replayed, exercise, max_attempts)
+
+
+def status(block_status: typing.List[float]) -> str:
+    if 100 in block_status:
+        return "passed"
+    elif 0 < block_status[-1] < 100:
+        return "blocked"
+    return "open"
+
+
+def write_record(student_folder: Path, record: records.StudentRecord, backup: str):
+    """
+    Replaces the student's record, the previous record and any legacy files are moved
+    into `regrade_{backup}`
+    """
+    backup_folder = student_folder / f"regrade_{backup}"
+    backup_folder.mkdir(exist_ok=True)
+    record_file = student_folder / records.RECORD_FILE
+    if record_file.exists():
+        shutil.copy2(str(record_file), str(backup_folder / records.RECORD_FILE))
+    for item in list(student_folder.iterdir()):
+        if records.LEGACY_BLOCK.match(item.name) or item.name == "data":
+            shutil.move(str(item), str(backup_folder / item.name))
+
+    records.save(student_folder, record)
+
+
+def run(
+    subject_folder: Path,
+    write: bool = False,
+    output: typing.Optional[Path] = None,
+    workers: typing.Optional[int] = None,
+) -> int:
+    """
+    Regrades all stored submissions of the subject with the current corrector and writes
+    a report of changed results. Returns the amount of students whose results changed.
+
+    :param subject_folder: Folder containing the corrector and the student folders
+    :param write: Replace the record of students whose results changed
+    :param output: Path of the report, defaults to _postprocessing/Regrade_{timestamp}.csv
+    :param workers: Parser processes, defaults to the CPU count
+    """
+    corrector_file = excel.Corrector.find_file(subject_folder)
+    if corrector_file is None:
+        raise excel.ExcelFileException(f"No corrector found in {subject_folder}")
+    corrector = excel.Corrector(corrector_file, check_deadline=False)
+    excel.STATE.flush()
+    if not corrector.valid:
+        raise excel.ExcelFileException("Invalid corrector, see PYCOR_ERROR.txt")
+
+    students = find_submissions(subject_folder)
+    paths = [s.path for submissions in students.values() for s in submissions]
+    log.info("Regrading %s submissions of %s students", len(paths), len(students))
+
+    # region Parse submissions in parallel
+    workers = workers or os.cpu_count() or 1
+    parsed: typing.Dict[Path, typing.Optional[ParsedSubmission]] = {}
+    with futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker
+    ) as executor:
+        results = executor.map(
+            parse,
+            paths,
+            [corrector.dummy_count] * len(paths),
+            chunksize=max(1, min(64, len(paths) // (workers * 16))),
+        )
+        for done, (path, result) in enumerate(zip(paths, results), 1):
+            parsed[path] = result
+            progress("Parsing", done, len(paths))
+    # endregion
+
+    # region Generate solutions once per distinct input
+    solutions: typing.Dict[typing.Tuple[int, tuple], typing.Optional[list]] = {
+        (p.mat_num, p.dummies): None for p in parsed.values() if p and p.solutions
+    }
+    try:
+        for done, (mat_num, dummies) in enumerate(list(solutions), 1):
+            try:
+                solutions[(mat_num, dummies)] = corrector.generate_solutions(
+                    mat_num, list(dummies)
+                )
+            except excel.ExcelFileException:
+                log.warning("Failed to generate solutions for %s", mat_num)
+            progress("Generating solutions", done, len(solutions))
+    finally:
+        corrector.close_excel()
+        cache.flush()
+    # endregion
+
+    exercise_count = len(corrector.exercise_ranges)
+    rows = [
+        [
+            "Student",
+            "Exercise",
+            "Previous attempts",
+            "Attempts",
+            "Previous status",
+            "Status",
+            "Manually changed from",
+        ]
+    ]
+    changed = 0
+    # Students whose manually changed attempts are lost by replacing their record
+    manual: typing.List[str] = []
+    backup = datetime.datetime.now().strftime("%Y-%m-%d %H.%M.%S")
+    for student_folder, submissions in students.items():
+        record = records.StudentRecord()
+
+        # Replay submissions like pycor.main() graded them
+        for submission in submissions:
+            # Contained in the record, resuming its journal entry must not count it again
+            record.submissions.append(submission.path.name)
+            p = parsed[submission.path]
+            if p is None or len(p.solutions) == 0:
+                continue
+            real_solutions = solutions.get((p.mat_num, p.dummies))
+            if real_solutions is None or len(p.solutions) != len(real_solutions):
+                continue
+
+            timestamp = submission.submitted.strftime("%Y-%m-%d %H:%M:%S")
+            for idx, student_solution in enumerate(p.solutions):
+                if None in student_solution or any(
+                    record.get_stats(idx, corrector.max_attempts)[:2]
+                ):
+                    continue
+                if len(student_solution) != len(real_solutions[idx]):
+                    continue
+
+                exercise_solved = pycor.grade_exercise(
+                    idx, student_solution, real_solutions[idx]
+                )
+                if len(exercise_solved["correct"]) > 0:
+                    record.update_stats(
+                        idx,
+                        pycor.percentage(exercise_solved),
+                        corrector.max_attempts,
+                        timestamp,
+                        p.mat_num,
+                    )
+
+        student_changed = False
+        student_manual = False
+        previous_record = records.load(student_folder)
+        for idx in range(exercise_count):
+            previous = load_block_status(previous_record, idx, corrector.max_attempts)
+            current = load_block_status(record, idx, corrector.max_attempts)
+            if previous == current:
+                continue
+            student_changed = True
+            graded = replayed_block_status(previous_record, idx, corrector.max_attempts)
+            student_manual |= previous != graded
+            rows.append(
+                [
+                    student_folder.name,
+                    idx + 1,
+                    " ".join(f"{v:g}" for v in previous),
+                    " ".join(f"{v:g}" for v in current),
+                    status(previous),
+                    status(current),
+                    " ".join(f"{v:g}" for v in graded) if previous != graded else "",
+                ]
+            )
+
+        if student_manual:
+            manual.append(student_folder.name)
+        if student_changed:
+            changed += 1
+            if write:
+                write_record(student_folder, record, backup)
+
+    # region Report
+    if output is None:
+        output = subject_folder / "_postprocessing" / f"Regrade_{backup}.csv"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", newline="") as c:
+        c.write("sep=,\r\n")
+        csv.writer(c).writerows(rows)
+    # endregion
+
+    log.info(
+        "Results of %s of %s students changed, wrote report to %s",
+        changed,
+        len(students),
+        output,
+    )
+    if manual:
+        log.warning(
+            "Manual changes of %s students %s: %s",
+            len(manual),
+            "were discarded" if write else "would be discarded",
+            ", ".join(manual),
+        )
+
+    if write and changed:
+        post.PostProcessing(subject_folder, exercise_count).run()
+    return changed
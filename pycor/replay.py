@@ -0,0 +1,137 @@
+"""
+Feeds mails from a local Maildir or a folder of .eml files through the regular
+submission pipeline, run via `python -m pycor replay <path>`
+"""
+
+import collections
+import email
+import email.errors
+import email.message
+import itertools
+import logging
+import os
+import tempfile
+import time
+import typing
+from concurrent import futures
+from pathlib import Path
+
+import pycor
+from pycor import mail, metrics
+
+log = logging.getLogger("PyCor").getChild("Replay")
+
+
+def find_mails(source: Path) -> typing.List[Path]:
+    """
+    Returns all mails in a Maildir (new and cur) or all .eml files below source
+    """
+    if (source / "cur").is_dir() or (source / "new").is_dir():
+        return sorted(
+            item
+            for folder in ("new", "cur")
+            if (source / folder).is_dir()
+            for item in (source / folder).iterdir()
+            if item.is_file()
+        )
+    return sorted(source.rglob("*.eml"))
+
+
+def parse(path: Path) -> typing.Optional[email.message.Message]:
+    """
+    Reads and parses a mail, runs in worker processes
+    """
+    try:
+        return email.message_from_bytes(path.read_bytes())
+    except (OSError, email.errors.MessageError):
+        return None
+
+
+def run(
+    source: Path,
+    dry_run: bool = False,
+    workers: typing.Optional[int] = None,
+    chunk_size: int = 100,
+) -> dict:
+    """
+    Processes all mails in source like :meth:`mail.Mail.check_inbox` would, then grades
+    the accepted submissions. Returns a summary which is also logged.
+
+    :param source: Maildir or folder containing .eml files
+    :param dry_run: Don't send any mails, submissions are saved and graded in a
+        temporary folder so neither the student folders nor the charts change
+    :param workers: Parser processes, defaults to the CPU count
+    :param chunk_size: Mails parsed per task, at most workers + 1 chunks are held in memory
+    """
+    metrics.METRICS.start_cycle()
+    start = time.perf_counter()
+
+    valid_filenames = pycor.find_valid_filenames()
+    paths = find_mails(source)
+    log.info("Replaying %s mails from %s", len(paths), source)
+
+    scratch = tempfile.TemporaryDirectory(prefix="pycor-replay-") if dry_run else None
+    mail_instance = mail.Mail(
+        login=False, dry_run=dry_run, scratch=Path(scratch.name) if scratch else None
+    )
+    student_files: typing.List[typing.Dict] = []
+    unreadable = 0
+
+    workers = workers or os.cpu_count() or 1
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep every worker busy while the parsed mails are processed in order
+        chunks = iter(
+            paths[i : i + chunk_size] for i in range(0, len(paths), chunk_size)
+        )
+        pending = collections.deque(
+            executor.submit(_parse_chunk, chunk)
+            for chunk in itertools.islice(chunks, workers + 1)
+        )
+        while pending:
+            messages = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(_parse_chunk, chunk))
+
+            for path, msg in messages:
+                if msg is None:
+                    log.warning("Failed to parse %s", path)
+                    unreadable += 1
+                    continue
+                submission = mail_instance.process_message(
+                    msg, valid_filenames, keep_date=True
+                )
+                if submission:
+                    student_files.append(submission)
+
+    metrics.inc("submissions", len(student_files))
+    graded = pycor.grade_submissions(student_files, mail_instance)
+    mail_instance.logout()
+    if scratch:
+        scratch.cleanup()
+    else:
+        pycor.post_process(graded)
+
+    snapshot = metrics.METRICS.end_cycle()
+    duration = time.perf_counter() - start
+    summary = {
+        "mails": len(paths),
+        "unreadable": unreadable,
+        "accepted": len(student_files),
+        "graded": len(graded),
+        "rejections": {
+            key: value
+            for key, value in snapshot["counters"].items()
+            if key.startswith("rejections")
+        },
+        "duration": round(duration, 2),
+        "mails_per_second": round(len(paths) / duration, 2) if duration else 0,
+        "dry_run": dry_run,
+    }
+    log.info("Replay finished: %s", summary)
+    return summary
+
+
+def _parse_chunk(
+    chunk: typing.List[Path],
+) -> typing.List[typing.Tuple[Path, typing.Optional[email.message.Message]]]:
+    return [(path, parse(path)) for path in chunk]
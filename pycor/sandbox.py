@@ -0,0 +1,176 @@
+import atexit
+import collections
+import itertools
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.pool
+import time
+import typing
+from pathlib import Path
+
+from pycor import config, excel, memory, metrics, utils
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, only the timeout applies there
+    resource = None  # type: ignore
+
+log = logging.getLogger("PyCor").getChild("Sandbox")
+
+ParseResult = typing.Union[excel.Student, excel.ExcelFileException]
+
+
+class ParseTimeoutException(excel.ExcelFileException):
+    pass
+
+
+class ParseFailedException(excel.ExcelFileException):
+    pass
+
+
+def _init_worker(log_queue: "multiprocessing.Queue", memory_limit: int):
+    # Hand records to the main process, the listener only runs there
+    pycor_log = logging.getLogger("PyCor")
+    pycor_log.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+    if resource is not None and memory_limit:
+        limit = (memory.virtual_size() or 0) + memory_limit
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _parse(path: Path, dummy_count: int) -> excel.Student:
+    try:
+        return excel.Student(path, dummy_count)
+    except MemoryError:
+        raise excel.ExcelFileException("Parsing exceeded the memory limit")
+
+
+class ParsePool:
+    """
+    Parses student files in worker processes with a wall-clock timeout per file and,
+    where available, a memory limit. Workers are replaced after PARSE_TASKS_PER_WORKER
+    files and after a timeout.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.timeout = getattr(config, "PARSE_TIMEOUT", 60)
+        self.memory_limit = (getattr(config, "PARSE_MEMORY_LIMIT", 1024) or 0) * 2**20
+        self.tasks_per_worker = getattr(config, "PARSE_TASKS_PER_WORKER", 100)
+
+        self.log_queue: "multiprocessing.Queue" = multiprocessing.Queue()
+        self.log_listener = logging.handlers.QueueListener(
+            self.log_queue,
+            *(utils.LISTENER.handlers if utils.LISTENER else ()),
+            respect_handler_level=True,
+        )
+        self.log_listener.start()
+
+        self.pool: typing.Optional[multiprocessing.pool.Pool] = None
+        self.start()
+
+    def start(self):
+        self.pool = multiprocessing.Pool(
+            self.workers,
+            _init_worker,
+            (self.log_queue, self.memory_limit),
+            maxtasksperchild=self.tasks_per_worker,
+        )
+
+    def restart(self):
+        """
+        Kills all workers, e.g. if one of them is stuck
+        """
+        self.pool.terminate()
+        self.pool.join()
+        metrics.inc("parse_pool_restarts")
+        self.start()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.log_listener.stop()
+
+    def parse_all(
+        self, jobs: typing.Iterable[typing.Tuple[Path, int]]
+    ) -> typing.Iterator[ParseResult]:
+        """
+        Parses (path, dummy_count) jobs ahead of time, at most one per worker, and yields
+        a :class:`excel.Student` or the raised :class:`excel.ExcelFileException` per job
+        in order
+        """
+        jobs = iter(jobs)
+        # (job, result, submitted) per job, the timeout applies from submitting
+        pending: typing.Deque[
+            typing.Tuple[
+                typing.Tuple[Path, int], multiprocessing.pool.AsyncResult, float
+            ]
+        ] = collections.deque()
+
+        def submit(job: typing.Tuple[Path, int]):
+            pending.append((job, self.pool.apply_async(_parse, job), time.monotonic()))
+
+        for job in itertools.islice(jobs, self.workers):
+            submit(job)
+
+        while pending:
+            job, result, submitted = pending.popleft()
+            outcome: ParseResult
+            try:
+                outcome = result.get(
+                    max(self.timeout - (time.monotonic() - submitted), 0)
+                )
+            except multiprocessing.TimeoutError:
+                log.error("Parsing %s took longer than %ss", job[0], self.timeout)
+                metrics.inc("rejections", reason="parse_timeout")
+                outcome = ParseTimeoutException("Parsing took too long")
+
+                # The worker can't be stopped on its own, resubmit the other files
+                self.restart()
+                resubmit = [job for job, _, _ in pending]
+                pending.clear()
+                for job in resubmit:
+                    submit(job)
+            except excel.ExcelFileException as exc:
+                outcome = exc
+            except Exception as exc:
+                # E.g. a worker died or the file crashed openpyxl
+                log.exception("Failed to parse %s", job[0])
+                outcome = ParseFailedException(f"Parsing failed: {exc}")
+
+            for job in itertools.islice(jobs, 1):
+                submit(job)
+            yield outcome
+
+
+# Reused across cycles since starting workers is slow on Windows
+_POOL: typing.Optional[ParsePool] = None
+
+
+def parse_students(
+    jobs: typing.Iterable[typing.Tuple[Path, int]],
+) -> typing.Iterator[ParseResult]:
+    """
+    Yields a :class:`excel.Student` or the raised :class:`excel.ExcelFileException`
+    per (path, dummy_count) job. Parses in worker processes if PARSE_WORKERS is set.
+    """
+    global _POOL
+
+    workers = getattr(config, "PARSE_WORKERS", None)
+    if not workers:
+        for path, dummy_count in jobs:
+            try:
+                yield excel.Student(path, dummy_count)
+            except excel.ExcelFileException as exc:
+                yield exc
+        return
+
+    if _POOL is None:
+        _POOL = ParsePool(workers)
+        atexit.register(_POOL.close)
+    yield from _POOL.parse_all(jobs)
@@ -0,0 +1,181 @@
+import collections
+import datetime
+import logging
+import threading
+import time
+import typing
+
+from pycor import config
+
+
+class CycleResult(typing.NamedTuple):
+    # Amount of accepted submissions
+    submissions: int = 0
+    # Whether the cycle stopped early due to MAX_SUBMISSIONS_PER_CYCLE and the
+    # remaining mails are still unseen
+    truncated: bool = False
+    # Deadlines of all registered correctors
+    deadlines: typing.Tuple[datetime.datetime, ...] = ()
+
+
+def deadline_end(deadline: datetime.datetime) -> datetime.datetime:
+    """
+    Submissions are accepted until the end of the deadline's day
+    """
+    return datetime.datetime.combine(deadline.date(), datetime.time.max)
+
+
+def order_submissions(
+    student_files: typing.List[typing.Dict],
+) -> typing.List[typing.Dict]:
+    """
+    Groups submissions into one queue per corrector and orders the queues by deadline
+    proximity and arrival time. Queues are processed in slices of QUEUE_SLICE
+    submissions so one huge cohort can't starve the others, consecutive submissions
+    of a slice share a corrector so its Excel instance stays open.
+
+    :param student_files: Dicts as returned by :meth:`pycor.mail.Mail.check_inbox`
+    """
+    queues: typing.Dict[typing.Any, typing.List[typing.Dict]] = {}
+    for sf in student_files:
+        queues.setdefault(sf["corrector"], []).append(sf)
+
+    for queue in queues.values():
+        queue.sort(key=lambda sf: sf["received"])
+
+    ordered = sorted(
+        queues.values(),
+        key=lambda queue: (
+            deadline_end(queue[0]["corrector"].deadline),
+            queue[0]["received"],
+        ),
+    )
+
+    queue_slice = getattr(config, "QUEUE_SLICE", None) or len(student_files)
+    ret: typing.List[typing.Dict] = []
+    while any(ordered):
+        for queue in ordered:
+            ret.extend(queue[:queue_slice])
+            del queue[:queue_slice]
+    return ret
+
+
+def coalesce(
+    student_files: typing.List[typing.Dict], window: float
+) -> typing.Tuple[typing.List[typing.Dict], typing.List[typing.Dict]]:
+    """
+    Collapses submissions from the same student for the same corrector which arrived
+    within window seconds before a newer one. Returns the kept and superseded ones.
+
+    :param student_files: Dicts as returned by :meth:`pycor.mail.Mail.check_inbox`
+    :param window: Seconds
+    """
+    groups: typing.Dict[typing.Tuple[str, typing.Any], typing.List[typing.Dict]] = {}
+    for sf in student_files:
+        groups.setdefault((sf["student"].parent.name, sf["corrector"]), []).append(sf)
+
+    kept: typing.List[typing.Dict] = []
+    superseded: typing.List[typing.Dict] = []
+    for group in groups.values():
+        group.sort(key=lambda sf: sf["received"], reverse=True)
+        newest = group[0]
+        kept.append(newest)
+        for sf in group[1:]:
+            if newest["received"] - sf["received"] <= window:
+                superseded.append(sf)
+            else:
+                # Older submission outside the window, start a new burst
+                newest = sf
+                kept.append(newest)
+    return kept, superseded
+
+
+def aligned_delay(now: datetime.datetime) -> float:
+    """
+    Seconds until a multiple of DELAY_SLEEP is on the clock
+    """
+    return abs(now.minute % config.DELAY_SLEEP - config.DELAY_SLEEP) * 60 - now.second
+
+
+class PollScheduler:
+    """
+    Picks the next poll time based on recent arrival rates and upcoming deadlines.
+    Polls every POLL_MIN_INTERVAL seconds within POLL_DEADLINE_WINDOW hours before a
+    deadline and backs off up to POLL_IDLE_INTERVAL minutes while the inbox is empty.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger("PyCor").getChild("Scheduler")
+
+        self.min_interval = getattr(config, "POLL_MIN_INTERVAL", 15)
+        self.base_interval = config.DELAY_SLEEP * 60
+        self.idle_interval = max(
+            getattr(config, "POLL_IDLE_INTERVAL", 30) * 60, self.base_interval
+        )
+        self.deadline_window = datetime.timedelta(
+            hours=getattr(config, "POLL_DEADLINE_WINDOW", 6)
+        )
+        # Submissions per cycle we aim for when mails are coming in steadily
+        self.target_batch = getattr(config, "POLL_TARGET_BATCH", 10)
+
+        # (timestamp, submissions) of the cycles in the last hour
+        self.arrivals: typing.Deque[typing.Tuple[float, int]] = collections.deque()
+        self.empty_cycles = 0
+
+    def rate(self, now: float) -> float:
+        """
+        Submissions per second over the last hour
+        """
+        while self.arrivals and now - self.arrivals[0][0] > 3600:
+            self.arrivals.popleft()
+        if len(self.arrivals) < 2:
+            return 0.0
+        span = max(now - self.arrivals[0][0], self.min_interval)
+        return sum(count for _, count in self.arrivals) / span
+
+    def next_delay(self, result: CycleResult) -> float:
+        """
+        Records the finished cycle and returns the seconds to sleep before the next one
+        """
+        now = time.time()
+        self.arrivals.append((now, result.submissions))
+        self.empty_cycles = 0 if result.submissions else self.empty_cycles + 1
+
+        if result.truncated:
+            self.log.info("Previous cycle was truncated, continuing immediately")
+            return 0
+
+        current = datetime.datetime.now()
+        upcoming = [deadline_end(deadline) for deadline in result.deadlines]
+        upcoming = [deadline for deadline in upcoming if deadline >= current]
+        if upcoming and min(upcoming) - current <= self.deadline_window:
+            self.log.debug("Deadline %s is close", min(upcoming))
+            return self.min_interval
+
+        rate = self.rate(now)
+        if rate > 0 and self.empty_cycles == 0:
+            return min(
+                max(self.target_batch / rate, self.min_interval), self.base_interval
+            )
+
+        # Back off exponentially while idle
+        return min(
+            self.base_interval * 2 ** max(self.empty_cycles - 1, 0), self.idle_interval
+        )
+
+
+# Set when submissions arrive outside of IMAP, cuts the current pause short
+_wake = threading.Event()
+
+
+def wake():
+    _wake.set()
+
+
+def sleep(seconds: float) -> bool:
+    """
+    Pauses until the next cycle is due, returns whether it was cut short by :func:`wake`
+    """
+    woken = _wake.wait(seconds)
+    _wake.clear()
+    return woken
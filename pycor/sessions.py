@@ -0,0 +1,318 @@
+"""
+Long-lived IMAP and SMTP sessions owned by the daemon. Each cycle reuses the logged in
+sessions, a NOOP checks them before use and dead connections are replaced
+transparently. Reconnecting SMTP sessions resume the previous TLS session.
+"""
+
+import atexit
+import imaplib
+import logging
+import smtplib
+import ssl
+import threading
+import time
+import typing
+
+from pycor import config, metrics
+
+log = logging.getLogger("PyCor").getChild("Sessions")
+
+
+def _shutdown(connection: imaplib.IMAP4):
+    try:
+        connection.shutdown()
+    except OSError:
+        pass
+
+
+class ImapSession:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        use_ssl: bool,
+        username: str,
+        password: str,
+        mailbox: str = "INBOX",
+    ):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.mailbox = mailbox
+
+        self.connection: typing.Optional[imaplib.IMAP4] = None
+        # Guards the connection, the keepalive runs in a background thread
+        self.lock = threading.RLock()
+        self.last_used = 0.0
+
+        self.keepalive_interval = getattr(config, "MAIL_IMAP_KEEPALIVE", 5 * 60)
+        self.stopped = threading.Event()
+        self.keepalive: typing.Optional[threading.Thread] = None
+
+    def connect(self):
+        """
+        Opens the connection, logs in and selects the mailbox
+        """
+        with metrics.timer("imap_login"):
+            if self.use_ssl:
+                connection: imaplib.IMAP4 = imaplib.IMAP4_SSL(self.host, self.port)
+            else:
+                connection = imaplib.IMAP4(self.host, self.port)
+            try:
+                connection.login(self.username, self.password)
+                connection.select(self.mailbox)
+            except imaplib.IMAP4.error:
+                _shutdown(connection)
+                raise
+        metrics.inc("imap_logins")
+
+        self.connection = connection
+        self.last_used = time.monotonic()
+        log.info("%s - Logged in to %s", self.username, self.host)
+
+        if self.keepalive_interval and self.keepalive is None:
+            self.keepalive = threading.Thread(
+                target=self.keep_alive, name=f"imap-{self.username}", daemon=True
+            )
+            self.keepalive.start()
+
+    def disconnect(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.logout()
+        except (imaplib.IMAP4.error, OSError):
+            # The connection is most likely dead already
+            _shutdown(self.connection)
+        self.connection = None
+
+    def reconnect(self):
+        log.info("%s - Reconnecting to %s", self.username, self.host)
+        metrics.inc("imap_reconnects")
+        self.disconnect()
+        self.connect()
+
+    def ensure(self):
+        """
+        Connects or verifies the existing connection with a NOOP, reconnects if it died
+        """
+        with self.lock:
+            if self.connection is None:
+                self.connect()
+                return
+            try:
+                self.connection.noop()
+                self.last_used = time.monotonic()
+            except (imaplib.IMAP4.abort, OSError):
+                self.reconnect()
+
+    def run(self, command: str, *args) -> typing.Tuple[str, typing.List]:
+        """
+        Runs an IMAP command, retries it once on a new connection if the old one died
+        """
+        with self.lock:
+            if self.connection is None:
+                self.connect()
+            try:
+                ret = getattr(self.connection, command)(*args)
+            except (imaplib.IMAP4.abort, OSError):
+                metrics.inc("mail_retries", kind=f"imap_{command}")
+                self.reconnect()
+                ret = getattr(self.connection, command)(*args)
+            self.last_used = time.monotonic()
+            return ret
+
+    def uid(self, *args) -> typing.Tuple[str, typing.List]:
+        return self.run("uid", *args)
+
+    def search(self, *args) -> typing.Tuple[str, typing.List]:
+        return self.run("search", *args)
+
+    def fetch(self, *args) -> typing.Tuple[str, typing.List]:
+        return self.run("fetch", *args)
+
+    def append(self, *args) -> typing.Tuple[str, typing.List]:
+        return self.run("append", *args)
+
+    def keep_alive(self):
+        while not self.stopped.wait(self.keepalive_interval / 4):
+            with self.lock:
+                if (
+                    self.connection is None
+                    or time.monotonic() - self.last_used < self.keepalive_interval
+                ):
+                    continue
+                try:
+                    self.connection.noop()
+                    self.last_used = time.monotonic()
+                except (imaplib.IMAP4.error, OSError):
+                    # Replaced by the next command
+                    log.info("%s - Connection to %s died", self.username, self.host)
+                    _shutdown(self.connection)
+                    self.connection = None
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.disconnect()
+
+
+# (host, port, username) as key, kept across cycles
+_SESSIONS: typing.Dict[typing.Tuple[str, int, str], ImapSession] = {}
+
+
+def imap(
+    host: str,
+    username: str,
+    password: str,
+    port: typing.Optional[int] = None,
+    use_ssl: bool = True,
+) -> ImapSession:
+    """
+    Returns the connected session of the account, created on first use
+    """
+    if port is None:
+        port = imaplib.IMAP4_SSL_PORT if use_ssl else imaplib.IMAP4_PORT
+
+    key = (host, port, username)
+    if key not in _SESSIONS:
+        _SESSIONS[key] = ImapSession(host, port, use_ssl, username, password)
+
+    session = _SESSIONS[key]
+    session.ensure()
+    return session
+
+
+# region SMTP
+# Idle sessions are checked with a NOOP before sending
+SMTP_CHECK_AFTER = 30
+
+# Unverified like smtplib's default, shared so TLS sessions can be resumed
+_TLS_CONTEXT = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+_TLS_CONTEXT.check_hostname = False
+_TLS_CONTEXT.verify_mode = ssl.CERT_NONE
+# Last negotiated TLS session, offered by every new connection
+_tls_session: typing.Optional[ssl.SSLSession] = None
+
+
+class _ResumingContext:
+    """
+    Passed to :meth:`smtplib.SMTP.starttls`, which has no way to resume a session
+    """
+
+    def __init__(self, session: typing.Optional[ssl.SSLSession]):
+        self.session = session
+
+    def wrap_socket(self, sock, server_hostname=None):
+        return _TLS_CONTEXT.wrap_socket(
+            sock, server_hostname=server_hostname, session=self.session
+        )
+
+
+class SmtpSession:
+    def __init__(self):
+        self.smtp: typing.Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+
+    def connect(self):
+        """
+        Opens the connection, negotiates TLS and logs in
+        """
+        global _tls_session
+
+        start = time.perf_counter()
+        smtp = smtplib.SMTP(
+            config.MAIL_SMTP, getattr(config, "MAIL_SMTP_PORT", 587), timeout=60
+        )
+        try:
+            smtp.ehlo()
+            resumed = False
+            if getattr(config, "MAIL_SMTP_STARTTLS", True):
+                smtp.starttls(context=_ResumingContext(_tls_session))
+                resumed = smtp.sock.session_reused
+            smtp.login(config.MAIL_USER, config.MAIL_PASS)
+            if isinstance(smtp.sock, ssl.SSLSocket):
+                # TLS 1.3 tickets arrive after the handshake, i.e. with a reply
+                _tls_session = smtp.sock.session
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+            raise
+
+        metrics.METRICS.observe("smtp_handshake", time.perf_counter() - start)
+        metrics.inc("smtp_handshakes", resumed=resumed)
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+
+    def disconnect(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            # Ignore disconnect, that's kinda what we want to do anyway
+            self.smtp.close()
+        self.smtp = None
+
+    def ensure(self) -> smtplib.SMTP:
+        """
+        Returns the connection, checks it with a NOOP if it was idle and reconnects
+        if it died
+        """
+        if self.smtp is not None and time.monotonic() - self.last_used > (
+            SMTP_CHECK_AFTER
+        ):
+            try:
+                alive = self.smtp.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                alive = False
+            metrics.inc("smtp_health_checks", alive=alive)
+            if not alive:
+                self.smtp.close()
+                self.smtp = None
+
+        if self.smtp is None:
+            self.connect()
+        self.last_used = time.monotonic()
+        return self.smtp
+
+
+# Idle SMTP sessions, reused by the next delivery
+_SMTP_POOL: typing.List[SmtpSession] = []
+_smtp_lock = threading.Lock()
+
+
+def smtp() -> SmtpSession:
+    """
+    Returns an idle SMTP session or a new one, connected on first use
+    """
+    with _smtp_lock:
+        if _SMTP_POOL:
+            return _SMTP_POOL.pop()
+    return SmtpSession()
+
+
+def release(session: SmtpSession):
+    """
+    Keeps the session for the next delivery
+    """
+    with _smtp_lock:
+        _SMTP_POOL.append(session)
+
+
+# endregion
+
+
+def close_all():
+    for session in _SESSIONS.values():
+        session.close()
+    _SESSIONS.clear()
+
+    with _smtp_lock:
+        for smtp_session in _SMTP_POOL:
+            smtp_session.disconnect()
+        _SMTP_POOL.clear()
+
+
+atexit.register(close_all)
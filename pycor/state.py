@@ -1,9 +1,14 @@
 import datetime
+import logging
 import typing
 from pathlib import Path
 
 from pydantic import BaseModel  # type: ignore
 
+from pycor import utils
+
+log = logging.getLogger("PyCor").getChild("State")
+
 
 class CorrectorDict(BaseModel):
     codename: str
@@ -14,23 +19,80 @@ class CorrectorDict(BaseModel):
     title: str
     change_date: datetime.datetime
     dummy_count: int = 8
+    # Content hash, recognizes an unchanged corrector whose mtime changed
+    digest: str = ""
 
 
-class State(BaseModel):
+class LegacyState(BaseModel):
     correctors: typing.Dict[str, CorrectorDict] = {}  # relevant path, dict
 
-    def save(self):
-        cf = Path("state.json")
-        try:
-            cf.write_text(self.json(sort_keys=True, indent=4))
-        except OSError:
-            print("Failed to write state file")
-            raise
+
+class State:
+    """
+    Corrector state, sharded into one file per corrector. Shards are loaded on first
+    access and changed ones are written atomically by :meth:`flush`.
+    """
+
+    def __init__(self, folder: Path = Path("state")):
+        self.folder = folder
+        # Relevant path as key, None if there's no (valid) shard
+        self.correctors: typing.Dict[str, typing.Optional[CorrectorDict]] = {}
+        self.dirty: typing.Set[str] = set()
+
+    def shard(self, key: str) -> Path:
+        return self.folder / f"{key}.json"
+
+    def get(self, key: str) -> typing.Optional[CorrectorDict]:
+        if key not in self.correctors:
+            shard = self.shard(key)
+            try:
+                self.correctors[key] = (
+                    CorrectorDict.parse_file(shard) if shard.exists() else None
+                )
+            except (OSError, ValueError):
+                log.warning("Ignoring invalid state file %s", shard)
+                self.correctors[key] = None
+        return self.correctors[key]
+
+    def set(self, key: str, corrector: CorrectorDict):
+        self.correctors[key] = corrector
+        self.dirty.add(key)
+
+    def flush(self):
+        """
+        Writes all changed shards, call once per cycle
+        """
+        if not self.dirty:
+            return
+        self.folder.mkdir(exist_ok=True)
+        for key in sorted(self.dirty):
+            corrector = self.correctors[key]
+            if corrector is None:
+                continue
+            try:
+                utils.write_atomic(
+                    self.shard(key), corrector.json(sort_keys=True, indent=4)
+                )
+            except OSError:
+                log.exception("Failed to write state file")
+                raise
+        self.dirty.clear()
+
+    def migrate(self, legacy_file: Path):
+        """
+        Splits the former global state file into shards
+        """
+        if not legacy_file.exists():
+            return
+        for key, corrector in LegacyState.parse_file(legacy_file).correctors.items():
+            if not self.shard(key).exists():
+                self.set(key, corrector)
+        self.flush()
+        legacy_file.replace(legacy_file.with_name(f"{legacy_file.name}.migrated"))
+        log.info("Migrated %s to %s", legacy_file, self.folder)
 
     @staticmethod
     def load():
-        cf = Path("state.json")
-        if cf.exists():
-            return State.parse_file(cf)
-        else:
-            return State()
+        state = State()
+        state.migrate(Path("state.json"))
+        return state
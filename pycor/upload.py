@@ -0,0 +1,312 @@
+"""
+Optional local HTTP endpoint accepting submissions without the round trip through the
+mail server. Uploads are saved like attachments, wake up the daemon and are graded in
+its next cycle. The result is returned right away if grading finishes within
+UPLOAD_WAIT seconds, otherwise it can be polled.
+"""
+
+import email.parser
+import email.policy
+import hmac
+import http.server
+import json
+import logging
+import threading
+import time
+import typing
+import uuid
+from urllib import parse
+
+from pydantic import BaseModel  # type: ignore
+
+from pycor import config, excel, journal, mail, metrics, scheduler
+
+QUEUED = "queued"
+GRADED = "graded"
+REJECTED = "rejected"
+
+# Seconds finished uploads can be polled
+RETENTION = 60 * 60
+
+log = logging.getLogger("PyCor").getChild("Upload")
+
+
+class UploadException(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Reply(BaseModel):
+    subject: str
+    content: str
+
+
+class Upload(BaseModel):
+    id: str
+    status: str = QUEUED
+    student: str
+    codename: str
+    received: float
+    finished: typing.Optional[float] = None
+    # Percentage per exercise [beginning at 1]
+    results: typing.Dict[int, int] = {}
+    # Same content as the mails sent to the student
+    replies: typing.List[Reply] = []
+
+
+# Upload id (the id of its journal entry) as key
+_UPLOADS: typing.Dict[str, Upload] = {}
+# Saved submissions waiting for the next cycle
+_QUEUE: typing.List[typing.Dict] = []
+# Guards both, notified whenever an upload is finished
+_cond = threading.Condition()
+
+# Codenames of the last cycle, used to reject unknown files right away
+_valid_filenames: typing.Dict[str, excel.Corrector] = {}
+
+
+def register(valid_filenames: typing.Dict[str, excel.Corrector]):
+    global _valid_filenames
+    _valid_filenames = valid_filenames
+
+
+def submit(student_email: str, file_name: str, content: bytes) -> Upload:
+    """
+    Saves an uploaded file and queues it for the next cycle
+
+    :raises UploadException: If the upload is rejected
+    """
+    if not mail.ADDRESS.match(student_email):
+        raise UploadException(400, "Malformed address")
+    if not mail.accepted_address(student_email):
+        raise UploadException(403, "Address is not accepted")
+
+    corrector = mail.find_corrector(file_name, _valid_filenames)
+    if corrector is None:
+        raise UploadException(404, f"Unknown file name {file_name}")
+
+    received = time.time()
+    with metrics.timer("attachment_save"):
+        student_file = mail.save_submission(content, student_email, corrector, received)
+    if student_file is None:
+        raise UploadException(500, "Failed to save file")
+
+    submission = {
+        "student": student_file,
+        "corrector": corrector,
+        "received": received,
+    }
+    with _cond:
+        # Registered before the journal entry is visible, see :func:`owns`
+        entry = journal.Entry(id=uuid.uuid4().hex)
+        upload = Upload(
+            id=entry.id,
+            student=student_email,
+            codename=corrector.codename.lower(),
+            received=received,
+        )
+        _prune()
+        _UPLOADS[upload.id] = upload
+        journal.saved(entry, submission)
+
+        submission["journal"] = entry
+        submission["upload"] = entry.id
+        _QUEUE.append(submission)
+    scheduler.wake()
+
+    log.info("Accepted uploaded file from %s", student_email)
+    metrics.inc("uploads")
+    return upload
+
+
+def _prune():
+    now = time.time()
+    for upload in list(_UPLOADS.values()):
+        if upload.finished and now - upload.finished > RETENTION:
+            del _UPLOADS[upload.id]
+
+
+def owns(upload_id: str) -> bool:
+    """
+    Whether the journal entry belongs to an upload which wasn't graded yet
+    """
+    with _cond:
+        upload = _UPLOADS.get(upload_id)
+        return upload is not None and upload.status == QUEUED
+
+
+def get(upload_id: str) -> typing.Optional[Upload]:
+    with _cond:
+        return _UPLOADS.get(upload_id)
+
+
+def wait(upload_id: str, timeout: float) -> Upload:
+    """
+    Waits up to timeout seconds for the upload to be graded
+    """
+    with _cond:
+        upload = _UPLOADS[upload_id]
+        _cond.wait_for(lambda: upload.status != QUEUED, timeout)
+        return upload
+
+
+def pending(
+    valid_filenames: typing.Dict[str, excel.Corrector],
+) -> typing.List[typing.Dict]:
+    """
+    Returns the uploaded submissions to grade in this cycle
+    """
+    with _cond:
+        submissions = _QUEUE[:]
+        _QUEUE.clear()
+
+    ret = []
+    for submission in submissions:
+        entry: journal.Entry = submission["journal"]
+        corrector = valid_filenames.get(entry.codename or "")
+        if corrector is None:
+            # Corrector disappeared since the upload
+            log.warning("Can't grade %s, discarding", submission["student"])
+            journal.discard(entry)
+            finished(submission, entry)
+            continue
+        submission["corrector"] = corrector
+        ret.append(submission)
+    return ret
+
+
+def finished(submission: typing.Dict, entry: journal.Entry):
+    """
+    Stores the result of a graded submission if it was uploaded
+    """
+    upload_id = submission.get("upload")
+    if upload_id is None:
+        return
+
+    with _cond:
+        upload = _UPLOADS.get(upload_id)
+        if upload is None:
+            return
+        upload.results = {exercise + 1: perc for exercise, perc in entry.attempts}
+        upload.replies = [
+            Reply(subject=outgoing.subject, content=outgoing.content)
+            for outgoing in entry.outbox
+        ]
+        upload.status = GRADED if entry.attempts else REJECTED
+        upload.finished = time.time()
+        _cond.notify_all()
+
+
+def parse_form(
+    content_type: str, body: bytes
+) -> typing.Dict[str, email.message.Message]:
+    """
+    Splits a multipart/form-data body into its parts, field names as key
+    """
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    if not msg.is_multipart():
+        return {}
+    return {
+        part.get_param("name", header="content-disposition"): part
+        for part in msg.iter_parts()
+    }
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def respond(
+        self, status: int, body: typing.Dict, location: typing.Optional[str] = None
+    ):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if location:
+            self.send_header("Location", location)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def respond_upload(self, upload: Upload):
+        if upload.status == QUEUED:
+            location = f"/submissions/{upload.id}"
+            self.respond(202, json.loads(upload.json()), location)
+        else:
+            self.respond(200, json.loads(upload.json()))
+
+    def authorized(self) -> bool:
+        token = getattr(config, "UPLOAD_TOKEN", None)
+        if token and hmac.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return True
+        self.respond(401, {"error": "Unauthorized"})
+        return False
+
+    def do_GET(self):
+        url = parse.urlsplit(self.path)
+        prefix, _, upload_id = url.path.rstrip("/").rpartition("/")
+        if prefix != "/submissions":
+            self.send_error(404)
+            return
+        if not self.authorized():
+            return
+
+        upload = get(upload_id)
+        if upload is None:
+            self.respond(404, {"error": "Unknown submission"})
+            return
+        self.respond_upload(upload)
+
+    def do_POST(self):
+        url = parse.urlsplit(self.path)
+        if url.path.rstrip("/") != "/submissions":
+            self.send_error(404)
+            return
+        if not self.authorized():
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > getattr(config, "MAX_FILE_SIZE", 10) * 1024 * 1024 + 64 * 1024:
+            self.respond(413, {"error": "File too large"})
+            return
+
+        form = parse_form(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        if "email" not in form or "file" not in form:
+            self.respond(400, {"error": "Expected the fields email and file"})
+            return
+
+        try:
+            upload = submit(
+                form["email"].get_content().strip(),
+                form["file"].get_filename() or "",
+                form["file"].get_payload(decode=True) or b"",
+            )
+        except UploadException as exc:
+            metrics.inc("rejections", reason=f"upload_{exc.status}")
+            self.respond(exc.status, {"error": str(exc)})
+            return
+
+        # ?wait=0 skips waiting for the result
+        timeout = getattr(config, "UPLOAD_WAIT", 30)
+        query = parse.parse_qs(url.query)
+        if "wait" in query:
+            try:
+                timeout = min(float(query["wait"][0]), timeout)
+            except ValueError:
+                pass
+        self.respond_upload(wait(upload.id, timeout))
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def serve(port: int) -> http.server.HTTPServer:
+    """
+    Accepts submissions on http://localhost:{port}/submissions in a background thread
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info("Accepting submissions on http://127.0.0.1:%s/submissions", port)
+    return server
@@ -1,18 +1,92 @@
+import atexit
 import datetime
 import logging
 import logging.handlers
+import multiprocessing
+import os
+import queue
 import random
 import string
 import sys
+import threading
+import time
 import traceback
+import typing
 from pathlib import Path
 
 import sentry_sdk  # type: ignore
 
-from pycor import config
+from pycor import config, metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+# Writes queued records to file and console in a background thread
+LISTENER: typing.Optional[logging.handlers.QueueListener] = None
+
+# Held until the process exits, see :func:`acquire_lock`
+_LOCK: typing.Optional[typing.IO] = None
+
+# Folder in the student's folder for submissions that are kept but never graded
+SUPERSEDED_FOLDER = "superseded"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `limit` debug records per second through for each logging function,
+    `site_limits` overrides the limit per function (e.g. {"PyCor:compare": 5}).
+    Dropped records are counted in the log_records_dropped metric.
+    """
+
+    def __init__(
+        self,
+        limit: typing.Optional[int],
+        site_limits: typing.Optional[typing.Dict[str, typing.Optional[int]]] = None,
+    ):
+        super().__init__()
+        self.limit = limit
+        self.site_limits = site_limits or {}
+        # Site as key, [window start, records] as value
+        self.windows: typing.Dict[str, typing.List[float]] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        site = f"{record.name}:{record.funcName}"
+        limit = self.site_limits.get(site, self.limit)
+        if limit is None:
+            return True
+
+        with self.lock:
+            window = self.windows.setdefault(site, [record.created, 0])
+            if record.created - window[0] >= 1:
+                window[0], window[1] = record.created, 0
+            window[1] += 1
+            if window[1] <= limit:
+                return True
+        metrics.inc("log_records_dropped", site=site)
+        return False
 
 
 def setup_logger(level=logging.DEBUG):
+    """
+    Logs to logs/PyCor.log and stdout. Records are only queued on the calling thread,
+    a :class:`logging.handlers.QueueListener` formats and writes them.
+
+    Worker processes spawned on Windows import pycor as well, they neither log to the
+    file nor install the crash handler.
+    """
+    global LISTENER
+
+    if multiprocessing.current_process().name != "MainProcess":
+        return logging.getLogger("PyCor")
+
     # Create logs folder
     if not Path("logs").exists():
         Path("logs").mkdir()
@@ -27,6 +101,7 @@ def setup_logger(level=logging.DEBUG):
             sys.__excepthook__(exc_type, value, tb)
             return
         log.critical("Uncaught exception", exc_info=(exc_type, value, tb))
+        stop_logger()
         input("Press return to exit.")
         sys.exit(1)
 
@@ -37,16 +112,40 @@ def setup_logger(level=logging.DEBUG):
     )
     hldr.setFormatter(fmt)
     hldr.setLevel(logging.DEBUG)
-    log.addHandler(hldr)
 
     stream = logging.StreamHandler(sys.stdout)
     stream.setFormatter(fmt)
     stream.setLevel(level)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    site_limits = getattr(config, "LOG_DEBUG_SITE_LIMITS", None)
+    limit = getattr(config, "LOG_DEBUG_RATE_LIMIT", None)
+    if limit is not None or site_limits:
+        queue_handler.addFilter(RateLimitFilter(limit, site_limits))
     log.setLevel(logging.DEBUG)
-    log.addHandler(stream)
+    log.addHandler(queue_handler)
+
+    LISTENER = logging.handlers.QueueListener(
+        log_queue, hldr, stream, respect_handler_level=True
+    )
+    LISTENER.start()
+    atexit.register(stop_logger)
     return log
 
 
+def stop_logger():
+    """
+    Writes all queued records and stops the background thread, call before exiting
+    without running atexit handlers
+    """
+    global LISTENER
+
+    if LISTENER is not None:
+        LISTENER.stop()
+        LISTENER = None
+
+
 def write_ignore(subject_folder: Path, message: str):
     with (subject_folder / "PYCOR_IGNORE.txt").open("a") as e:
         e.write(message)
@@ -80,6 +179,29 @@ def write_error(subject_folder: Path, message: str):
     )
 
 
+def write_atomic(target: Path, content: str):
+    """
+    Writes to a temporary file first and replaces target with it, so readers and
+    crashes never see a partially written file
+    """
+    tmp_file = target.with_name(f"{target.name}.tmp")
+    tmp_file.write_text(content, encoding="utf-8")
+    os.replace(tmp_file, target)
+
+
+def archive_submission(student_file: Path) -> Path:
+    """
+    Moves a submitted file into the student's `superseded` folder so it's kept but
+    never graded
+
+    :param student_file: Path to the submitted file
+    :return: New path of the file
+    """
+    archive = student_file.parent / SUPERSEDED_FOLDER
+    archive.mkdir(exist_ok=True)
+    return student_file.replace(archive / student_file.name)
+
+
 def setup_sentry(release):
     if config.DISABLE_OUTGOING_MAIL:
         environment = "dev"
@@ -105,3 +227,30 @@ def setup_sentry(release):
 
 def random_string():
     return "".join(random.choices(string.digits + string.ascii_letters, k=6))
+
+
+def acquire_lock(lock_file: Path = Path("pycor.lock"), wait: float = 0) -> bool:
+    """
+    Locks the working directory until the process exits, returns False if another
+    process (e.g. the daemon) holds the lock. Released by the OS even after a crash.
+
+    :param wait: Seconds to retry for, e.g. until a restarted daemon's predecessor exited
+    """
+    global _LOCK
+
+    deadline = time.monotonic() + wait
+    handle = lock_file.open("a")
+    while True:
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if time.monotonic() < deadline:
+                time.sleep(0.5)
+                continue
+            handle.close()
+            return False
+        _LOCK = handle
+        return True